@@ -2,34 +2,199 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import StringIO
+import bisect
+import collections
+import contextlib
+import copy
+import errno
+import fcntl
+import functools
+import inspect
+import itertools
+import json
 import os
 import posixpath
 import re
+import select
 import subprocess
+import tarfile
 import tempfile
+import threading
 import time
 import traceback
+import uuid
 
 from abc import ABCMeta, abstractmethod
 
 
+def _select(fds, timeout):
+    """select() for readability, restarting if interrupted by a signal."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return select.select(fds, [], [], max(timeout, 0))[0]
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            timeout = deadline - time.time()
+
+
+class ProcessWaiter(object):
+    """ProcessWaiter reaps a subprocess in a helper thread which blocks
+    in proc.wait() and then signals the process' exit by writing to a
+    pipe. The read end of the pipe, fd, can be passed to select() along
+    with any other file descriptors so that the caller is woken as
+    soon as the process exits rather than on the next polling
+    interval.
+    """
+    def __init__(self, proc):
+        self.proc = proc
+        self.fd, self._write_fd = os.pipe()
+        self._thread = threading.Thread(target=self._wait,
+                                        name='ADBProcessWaiter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _wait(self):
+        try:
+            self.proc.wait()
+        finally:
+            os.write(self._write_fd, 'x')
+
+    def close(self, kill=False):
+        """Waits for the helper thread to reap the process, killing the
+        process first if kill is True.
+        """
+        if kill:
+            try:
+                self.proc.kill()
+            except OSError:
+                pass
+        # Only the helper thread reaps the process.
+        self._thread.join()
+        os.close(self.fd)
+        os.close(self._write_fd)
+
+
+def wait_for_process(proc, timeout):
+    """Waits for the subprocess proc to exit without polling.
+
+    :param proc: subprocess.Popen object.
+    :param timeout: The maximum time in seconds to wait.
+    :returns: boolean - True if the process exited, False if the
+        timeout expired in which case the process has been killed.
+    """
+    if proc.poll() is not None:
+        return True
+    waiter = ProcessWaiter(proc)
+    exited = False
+    try:
+        exited = bool(_select([waiter.fd], timeout))
+    finally:
+        waiter.close(kill=not exited)
+    return exited
+
+
 class ADBProcess(object):
-    """ADBProcess encapsulates the data related to executing the adb process."""
-    def __init__(self, args):
+    """ADBProcess encapsulates the data related to executing the adb process.
+
+    By default stdout and stderr are written directly to temporary
+    files. If max_buffer_size is non-zero, the output is instead read
+    from pipes into memory buffers which are spilled to temporary
+    files only when they grow beyond max_buffer_size bytes, and the
+    last TAIL_SIZE bytes of stdout are retained in stdout_tail so
+    that the exit code of a shell command can be extracted without
+    rereading the file.
+    """
+    TAIL_SIZE = 256
+
+    def __init__(self, args, max_buffer_size=0):
         #: command argument argument list.
         self.args = args
-        #: Temporary file handle to be used for stdout.
-        self.stdout_file = tempfile.TemporaryFile()
-        #: Temporary file handle to be used for stderr.
-        self.stderr_file = tempfile.TemporaryFile()
         #: boolean indicating if the command timed out.
         self.timedout = None
         #: exitcode of the process.
         self.exitcode = None
+        #: The end of stdout if it is being captured in memory.
+        self.stdout_tail = None
+        if max_buffer_size:
+            #: File like object containing stdout.
+            self.stdout_file = tempfile.SpooledTemporaryFile(
+                max_size=max_buffer_size)
+            #: File like object containing stderr.
+            self.stderr_file = tempfile.SpooledTemporaryFile(
+                max_size=max_buffer_size)
+            self.stdout_tail = ''
+            stdout = stderr = subprocess.PIPE
+        else:
+            self.stdout_file = tempfile.TemporaryFile()
+            self.stderr_file = tempfile.TemporaryFile()
+            stdout = self.stdout_file
+            stderr = self.stderr_file
         #: subprocess Process object used to execute the command.
-        self.proc = subprocess.Popen(args,
-                                     stdout=self.stdout_file,
-                                     stderr=self.stderr_file)
+        self.proc = subprocess.Popen(args, stdout=stdout, stderr=stderr)
+
+    def wait(self, timeout):
+        """Waits for the adb process to exit. If it does not exit
+        within timeout seconds it is killed and timedout is set.
+
+        :param timeout: The maximum time in seconds to wait.
+        :returns: exit code of the process.
+        """
+        if self.stdout_tail is None:
+            exited = wait_for_process(self.proc, timeout)
+        else:
+            exited = self._capture_output(timeout)
+        if not exited:
+            self.timedout = True
+        return self.proc.returncode
+
+    def _capture_output(self, timeout):
+        """Reads stdout and stderr of the process into the buffers until
+        the process exits or the timeout expires. Once the process has
+        exited, only output which is already available is read since
+        the pipes may have been inherited by a process which outlives
+        adb, such as a newly started adb server.
+        """
+        deadline = time.time() + timeout
+        buffers = {self.proc.stdout.fileno(): self.stdout_file,
+                   self.proc.stderr.fileno(): self.stderr_file}
+        stdout_fd = self.proc.stdout.fileno()
+        waiter = ProcessWaiter(self.proc)
+        exited = False
+        try:
+            while buffers:
+                if exited:
+                    ready = _select(buffers.keys(), 0)
+                    if not ready:
+                        break
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    ready = _select(buffers.keys() + [waiter.fd], remaining)
+                    if waiter.fd in ready:
+                        exited = True
+                        ready.remove(waiter.fd)
+                for fd in ready:
+                    data = os.read(fd, 65536)
+                    if not data:
+                        del buffers[fd]
+                        continue
+                    buffers[fd].write(data)
+                    if fd == stdout_fd:
+                        self.stdout_tail = (self.stdout_tail +
+                                            data)[-self.TAIL_SIZE:]
+            if not buffers and not exited:
+                # Both pipes were closed. Wait for the exit status.
+                exited = bool(_select([waiter.fd],
+                                      deadline - time.time()))
+        finally:
+            waiter.close(kill=not exited)
+            self.proc.stdout.close()
+            self.proc.stderr.close()
+        return exited
 
     @property
     def stdout(self):
@@ -55,6 +220,356 @@ class ADBProcess(object):
         return ('args: %s, exitcode: %s, stdout: %s, stderr: %s' % (
             ' '.join(self.args), self.exitcode, self.stdout, self.stderr))
 
+
+class ADBCompletedProcess(ADBProcess):
+    """ADBCompletedProcess encapsulates the result of an adb command
+    which was not executed by an adb process of its own, such as a
+    command executed in an :class:`ADBShellSession` or via an adb
+    server transport. It exposes the same attributes as
+    :class:`ADBProcess` so that callers can not distinguish between
+    the two."""
+    def __init__(self, args, proc=None, output='', error=''):
+        #: command argument argument list.
+        self.args = args
+        #: In memory file handle containing stdout.
+        self.stdout_file = StringIO.StringIO(output)
+        #: In memory file handle containing stderr.
+        self.stderr_file = StringIO.StringIO(error)
+        #: boolean indicating if the command timed out.
+        self.timedout = None
+        #: exitcode of the command.
+        self.exitcode = None
+        #: The output is already in memory so no tail is kept.
+        self.stdout_tail = None
+        #: subprocess Process object of the shell session if any.
+        self.proc = proc
+
+
+class ADBShellSessionError(Exception):
+    """ADBShellSessionError is raised internally when a command could
+    not be started in an :class:`ADBShellSession` and should be
+    executed in a separate adb process instead.
+    """
+    pass
+
+
+class ADBShellSession(object):
+    """ADBShellSession maintains a single long lived adb shell process
+    for a device into which shell commands are written one at a
+    time. Each command is bracketed by unique begin and end sentinels,
+    the end sentinel also carrying the exit code of the command, which
+    allows the output of each command to be separated from that of
+    the others without spawning a new adb process per command.
+
+    The session is owned by the process which created it. A session
+    inherited across a fork is not used by the child.
+    """
+    def __init__(self, args, logger):
+        """Starts the adb shell process.
+
+        :param list args: The adb command line used to start the
+            interactive shell.
+        :param logger: logger used to report session events.
+        """
+        self.args = args
+        self.pid = os.getpid()
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._lines = collections.deque()
+        self._partial = ''
+        self._eof = False
+        self.proc = subprocess.Popen(args,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT,
+                                     close_fds=True)
+
+    @property
+    def alive(self):
+        """True if the shell process is still running."""
+        return self.proc is not None and self.proc.poll() is None
+
+    def close(self):
+        """Terminates the shell process."""
+        if not self.proc or self.pid != os.getpid():
+            self.proc = None
+            return
+        try:
+            if self.proc.poll() is None:
+                try:
+                    self.proc.stdin.write('exit\n')
+                    self.proc.stdin.flush()
+                except IOError:
+                    pass
+                wait_for_process(self.proc, 1)
+            self.proc.stdin.close()
+            self.proc.stdout.close()
+        except OSError:
+            pass
+        self.proc = None
+
+    def _get_line(self, deadline):
+        """Returns the next line of output from the session, or None if
+        the session has terminated, blocking in select() until output
+        is available or the deadline has passed.
+
+        :raises: ADBTimeoutError if the deadline passes.
+        """
+        fd = self.proc.stdout.fileno()
+        while not self._lines:
+            if self._eof:
+                return None
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise ADBTimeoutError('shell session timed out')
+            try:
+                if not select.select([fd], [], [], remaining)[0]:
+                    continue
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                self._eof = True
+                if self._partial:
+                    self._lines.append(self._partial)
+                    self._partial = ''
+                continue
+            lines = (self._partial + data).split('\n')
+            self._partial = lines.pop()
+            self._lines.extend([line + '\n' for line in lines])
+        return self._lines.popleft()
+
+    def execute(self, cmd, timeout):
+        """Executes a shell command in the session.
+
+        :param str cmd: The command to be executed.
+        :param integer timeout: The maximum time in seconds to wait
+            for the command to complete.
+        :returns: :class:`ADBCompletedProcess`
+        :raises: ADBShellSessionError if the session is not usable and
+            the command was not started.
+        """
+        with self._lock:
+            if not self.alive:
+                raise ADBShellSessionError('shell session is not running')
+            token = uuid.uuid4().hex
+            begin = 'ADB_SESSION_BEGIN_%s' % token
+            end = 'ADB_SESSION_END_%s_rc=' % token
+            re_end = re.compile(r'%s([0-9]+)' % end)
+            # Run the command in a subshell so that changes to the
+            # working directory or environment do not leak into the
+            # following commands and so that the command can not
+            # consume the session's input.
+            line = 'echo %s; ( %s ) </dev/null 2>&1; echo %s$?\n' % (
+                begin, cmd, end)
+            adb_process = ADBCompletedProcess(self.args + [cmd], self.proc)
+            try:
+                self.proc.stdin.write(line)
+                self.proc.stdin.flush()
+            except IOError, e:
+                raise ADBShellSessionError('shell session write: %s' % e)
+
+            deadline = time.time() + timeout
+            started = False
+            output = []
+            try:
+                while True:
+                    data = self._get_line(deadline)
+                    if data is None:
+                        # The session terminated.
+                        if not started:
+                            raise ADBShellSessionError(
+                                'shell session terminated')
+                        adb_process.exitcode = self.proc.wait()
+                        if not adb_process.exitcode:
+                            adb_process.exitcode = 255
+                        break
+                    if not started:
+                        # Discard anything preceding the begin
+                        # sentinel such as the echoed command line.
+                        started = data.rstrip('\r\n') == begin
+                        continue
+                    match = re_end.search(data)
+                    if match:
+                        if match.start() > 0:
+                            output.append(data[:match.start()])
+                        adb_process.exitcode = int(match.group(1))
+                        break
+                    output.append(data)
+            except ADBTimeoutError:
+                self._logger.warning('shell session timed out running %s' %
+                                     cmd)
+                adb_process.timedout = True
+                self.close()
+                adb_process.exitcode = None
+            adb_process.stdout_file = StringIO.StringIO(''.join(output))
+            return adb_process
+
+class ADBLogcatReader(object):
+    """ADBLogcatReader runs adb logcat for a device in a single long
+    lived process and appends each line of its output to a bounded
+    ring buffer as it arrives.
+
+    Each line is assigned a sequence number. Consumers keep a cursor,
+    the sequence number of the next line they have not yet seen, and
+    retrieve only the lines which have arrived since then via
+    :meth:`get_lines`. If a consumer falls more than max_lines behind,
+    the lines it missed are dropped.
+
+    If the adb logcat process exits, for example because the device
+    was rebooted or disconnected, it is restarted. Since the restarted
+    process dumps the device's log buffer again, lines which duplicate
+    the most recently received lines are skipped until a new line is
+    seen.
+
+    The reader is owned by the process which created it. A reader
+    inherited across a fork is not used by the child.
+    """
+    def __init__(self, args, logger, max_lines=100000, restart_wait=1):
+        """Starts the adb logcat process and the thread reading it.
+
+        :param list args: The adb logcat command line.
+        :param logger: logger used to report reader events.
+        :param integer max_lines: The maximum number of lines kept in
+            the ring buffer. Defaults to 100000.
+        :param restart_wait: Seconds to wait before restarting adb
+            logcat after it exits. Defaults to 1.
+        """
+        self.args = args
+        self.max_lines = max_lines
+        self.restart_wait = restart_wait
+        self.pid = os.getpid()
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+        self._lines = collections.deque(maxlen=max_lines)
+        self._next = 0
+        self._proc = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='ADBLogcatReader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def alive(self):
+        """True if the reader has not been stopped."""
+        return not self._stopped and self._thread.is_alive()
+
+    @property
+    def cursor(self):
+        """The sequence number of the next line to be received."""
+        with self._lock:
+            return self._next
+
+    def _append(self, lines):
+        with self._lock:
+            self._lines.extend(lines)
+            self._next += len(lines)
+            self._arrived.notify_all()
+
+    def wait(self, cursor, timeout):
+        """Waits until lines have been received since cursor.
+
+        :param integer cursor: The cursor returned by get_lines().
+        :param timeout: The maximum time in seconds to wait.
+        :returns: boolean - True if lines have been received since
+            cursor.
+        """
+        with self._lock:
+            if self._next <= cursor and not self._stopped:
+                self._arrived.wait(timeout)
+            return self._next > cursor
+
+    def _run(self):
+        started = False
+        while not self._stopped:
+            # Lines recently received which will be output again
+            # when adb logcat is restarted.
+            with self._lock:
+                if started:
+                    duplicates = set(itertools.islice(
+                        self._lines, max(0, len(self._lines) - 1000), None))
+                else:
+                    duplicates = None
+            started = True
+            try:
+                self._proc = subprocess.Popen(self.args,
+                                              stdout=subprocess.PIPE,
+                                              stderr=subprocess.STDOUT,
+                                              close_fds=True)
+            except OSError, e:
+                self._logger.warning('ADBLogcatReader: %s' % e)
+                time.sleep(self.restart_wait)
+                continue
+            fd = self._proc.stdout.fileno()
+            partial = ''
+            while True:
+                try:
+                    data = os.read(fd, 65536)
+                except OSError, e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    break
+                if not data:
+                    break
+                lines = (partial + data).split('\n')
+                partial = lines.pop()
+                lines = [line.rstrip('\r') for line in lines]
+                lines = [line for line in lines
+                         if line and not line.startswith('--------- beginning of')]
+                if duplicates:
+                    while lines and lines[0] in duplicates:
+                        lines.pop(0)
+                    if lines:
+                        duplicates = None
+                if lines:
+                    self._append(lines)
+            self._proc.stdout.close()
+            wait_for_process(self._proc, self.restart_wait)
+            if not self._stopped:
+                self._logger.debug('ADBLogcatReader: adb logcat exited, '
+                                   'restarting')
+                time.sleep(self.restart_wait)
+
+    def get_lines(self, cursor):
+        """Returns the lines received since cursor.
+
+        :param integer cursor: The sequence number of the first line to
+            be returned, usually the cursor returned by the previous
+            call.
+        :returns: tuple (lines, cursor) where lines is the list of lines
+            received since cursor and cursor is the value to be passed
+            to the next call.
+        """
+        with self._lock:
+            first = self._next - len(self._lines)
+            if cursor < first:
+                if cursor > 0:
+                    self._logger.warning('ADBLogcatReader: %d lines were '
+                                         'dropped' % (first - cursor))
+                cursor = first
+            count = self._next - cursor
+            lines = list(itertools.islice(self._lines,
+                                          len(self._lines) - count, None))
+            return lines, self._next
+
+    def stop(self):
+        """Terminates the adb logcat process."""
+        self._stopped = True
+        if self.pid != os.getpid():
+            return
+        proc = self._proc
+        if proc and proc.returncode is None:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        self._thread.join(self.restart_wait + 5)
+
+
 # ADBError, ADBRootError, and ADBTimeoutError are treated
 # differently in order that unhandled ADBRootErrors and
 # ADBTimeoutErrors can be handled distinctly from ADBErrors.
@@ -96,6 +611,237 @@ class ADBTimeoutError(Exception):
     pass
 
 
+class ADBCapabilityCache(object):
+    """ADBCapabilityCache persists the results of the capability probes
+    performed when an :class:`ADBDevice` is created, such as which
+    versions of su and ls the device supports, in a json file on the
+    host.
+
+    The capabilities are keyed by the device serial number and are
+    only used if the device's ro.build.fingerprint is unchanged so
+    that a reflashed device is probed again. Call
+    :meth:`ADBDevice.probe_capabilities` to force the device to be
+    probed again, for example after software has been installed
+    without changing the build.
+
+    ::
+
+       from adb import ADBCapabilityCache
+       from adb_android import ADBAndroid
+
+       cache = ADBCapabilityCache('capabilities.json')
+       adbdevice = ADBAndroid(device='0123456789ABCDEF',
+                              capability_cache=cache)
+    """
+
+    def __init__(self, path):
+        """Initializes the ADBCapabilityCache object.
+
+        :param str path: The path of the json file containing the
+            cached capabilities. It is created if it does not exist,
+            along with path + '.lock' which serializes updates made by
+            different processes.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # The cache file is shared by every process on the host, so
+        # updates are serialized by an exclusive lock on a separate
+        # lock file as well as by the lock of this process's threads.
+        with self._lock:
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        # A missing or corrupt file is treated as an empty cache.
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if not isinstance(cache, dict):
+            return {}
+        return cache
+
+    def _save(self, cache):
+        # Write a temporary file and rename it so that concurrent
+        # readers never see a partially written file.
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def get(self, serial, fingerprint):
+        """Returns the capabilities of the device or None if they have
+        not been cached or were cached for a different build.
+
+        :param str serial: The device serial number.
+        :param str fingerprint: The device's ro.build.fingerprint.
+        :returns: dict or None
+        """
+        with self._lock:
+            entry = self._load().get(serial)
+        if not entry or entry.get('fingerprint') != fingerprint:
+            return None
+        return entry.get('capabilities')
+
+    def set(self, serial, fingerprint, capabilities):
+        """Saves the capabilities of the device.
+
+        :param str serial: The device serial number.
+        :param str fingerprint: The device's ro.build.fingerprint.
+        :param dict capabilities: The capabilities of the device.
+        :raises: * IOError
+                 * OSError
+        """
+        with self._locked():
+            cache = self._load()
+            cache[serial] = {'fingerprint': fingerprint,
+                             'capabilities': capabilities}
+            self._save(cache)
+
+    def remove(self, serial):
+        """Removes the cached capabilities of the device so that it is
+        probed the next time an :class:`ADBDevice` is created for it.
+
+        :param str serial: The device serial number.
+        :raises: * IOError
+                 * OSError
+        """
+        with self._locked():
+            cache = self._load()
+            if cache.pop(serial, None) is not None:
+                self._save(cache)
+
+
+class ADBLatencyHistogram(object):
+    """ADBLatencyHistogram accumulates the durations of the adb
+    commands sharing a verb in buckets bounded by BOUNDS, along with
+    the number of commands which failed or timed out."""
+
+    #: Upper bounds in milliseconds of the buckets. Durations larger
+    #: than the last bound are counted in an additional bucket.
+    BOUNDS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000,
+              60000)
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+
+    def add(self, duration_ms, exitcode, timedout):
+        self.count += 1
+        if timedout:
+            self.timeouts += 1
+        elif exitcode:
+            self.failures += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.buckets[bisect.bisect_left(self.BOUNDS, duration_ms)] += 1
+
+    def percentile(self, percent):
+        """Returns the upper bound in milliseconds of the bucket
+        containing the percent percentile or max_ms if it is in the
+        last bucket."""
+        rank = self.count * percent / 100.0
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                if i < len(self.BOUNDS):
+                    return min(self.BOUNDS[i], self.max_ms)
+                break
+        return self.max_ms
+
+
+class ADBCommandStats(object):
+    """ADBCommandStats records the latency of the adb commands executed
+    for a device in an :class:`ADBLatencyHistogram` per command verb.
+    The verb is the adb command, such as push or install, or for shell
+    commands shell: followed by the name of the program, such as
+    shell:pm or shell:ls.
+
+    ::
+
+       print adbdevice.command_stats
+    """
+
+    def __init__(self):
+        #: Time when recording started.
+        self.start_time = time.time()
+        #: dict of :class:`ADBLatencyHistogram` indexed by verb.
+        self.histograms = {}
+        #: dict of [hits, misses] lists of the queries answered from
+        #: the device's :class:`ADBQueryCache` indexed by query name.
+        self.queries = {}
+
+    def record(self, verb, duration, exitcode=0, timedout=False):
+        """Records the completion of an adb command.
+
+        :param str verb: The command verb.
+        :param duration: The duration of the command in seconds.
+        :param exitcode: The exit code of the command.
+        :param bool timedout: True if the command timed out.
+        """
+        histogram = self.histograms.get(verb)
+        if histogram is None:
+            histogram = self.histograms[verb] = ADBLatencyHistogram()
+        histogram.add(duration * 1000, exitcode, timedout)
+
+    def record_query(self, name, hit):
+        """Records a lookup in the query cache.
+
+        :param str name: The name of the query, such as is_dir.
+        :param bool hit: True if the result was found in the cache.
+        """
+        counts = self.queries.get(name)
+        if counts is None:
+            counts = self.queries[name] = [0, 0]
+        counts[0 if hit else 1] += 1
+
+    def reset(self):
+        """Discards the recorded commands."""
+        self.__init__()
+
+    def copy(self):
+        """Returns a copy of the recorded statistics which is safe to
+        send to another process while recording continues."""
+        return copy.deepcopy(self)
+
+    def __str__(self):
+        lines = ['%-24s %7s %6s %6s %9s %9s %9s %9s' % (
+            'verb', 'count', 'fail', 'tmout', 'mean ms', 'p50 ms', 'p95 ms',
+            'max ms')]
+        # Order the verbs by the total time spent in them.
+        for verb, histogram in sorted(self.histograms.items(),
+                                      key=lambda item: -item[1].total_ms):
+            lines.append('%-24s %7d %6d %6d %9.1f %9.1f %9.1f %9.1f' % (
+                verb[:24], histogram.count, histogram.failures,
+                histogram.timeouts, histogram.total_ms / histogram.count,
+                histogram.percentile(50), histogram.percentile(95),
+                histogram.max_ms))
+        if self.queries:
+            lines.append('%-24s %7s %7s' % ('cached query', 'hits', 'misses'))
+            for name, (hits, misses) in sorted(self.queries.items()):
+                lines.append('%-24s %7d %7d' % (name[:24], hits, misses))
+        return '\n'.join(lines)
+
+
 class ADBCommand(object):
     """ADBCommand provides a basic interface to adb commands
     which is used to provide the 'command' methods for the
@@ -122,7 +868,9 @@ class ADBCommand(object):
                  adb_port=None,
                  logger_name='adb',
                  timeout=300,
-                 verbose=False):
+                 verbose=False,
+                 transport=None,
+                 output_buffer_size=0):
         """Initializes the ADBCommand object.
 
         :param str adb: path to adb executable. Defaults to 'adb'.
@@ -131,6 +879,15 @@ class ADBCommand(object):
         :param adb_port: port of the adb server.
         :type adb_port: integer or None
         :param str logger_name: logging logger name. Defaults to 'adb'.
+        :param transport: Optional transport such as
+            :class:`adb_transport.ADBServerTransport` used to execute
+            the commands it supports without spawning an adb process.
+            Defaults to None.
+        :param integer output_buffer_size: If non-zero, the output of
+            adb processes is captured in memory and only written to
+            temporary files if it exceeds this many bytes. If zero,
+            the output is always written to temporary files.
+            Defaults to 0.
 
         :raises: * ADBError
                  * ADBTimeoutError
@@ -144,7 +901,11 @@ class ADBCommand(object):
         self._adb_host = adb_host
         self._adb_port = adb_port
         self._timeout = timeout
-        self._polling_interval = 0.1
+        self._transport = transport
+        self._output_buffer_size = output_buffer_size
+        #: :class:`ADBCommandStats` recording the latency of the
+        #: commands executed by this object.
+        self.command_stats = ADBCommandStats()
 
         self._logger.debug("%s: %s" % (self.__class__.__name__,
                                        self.__dict__))
@@ -216,27 +977,33 @@ class ADBCommand(object):
             args.extend(['-s', device_serial, 'wait-for-device'])
         args.extend(cmds)
 
-        adb_process = ADBProcess(args)
-
         if timeout is None:
             timeout = self._timeout
 
         start_time = time.time()
-        adb_process.exitcode = adb_process.proc.poll()
-        while ((time.time() - start_time) <= timeout and
-               adb_process.exitcode is None):
-            time.sleep(self._polling_interval)
-            adb_process.exitcode = adb_process.proc.poll()
-        if adb_process.exitcode is None:
-            adb_process.proc.kill()
-            adb_process.timedout = True
-            adb_process.exitcode = adb_process.proc.poll()
+        if self._transport:
+            adb_process = self._transport.command(args, cmds,
+                                                  device_serial=device_serial,
+                                                  timeout=timeout)
+            if adb_process:
+                self._record_command(cmds[0], start_time, adb_process)
+                return adb_process
+
+        adb_process = ADBProcess(args,
+                                 max_buffer_size=self._output_buffer_size)
+        adb_process.exitcode = adb_process.wait(timeout)
 
         adb_process.stdout_file.seek(0, os.SEEK_SET)
         adb_process.stderr_file.seek(0, os.SEEK_SET)
 
+        self._record_command(cmds[0], start_time, adb_process)
         return adb_process
 
+    def _record_command(self, verb, start_time, adb_process):
+        self.command_stats.record(verb, time.time() - start_time,
+                                  exitcode=adb_process.exitcode,
+                                  timedout=adb_process.timedout)
+
     def command_output(self, cmds, device_serial=None, timeout=None):
         """Executes an adb command on the host returning stdout.
 
@@ -306,7 +1073,9 @@ class ADBHost(ADBCommand):
                  adb_port=None,
                  logger_name='adb',
                  timeout=300,
-                 verbose=False):
+                 verbose=False,
+                 transport=None,
+                 output_buffer_size=0):
         """Initializes the ADBHost object.
 
         :param str adb: path to adb executable. Defaults to 'adb'.
@@ -315,13 +1084,20 @@ class ADBHost(ADBCommand):
         :param adb_port: port of the adb server.
         :type adb_port: integer or None
         :param str logger_name: logging logger name. Defaults to 'adb'.
+        :param transport: Optional transport used to execute commands
+            without spawning an adb process. Defaults to None.
+        :param integer output_buffer_size: If non-zero, the maximum
+            number of bytes of adb process output to hold in memory
+            before using temporary files. Defaults to 0.
 
         :raises: * ADBError
                  * ADBTimeoutError
         """
         ADBCommand.__init__(self, adb=adb, adb_host=adb_host,
                             adb_port=adb_port, logger_name=logger_name,
-                            timeout=timeout, verbose=verbose)
+                            timeout=timeout, verbose=verbose,
+                            transport=transport,
+                            output_buffer_size=output_buffer_size)
 
     def command(self, cmds, timeout=None):
         """Executes an adb command on the host.
@@ -471,6 +1247,211 @@ class ADBHost(ADBCommand):
         return devices
 
 
+# Maximum length of the command line submitted by shell_batch() in a
+# single adb shell invocation. Older versions of adb limit the length
+# of the shell service request to 4096 bytes.
+SHELL_BATCH_MAX_LENGTH = 3072
+
+
+class ADBQueryCache(object):
+    """ADBQueryCache holds the results of idempotent device queries,
+    such as exists() and is_app_installed(), for ttl seconds.
+
+    Methods which modify the device invalidate the results for the
+    paths or apps they affect and reboot() discards all of the
+    results. Since arbitrary shell commands may also modify the
+    device, all of the results are discarded after each shell command
+    which is not run by a query or a modification. Changes made by
+    other means are only noticed once the results expire, so ttl
+    should be short.
+
+    ::
+
+       adbdevice.query_cache = ADBQueryCache(ttl=5)
+    """
+
+    def __init__(self, ttl=5):
+        """
+        :param ttl: Seconds for which a result is valid.
+        """
+        self.ttl = ttl
+        # dict of (expires, value, path, app_name) tuples indexed by
+        # the query's key.
+        self._entries = {}
+        self._suspended = 0
+        self._querying = 0
+
+    @property
+    def suspended(self):
+        """True while a method which modifies the device is running."""
+        return self._suspended > 0
+
+    @property
+    def nested(self):
+        """True while a query or a method which modifies the device is
+        running."""
+        return self._suspended > 0 or self._querying > 0
+
+    def begin_query(self):
+        self._querying += 1
+
+    def end_query(self):
+        self._querying -= 1
+
+    def suspend(self):
+        """Bypasses the cache until resume() is called."""
+        self._suspended += 1
+
+    def resume(self):
+        self._suspended -= 1
+
+    def get(self, key):
+        """Returns a tuple of True and the result of the query
+        identified by key if it is cached and has not expired,
+        otherwise False and None."""
+        if self._suspended:
+            return False, None
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] < time.time():
+            del self._entries[key]
+            return False, None
+        return True, entry[1]
+
+    def set(self, key, value, path=None, app_name=None):
+        """Caches the result of a query.
+
+        :param key: The hashable key identifying the query.
+        :param value: The result of the query.
+        :param path: The normalized device path the query examined.
+        :param app_name: The name of the app the query examined.
+        """
+        if not self._suspended:
+            self._entries[key] = (time.time() + self.ttl, value, path,
+                                  app_name)
+
+    def invalidate_path(self, path):
+        """Discards the results for path, the paths beneath it and its
+        parent directories."""
+        path = posixpath.normpath(path)
+        for key, entry in self._entries.items():
+            entry_path = entry[2]
+            if entry_path is None:
+                continue
+            if (entry_path == path or
+                entry_path.startswith(path.rstrip('/') + '/') or
+                path.startswith(entry_path.rstrip('/') + '/')):
+                del self._entries[key]
+
+    def invalidate_apps(self, app_names=None):
+        """Discards the results for the apps in app_names or for all
+        apps if app_names is None."""
+        for key, entry in self._entries.items():
+            if entry[3] is None:
+                continue
+            if app_names is None or entry[3] in app_names:
+                del self._entries[key]
+
+    def clear(self):
+        """Discards all of the results."""
+        self._entries = {}
+
+
+def _device_query(*arg_names):
+    """Decorator for :class:`ADBDevice` methods whose results are held
+    in the device's query cache, if it has one. The results are keyed
+    by the method name and the values of the arguments in arg_names.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = self.query_cache
+            if not cache or cache.suspended:
+                return method(self, *args, **kwargs)
+            callargs = inspect.getcallargs(method, self, *args, **kwargs)
+            path = callargs.get('path')
+            if path is not None:
+                path = posixpath.normpath(path)
+                callargs['path'] = path
+            key = [method.__name__]
+            for name in arg_names:
+                value = callargs[name]
+                if isinstance(value, list):
+                    value = tuple(value)
+                key.append(value)
+            key = tuple(key)
+            found, value = cache.get(key)
+            self.command_stats.record_query(method.__name__, found)
+            if found:
+                return value
+            cache.begin_query()
+            try:
+                value = method(self, *args, **kwargs)
+            finally:
+                cache.end_query()
+            cache.set(key, value, path=path,
+                      app_name=callargs.get('app_name'))
+            return value
+        return wrapper
+    return decorator
+
+
+def _device_modification(paths=(), apps=(), all_apps=False, clear=False):
+    """Decorator for :class:`ADBDevice` methods which modify the
+    device. The query cache is bypassed while the method runs. When it
+    returns or raises, the results for the paths and apps named by the
+    arguments in paths and apps are invalidated, or for all apps if
+    all_apps is True, or all of the results if clear is True.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = self.query_cache
+            if not cache:
+                return method(self, *args, **kwargs)
+            callargs = inspect.getcallargs(method, self, *args, **kwargs)
+            cache.suspend()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                cache.resume()
+                if clear:
+                    cache.clear()
+                for name in paths:
+                    cache.invalidate_path(callargs[name])
+                if all_apps:
+                    cache.invalidate_apps()
+                for name in apps:
+                    value = callargs[name]
+                    if isinstance(value, basestring):
+                        value = [value]
+                    cache.invalidate_apps(value)
+        return wrapper
+    return decorator
+
+
+def _device_shell(method):
+    """Decorator for the :class:`ADBDevice` method which runs shell
+    commands. Since a command may modify the device, the query cache is
+    bypassed while it runs and cleared when it returns or raises,
+    unless it is run by a query or by a method which modifies the
+    device and invalidates its own results.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self.query_cache
+        if not cache or cache.nested:
+            return method(self, *args, **kwargs)
+        cache.suspend()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            cache.resume()
+            cache.clear()
+    return wrapper
+
+
 class ADBDevice(ADBCommand):
     """ADBDevice is an abstract base class which provides methods which
     can be used to interact with the associated Android or B2G based
@@ -479,6 +1460,11 @@ class ADBDevice(ADBCommand):
     """
     __metaclass__ = ABCMeta
 
+    # Names of the attributes set by probe_capabilities() which are
+    # saved in the capability cache.
+    _capability_names = ('_have_su', '_have_android_su', '_ls', '_have_cp',
+                         '_chmod_R', '_mkdir_p', '_tar', '_tar_z')
+
     def __init__(self,
                  device=None,
                  adb='adb',
@@ -489,7 +1475,11 @@ class ADBDevice(ADBCommand):
                  timeout=300,
                  verbose=False,
                  device_ready_retry_wait=20,
-                 device_ready_retry_attempts=3):
+                 device_ready_retry_attempts=3,
+                 use_shell_session=False,
+                 transport=None,
+                 output_buffer_size=0,
+                 capability_cache=None):
         """Initializes the ADBDevice object.
 
         :param device: When a string is passed, it is interpreted as the
@@ -519,6 +1509,22 @@ class ADBDevice(ADBCommand):
             reboot.
         :param integer device_ready_retry_attempts: number of attempts when
             checking if a device is ready.
+        :param bool use_shell_session: Flag indicating that shell
+            commands are to be executed in a persistent adb shell
+            session rather than in a new adb process per command.
+            Defaults to False.
+        :param transport: Optional transport such as
+            :class:`adb_transport.ADBServerTransport` used to execute
+            the commands it supports without spawning an adb process.
+            Defaults to None.
+        :param integer output_buffer_size: If non-zero, the output of
+            adb processes is captured in memory and only written to
+            temporary files if it exceeds this many bytes. Defaults
+            to 0 which always uses temporary files.
+        :param capability_cache: Optional :class:`ADBCapabilityCache`
+            used to avoid probing the device's capabilities if they
+            were saved for the device's current build. Defaults to
+            None.
 
         :raises: * ADBError
                  * ADBTimeoutError
@@ -526,15 +1532,45 @@ class ADBDevice(ADBCommand):
         """
         ADBCommand.__init__(self, adb=adb, adb_host=adb_host,
                             adb_port=adb_port, logger_name=logger_name,
-                            timeout=timeout, verbose=verbose)
+                            timeout=timeout, verbose=verbose,
+                            transport=transport,
+                            output_buffer_size=output_buffer_size)
         self._device_serial = self._get_device_serial(device)
+        self._use_shell_session = use_shell_session
+        self._shell_session = None
+        self._shell_session_failures = 0
+        self._props = None
+        self._props_time = 0
+        self._logcat_reader = None
+        #: Optional :class:`transferscheduler.TransferScheduler` shared
+        #: by the devices on the host which limits the number of
+        #: concurrent pushes, pulls and installs.
+        self.transfer_scheduler = None
+        #: Priority of this device's transfers in the scheduler.
+        self.transfer_priority = 0
+        #: Optional :class:`ADBQueryCache` holding the results of
+        #: idempotent queries such as exists() and is_dir().
+        self.query_cache = None
+        #: Default archive mode used by push() and pull() to transfer
+        #: directories: None or '' to use adb's per file sync, 'tar'
+        #: or 'tgz'.
+        self.archive_transfers = None
+        #: Seconds for which properties other than the read only ro.*
+        #: properties are served from the property snapshot. 0 reads
+        #: them from the device each time.
+        self.prop_cache_ttl = 0
         self._initial_test_root = test_root
         self._test_root = None
         self._device_ready_retry_wait = device_ready_retry_wait
         self._device_ready_retry_attempts = device_ready_retry_attempts
+        self._capability_cache = capability_cache
+        self._fingerprint = None
         self._have_root_shell = False
         self._have_su = False
         self._have_android_su = False
+        self._mkdir_p = None
+        self._tar = None
+        self._tar_z = False
 
         # Catch exceptions due to the potential for segfaults
         # calling su when using an improperly rooted device.
@@ -552,6 +1588,51 @@ class ADBDevice(ADBCommand):
 
         self._check_adb_root(timeout=timeout)
 
+        # Use the cached capabilities if the device has not been
+        # reflashed since they were probed.
+        capabilities = None
+        if self._capability_cache and self._device_serial:
+            self._fingerprint = self.get_prop('ro.build.fingerprint',
+                                              timeout=timeout)
+            capabilities = self._capability_cache.get(self._device_serial,
+                                                      self._fingerprint)
+        if capabilities and self._set_capabilities(capabilities):
+            self._logger.info("Using cached capabilities for %s" %
+                              self._device_serial)
+        else:
+            self.probe_capabilities(timeout=timeout)
+
+        self._logger.debug("ADBDevice: %s" % self.__dict__)
+
+    def probe_capabilities(self, timeout=None):
+        """Probes the device for the commands it supports and saves
+        the results in the capability cache if one was passed to the
+        constructor. The probes are performed when the ADBDevice is
+        created unless cached capabilities are available. Call
+        probe_capabilities() to probe the device again, for example
+        after it has been reflashed or after su has been installed.
+
+        :param timeout: The maximum time in
+            seconds for any spawned adb process to complete before
+            throwing an ADBTimeoutError.
+            This timeout is per adb call. The total time spent
+            may exceed this value. If it is not specified, the value
+            set in the ADBDevice constructor is used.
+        :type timeout: integer or None
+        :raises: * ADBTimeoutError
+                 * ADBError
+        """
+        self._test_root = None
+        self._mkdir_p = None
+        self._probe_capabilities(timeout=timeout)
+        if self._capability_cache and self._device_serial:
+            self._fingerprint = self.get_prop('ro.build.fingerprint',
+                                              timeout=timeout, refresh=True)
+        self._save_capabilities()
+
+    def _probe_capabilities(self, timeout=None):
+        self._have_su = False
+        self._have_android_su = False
         uid = 'uid=0'
         # Do we have a 'Superuser' sh like su?
         try:
@@ -569,7 +1650,6 @@ class ADBDevice(ADBCommand):
         except ADBError:
             self._logger.debug("Check for su 0 failed")
 
-        self._mkdir_p = None
         # Force the use of /system/bin/ls or /system/xbin/ls in case
         # there is /sbin/ls which embeds ansi escape codes to colorize
         # the output.  Detect if we are using busybox ls. We want each
@@ -607,12 +1687,66 @@ class ADBDevice(ADBCommand):
                 self._chmod_R = True
         self._logger.info("Native chmod -R support: %s" % self._chmod_R)
 
-        self._logger.debug("ADBDevice: %s" % self.__dict__)
+        # Do we have a tar which supports -C? It is used to transfer
+        # directories as a single archive.
+        self._tar = None
+        self._tar_z = False
+        for tar in ('tar', 'toybox tar', 'busybox tar'):
+            if self.shell_bool('%s -cf /dev/null -C /proc version' % tar,
+                               timeout=timeout):
+                self._tar = tar
+                self._tar_z = self.shell_bool(
+                    '%s -czf /dev/null -C /proc version' % tar,
+                    timeout=timeout)
+                break
+        self._logger.info("tar support: %s, gzip: %s" % (self._tar,
+                                                         self._tar_z))
+
+    def _set_capabilities(self, capabilities):
+        """Sets the attributes named in _capability_names from cached
+        capabilities. Returns False if any are missing."""
+        for name in self._capability_names:
+            if name not in capabilities:
+                return False
+        for name in self._capability_names:
+            value = capabilities[name]
+            if isinstance(value, unicode):
+                value = str(value)
+            setattr(self, name, value)
+        if capabilities.get('_initial_test_root') == self._initial_test_root:
+            test_root = capabilities.get('_test_root')
+            if isinstance(test_root, unicode):
+                test_root = str(test_root)
+            # A factory reset keeps the fingerprint but can remove the
+            # test root, so it is only used if it still works. Otherwise
+            # test_root probes for it again.
+            try:
+                if test_root and self._try_test_root(test_root):
+                    self._test_root = test_root
+            except (ADBError, ADBTimeoutError), e:
+                self._logger.debug('Cached test root %s: %s' % (test_root, e))
+        return True
+
+    def _save_capabilities(self):
+        if (not self._capability_cache or not self._device_serial or
+            self._fingerprint is None):
+            return
+        capabilities = dict([(name, getattr(self, name))
+                             for name in self._capability_names])
+        capabilities['_initial_test_root'] = self._initial_test_root
+        capabilities['_test_root'] = self._test_root
+        try:
+            self._capability_cache.set(self._device_serial,
+                                       self._fingerprint, capabilities)
+        except (IOError, OSError), e:
+            self._logger.warning('Unable to save capabilities to %s: %s' %
+                                 (self._capability_cache.path, e))
 
     def _get_device_serial(self, device):
         if device is None:
             devices = ADBHost(adb=self._adb_path, adb_host=self._adb_host,
-                              adb_port=self._adb_port).devices()
+                              adb_port=self._adb_port,
+                              transport=self._transport).devices()
             if len(devices) > 1:
                 raise ValueError("ADBDevice called with multiple devices "
                                  "attached and no device specified")
@@ -655,6 +1789,9 @@ class ADBDevice(ADBCommand):
 
         # Do we need to run adb root to get a root shell?
         try:
+            if not self._have_root_shell:
+                # adb root restarts adbd which terminates any shell session.
+                self.close_shell_session()
             if (not self._have_root_shell and
                 self.command_output(
                     ["root"],
@@ -665,6 +1802,53 @@ class ADBDevice(ADBCommand):
             self._logger.debug("Check for root adbd failed")
 
 
+    def _get_shell_session(self):
+        """Returns the persistent shell session for the device, starting
+        a new one if necessary, or None if shell sessions are not in use.
+        """
+        if not self._use_shell_session:
+            return None
+        session = self._shell_session
+        if session and session.pid != os.getpid():
+            # The session was inherited from the parent process. Leave
+            # it to the parent and start one of our own.
+            session = self._shell_session = None
+        if session and not session.alive:
+            self._logger.debug('shell session terminated')
+            session.close()
+            session = self._shell_session = None
+        if session is None:
+            if self._shell_session_failures >= 3:
+                self._logger.warning('shell session failed %d times, '
+                                     'using separate adb processes' %
+                                     self._shell_session_failures)
+                self._use_shell_session = False
+                return None
+            args = [self._adb_path]
+            if self._adb_host:
+                args.extend(['-H', self._adb_host])
+            if self._adb_port:
+                args.extend(['-P', str(self._adb_port)])
+            if self._device_serial:
+                args.extend(['-s', self._device_serial])
+            args.extend(["wait-for-device", "shell"])
+            try:
+                session = self._shell_session = ADBShellSession(args,
+                                                                self._logger)
+            except OSError, e:
+                self._logger.warning('Unable to start shell session: %s' % e)
+                self._shell_session_failures += 1
+                return None
+        return session
+
+    def close_shell_session(self):
+        """Terminates the persistent shell session if one is running.
+        A new session will be started by the next shell command if
+        shell sessions are in use."""
+        if self._shell_session:
+            self._shell_session.close()
+            self._shell_session = None
+
     @staticmethod
     def _escape_command_line(cmd):
         """Utility function to return escaped and quoted version of command
@@ -688,10 +1872,29 @@ class ADBDevice(ADBCommand):
         return " ".join(quoted_cmd)
 
     @staticmethod
-    def _get_exitcode(file_obj):
+    def _get_exitcode(file_obj, tail=None):
         """Get the exitcode from the last line of the file_obj for shell
         commands.
+
+        If tail, the last bytes written to file_obj, is given and
+        contains the complete last line, the exitcode is extracted from
+        tail and the file is truncated without being reread.
         """
+        if tail:
+            stripped = tail.rstrip('\r\n')
+            start = max(stripped.rfind('\n'), stripped.rfind('\r')) + 1
+            file_obj.seek(0, os.SEEK_END)
+            length = file_obj.tell()
+            if start > 0 or len(tail) == length:
+                match = re.match(r'rc=([0-9]+)', stripped[start:])
+                if not match:
+                    return None
+                # Remove the rc= line along with the preceding newline.
+                file_obj.seek(max(length - len(tail) + start - 1, 0),
+                              os.SEEK_SET)
+                file_obj.truncate()
+                return int(match.group(1))
+
         file_obj.seek(0, os.SEEK_END)
 
         line = ''
@@ -767,6 +1970,7 @@ class ADBDevice(ADBCommand):
 
                 if self._try_test_root(test_root):
                     self._test_root = test_root
+                    self._save_capabilities()
                     return self._test_root
 
                 self._logger.debug('_setup_test_root: '
@@ -947,6 +2151,26 @@ class ADBDevice(ADBCommand):
 
     # Device Shell methods
 
+    def _get_root_command(self, cmd):
+        """Returns cmd modified so that it is executed as root.
+
+        :param str cmd: The command to be executed.
+        :returns: string - the command to be executed.
+        :raises: ADBRootError
+        """
+        if self._have_root_shell:
+            return cmd
+        # If root was requested and we do not already have a root
+        # shell, then use the appropriate version of su to invoke
+        # the shell cmd. Prefer Android's su version since it may
+        # falsely report support for su -c.
+        if self._have_android_su:
+            return "su 0 %s" % cmd
+        elif self._have_su:
+            return "su -c \"%s\"" % cmd
+        raise ADBRootError('Can not run command %s as root!' % cmd)
+
+    @_device_shell
     def shell(self, cmd, env=None, cwd=None, timeout=None, root=False):
         """Executes a shell command on the device.
 
@@ -999,20 +2223,19 @@ class ADBDevice(ADBCommand):
         is terminated. The return code is extracted from the stdout
         and is then removed from the file.
 
+        If the ADBDevice was created with use_shell_session=True, the
+        command is instead written to a persistent adb shell session
+        for the device. If the session can not be used, the command is
+        executed in a new adb process as described above.
+
         It is the caller's responsibilty to clean up by closing
         the stdout and stderr temporary files.
         """
-        if root and not self._have_root_shell:
-            # If root was requested and we do not already have a root
-            # shell, then use the appropriate version of su to invoke
-            # the shell cmd. Prefer Android's su version since it may
-            # falsely report support for su -c.
-            if self._have_android_su:
-                cmd = "su 0 %s" % cmd
-            elif self._have_su:
-                cmd = "su -c \"%s\"" % cmd
-            else:
-                raise ADBRootError('Can not run command %s as root!' % cmd)
+        verb = self._get_shell_verb(cmd)
+        start_time = time.time()
+
+        if root:
+            cmd = self._get_root_command(cmd)
 
         # prepend cwd and env to command if necessary
         if cwd:
@@ -1021,6 +2244,24 @@ class ADBDevice(ADBCommand):
             envstr = '&& '.join(map(lambda x: 'export %s=%s' %
                                     (x[0], x[1]), env.iteritems()))
             cmd = envstr + "&& " + cmd
+
+        if timeout is None:
+            timeout = self._timeout
+
+        if '\n' not in cmd:
+            session = self._get_shell_session()
+            if session:
+                try:
+                    adb_process = session.execute(cmd, timeout)
+                    self._shell_session_failures = 0
+                    self._record_command(verb, start_time, adb_process)
+                    return adb_process
+                except ADBShellSessionError, e:
+                    self._logger.debug('shell: %s, falling back to adb '
+                                       'process' % e)
+                    self._shell_session_failures += 1
+                    self.close_shell_session()
+
         cmd += "; echo rc=$?"
 
         args = [self._adb_path]
@@ -1031,30 +2272,45 @@ class ADBDevice(ADBCommand):
         if self._device_serial:
             args.extend(['-s', self._device_serial])
         args.extend(["wait-for-device", "shell", cmd])
-        adb_process = ADBProcess(args)
-
-        if timeout is None:
-            timeout = self._timeout
 
-        start_time = time.time()
-        exitcode = adb_process.proc.poll()
-        while ((time.time() - start_time) <= timeout) and exitcode is None:
-            time.sleep(self._polling_interval)
-            exitcode = adb_process.proc.poll()
-        if exitcode is None:
-            adb_process.proc.kill()
-            adb_process.timedout = True
-            adb_process.exitcode = adb_process.proc.poll()
+        adb_process = None
+        if self._transport:
+            adb_process = self._transport.command(
+                args, ["shell", cmd], device_serial=self._device_serial,
+                timeout=timeout)
+        if adb_process:
+            exitcode = adb_process.exitcode
+        else:
+            adb_process = ADBProcess(args,
+                                     max_buffer_size=self._output_buffer_size)
+            exitcode = adb_process.wait(timeout)
+        if adb_process.timedout:
+            adb_process.exitcode = exitcode
         elif exitcode == 0:
-            adb_process.exitcode = self._get_exitcode(adb_process.stdout_file)
+            adb_process.exitcode = self._get_exitcode(
+                adb_process.stdout_file, tail=adb_process.stdout_tail)
         else:
             adb_process.exitcode = exitcode
 
         adb_process.stdout_file.seek(0, os.SEEK_SET)
         adb_process.stderr_file.seek(0, os.SEEK_SET)
 
+        self._record_command(verb, start_time, adb_process)
         return adb_process
 
+    @staticmethod
+    def _get_shell_verb(cmd):
+        """Returns the verb recorded in command_stats for a shell
+        command: shell: followed by the name of the program, e.g.
+        shell:pm for 'pm list packages', or shell:batch for the
+        commands combined by shell_batch()."""
+        if cmd.startswith('echo B_'):
+            return 'shell:batch'
+        words = cmd.split(None, 1)
+        if not words:
+            return 'shell:'
+        return 'shell:%s' % words[0].rstrip(';').split('/')[-1]
+
     def shell_bool(self, cmd, env=None, cwd=None, timeout=None, root=False):
         """Executes a shell command on the device returning True on success
         and False on failure.
@@ -1142,6 +2398,79 @@ class ADBDevice(ADBCommand):
                 adb_process.stdout_file.close()
                 adb_process.stderr_file.close()
 
+    def shell_batch(self, cmds, env=None, cwd=None, timeout=None,
+                    root=False):
+        """Executes a list of shell commands on the device using as few
+        adb shell invocations as possible, returning the output and exit
+        code of each command.
+
+        :param list cmds: The commands to be executed. Each command is
+            executed in its own subshell with stdin redirected from
+            /dev/null and stderr redirected to stdout. Later commands
+            are executed regardless of the exit codes of earlier
+            commands.
+        :param env: Contains the environment variables and their values.
+        :type env: dict or None
+        :param cwd: The directory from which to execute.
+        :type cwd: str or None
+        :param timeout: The maximum time in
+            seconds for any spawned adb process to complete before
+            throwing an ADBTimeoutError.  This timeout is per
+            adb call. The total time spent may exceed this
+            value. If it is not specified, the value set
+            in the ADBDevice constructor is used.
+        :type timeout: integer or None
+        :param bool root: Flag specifying if the commands
+            should be executed as root.
+        :returns: list of (output, exitcode) tuples in the same order
+            as cmds where output is the combined stdout and stderr of
+            the command with trailing whitespace removed.
+        :raises: * ADBTimeoutError
+                 * ADBRootError
+                 * ADBError
+
+        The commands are joined into a single command line delimited
+        by markers which are used to split the output. Since adb limits
+        the length of the command line, a long list of commands is
+        split across several adb shell invocations.
+        """
+        token = uuid.uuid4().hex[:12]
+        scripts = []
+        for index, cmd in enumerate(cmds):
+            if root:
+                cmd = self._get_root_command(cmd)
+            scripts.append('echo B_%s_%d; ( %s ) </dev/null 2>&1; '
+                           'rc=$?; echo; echo E_%s_%d_rc=$rc' %
+                           (token, index, cmd, token, index))
+        chunks = []
+        for script in scripts:
+            if chunks and len(chunks[-1]) + len(script) < SHELL_BATCH_MAX_LENGTH:
+                chunks[-1] += '; ' + script
+            else:
+                chunks.append(script)
+
+        output = ''
+        for chunk in chunks:
+            output += self.shell_output(chunk, env=env, cwd=cwd,
+                                        timeout=timeout) + '\n'
+
+        re_result = re.compile(r'^B_%s_(\d+)\r?\n(.*?)\r?\n'
+                               r'E_%s_\1_rc=(\d+)\r?$' % (token, token),
+                               re.M | re.S)
+        results = {}
+        for match in re_result.finditer(output):
+            results[int(match.group(1))] = (match.group(2).rstrip(),
+                                            int(match.group(3)))
+        if len(results) != len(cmds):
+            raise ADBError('shell_batch: missing results for %s' %
+                           [cmd for index, cmd in enumerate(cmds)
+                            if index not in results])
+        if self._verbose:
+            self._logger.debug('shell_batch: %s, results: %s' %
+                               (cmds, [results[index]
+                                       for index in range(len(cmds))]))
+        return [results[index] for index in range(len(cmds))]
+
     # Informational methods
 
     def _get_logcat_buffer_args(self, buffers):
@@ -1224,9 +2553,88 @@ class ADBDevice(ADBCommand):
 
         return lines
 
-    def get_prop(self, prop, timeout=None):
+    def get_logcat_reader(self, buffers=None, max_lines=100000):
+        """Returns the :class:`ADBLogcatReader` which streams adb logcat
+        -v time output for the device, starting it if necessary. The
+        same reader is returned until stop_logcat_reader() is called.
+
+        :param list buffers: Log buffers to retrieve. Valid buffers are
+            "radio", "events", and "main". Defaults to "main". Only
+            used when the reader is started.
+        :param integer max_lines: The maximum number of lines kept by
+            the reader. Only used when the reader is started.
+        :returns: :class:`ADBLogcatReader`
+        :raises: ADBError
+        """
+        reader = self._logcat_reader
+        if reader and reader.pid != os.getpid():
+            # The reader was inherited from the parent process. Leave
+            # it to the parent and start one of our own.
+            reader = None
+        if reader and reader.alive:
+            return reader
+        if buffers is None:
+            buffers = []
+        args = [self._adb_path]
+        if self._adb_host:
+            args.extend(['-H', self._adb_host])
+        if self._adb_port:
+            args.extend(['-P', str(self._adb_port)])
+        if self._device_serial:
+            args.extend(['-s', self._device_serial])
+        args.extend(['wait-for-device', 'logcat', '-v', 'time'])
+        args.extend(self._get_logcat_buffer_args(buffers))
+        args.append('*:V')
+        self._logcat_reader = ADBLogcatReader(args, self._logger,
+                                              max_lines=max_lines)
+        return self._logcat_reader
+
+    def stop_logcat_reader(self):
+        """Stops the logcat reader started by get_logcat_reader() if
+        any."""
+        if self._logcat_reader:
+            self._logcat_reader.stop()
+            self._logcat_reader = None
+
+    def get_props(self, timeout=None, refresh=False):
+        """Returns a dictionary of all of the device's properties.
+
+        The properties are read with a single adb shell getprop and are
+        cached. The snapshot is reused by later calls until the device
+        is rebooted or refresh is True.
+
+        :param timeout: The maximum time in
+            seconds for any spawned adb process to complete before
+            throwing an ADBTimeoutError.
+            This timeout is per adb call. The total time spent
+            may exceed this value. If it is not specified, the value
+            set in the ADBDevice constructor is used.
+        :type timeout: integer or None
+        :param bool refresh: Flag indicating that a new snapshot of the
+            properties is to be taken.
+        :returns: dict of property names and values.
+        :raises: * ADBTimeoutError
+                 * ADBError
+        """
+        if refresh or self._props is None:
+            output = self.shell_output('getprop', timeout=timeout)
+            # Each property is output as [name]: [value]. Values may
+            # span several lines.
+            re_prop = re.compile(r'^\[([^\]]+)\]: \[(.*?)\]\r?$', re.M | re.S)
+            self._props = dict(re_prop.findall(output))
+            self._props_time = time.time()
+        return dict(self._props)
+
+    def get_prop(self, prop, timeout=None, refresh=False):
         """Gets value of a property from the device via adb shell getprop.
 
+        The value is taken from the snapshot of the properties made by
+        get_props(). Read only ro.* properties are served from the
+        snapshot until the device is rebooted. Other properties are
+        read from the device unless prop_cache_ttl is set, in which
+        case they are served from the snapshot if it is less than
+        prop_cache_ttl seconds old.
+
         :param str prop: The propery name.
         :param timeout: The maximum time in
             seconds for any spawned adb process to complete before
@@ -1235,12 +2643,19 @@ class ADBDevice(ADBCommand):
             may exceed this value. If it is not specified, the value
             set in the ADBDevice constructor is used.
         :type timeout: integer or None
+        :param bool refresh: Flag indicating that a new snapshot of the
+            properties is to be taken.
         :returns: string value of property.
         :raises: * ADBTimeoutError
                  * ADBError
         """
-        output = self.shell_output('getprop %s' % prop, timeout=timeout)
-        return output
+        if (self._props is not None and
+            (not prop.startswith('ro.') or prop not in self._props) and
+            time.time() - self._props_time >= self.prop_cache_ttl):
+            refresh = True
+        if refresh or self._props is None:
+            self.get_props(timeout=timeout, refresh=True)
+        return self._props.get(prop, '')
 
     def get_state(self, timeout=None):
         """Returns the device's state via adb get-state.
@@ -1259,6 +2674,7 @@ class ADBDevice(ADBCommand):
         output = self.command_output(["get-state"], timeout=timeout).strip()
         return output
 
+    @_device_query('interfaces')
     def get_ip_address(self, interfaces=None, timeout=None):
         """Returns the device's ip address, or None if it doesn't have one
 
@@ -1279,7 +2695,7 @@ class ADBDevice(ADBCommand):
         """
         if not interfaces:
             interfaces = ["wlan0", "eth0"]
-            wifi_interface = self.shell_output('getprop wifi.interface', timeout=timeout)
+            wifi_interface = self.get_prop('wifi.interface', timeout=timeout)
             self._logger.debug('get_ip_address: wifi_interface: %s' % wifi_interface)
             if wifi_interface and wifi_interface not in interfaces:
                 interfaces = interfaces.append(wifi_interface)
@@ -1395,6 +2811,7 @@ class ADBDevice(ADBCommand):
         if not rv.startswith("remount succeeded"):
             raise ADBError("Unable to remount device")
 
+    @_device_modification(paths=('path',))
     def chmod(self, path, recursive=False, mask="777", timeout=None, root=False):
         """Recursively changes the permissions of a directory on the
         device.
@@ -1466,6 +2883,7 @@ class ADBDevice(ADBCommand):
                     self._logger.warning('chmod: entry %s does not exist' %
                                          entry)
 
+    @_device_query('path', 'root')
     def exists(self, path, timeout=None, root=False):
         """Returns True if the path exists on the device.
 
@@ -1486,6 +2904,7 @@ class ADBDevice(ADBCommand):
         path = posixpath.normpath(path)
         return self.shell_bool('ls -a %s' % path, timeout=timeout, root=root)
 
+    @_device_query('path', 'root')
     def is_dir(self, path, timeout=None, root=False):
         """Returns True if path is an existing directory on the device.
 
@@ -1564,6 +2983,7 @@ class ADBDevice(ADBCommand):
         self._logger.debug('list_files: %s' % data)
         return data
 
+    @_device_modification(paths=('path',))
     def mkdir(self, path, parents=False, timeout=None, root=False):
         """Create a directory on the device.
 
@@ -1616,7 +3036,42 @@ class ADBDevice(ADBCommand):
         if not self.is_dir(path, timeout=timeout, root=root):
             raise ADBError('mkdir %s Failed' % path)
 
-    def push(self, local, remote, timeout=None):
+    @contextlib.contextmanager
+    def _bulk_transfer(self, description):
+        """Context manager which holds a slot in the transfer
+        scheduler, if one is set, while a bulk transfer runs.
+
+        :param str description: description of the transfer for the
+            log.
+        """
+        if not self.transfer_scheduler:
+            yield
+            return
+        with self.transfer_scheduler.transfer(self.transfer_priority) as delay:
+            if delay >= 1:
+                self._logger.info('%s waited %.1f seconds for a transfer '
+                                  'slot' % (description, delay))
+            yield
+
+    def _get_archive_mode(self, archive):
+        """Returns the archive mode, 'tar' or 'tgz', to be used for a
+        directory transfer or None if the transfer is to use adb's per
+        file sync.
+        """
+        if archive is None:
+            archive = self.archive_transfers
+        if archive is True:
+            archive = 'tar'
+        if not archive or not self._tar:
+            return None
+        if archive not in ('tar', 'tgz'):
+            raise ADBError('Unknown archive mode %s' % archive)
+        if archive == 'tgz' and not self._tar_z:
+            return 'tar'
+        return archive
+
+    @_device_modification(paths=('remote',))
+    def push(self, local, remote, timeout=None, archive=None):
         """Pushes a file or directory to the device.
 
         :param str local: The name of the local file or
@@ -1630,13 +3085,52 @@ class ADBDevice(ADBCommand):
             may exceed this value. If it is not specified, the value
             set in the ADBDevice constructor is used.
         :type timeout: integer or None
+        :param archive: How a directory is transferred. 'tar' pushes
+            the directory as a single tar archive which is extracted
+            on the device, 'tgz' also compresses the archive, True is
+            equivalent to 'tar' and False uses adb's per file sync.
+            Defaults to None which
+            uses the archive_transfers attribute. Per file sync is
+            used if the device does not have tar and the archive is
+            not compressed if the device's tar does not support gzip.
+        :type archive: str, bool or None
         :raises: * ADBTimeoutError
                  * ADBError
         """
-        self.command_output(["push", os.path.realpath(local), remote],
-                            timeout=timeout)
-
-    def pull(self, remote, local, timeout=None):
+        archive = self._get_archive_mode(archive)
+        if archive and os.path.isdir(local):
+            self._push_archive(local, remote, archive, timeout=timeout)
+            return
+        with self._bulk_transfer('push %s' % remote):
+            self.command_output(["push", os.path.realpath(local), remote],
+                                timeout=timeout)
+
+    def _push_archive(self, local, remote, archive, timeout=None):
+        remote_archive = posixpath.join(self.test_root, 'push-%s.%s' % (
+            uuid.uuid4(), archive))
+        local_archive = tempfile.NamedTemporaryFile(suffix='.%s' % archive)
+        try:
+            tar = tarfile.open(fileobj=local_archive,
+                               mode='w:gz' if archive == 'tgz' else 'w')
+            try:
+                for name in os.listdir(local):
+                    tar.add(os.path.join(local, name), arcname=name)
+            finally:
+                tar.close()
+            local_archive.flush()
+            with self._bulk_transfer('push %s' % remote):
+                self.command_output(["push", local_archive.name,
+                                     remote_archive], timeout=timeout)
+        finally:
+            local_archive.close()
+        self.mkdir(remote, parents=True, timeout=timeout)
+        # Remove the archive even if the extraction fails while
+        # preserving the exit code of tar.
+        self.shell_output('%s -x%sf %s -C %s; rc=$?; rm %s; [ $rc -eq 0 ]' % (
+            self._tar, 'z' if archive == 'tgz' else '', remote_archive,
+            remote, remote_archive), timeout=timeout)
+
+    def pull(self, remote, local, timeout=None, archive=None):
         """Pulls a file or directory from the device.
 
         :param str remote: The path of the remote file or
@@ -1650,12 +3144,101 @@ class ADBDevice(ADBCommand):
             may exceed this value. If it is not specified, the value
             set in the ADBDevice constructor is used.
         :type timeout: integer or None
+        :param archive: How a directory is transferred. 'tar' creates
+            a single tar archive of the directory on the device which
+            is pulled and extracted on the host, 'tgz' also compresses
+            the archive, True is equivalent to 'tar' and False uses
+            adb's per file sync. Defaults to None which uses the
+            archive_transfers attribute. Per file sync is used if the
+            device does not have tar.
+        :type archive: str, bool or None
         :raises: * ADBTimeoutError
                  * ADBError
         """
-        self.command_output(["pull", remote, os.path.realpath(local)],
-                            timeout=timeout)
+        archive = self._get_archive_mode(archive)
+        if archive:
+            remote_archive = posixpath.join(self.test_root, 'pull-%s.%s' % (
+                uuid.uuid4(), archive))
+            # The archive can not be created within the directory
+            # being archived.
+            if (not remote_archive.startswith(remote.rstrip('/') + '/') and
+                self.is_dir(remote, timeout=timeout)):
+                if self._pull_archive(remote, local, remote_archive,
+                                      archive, timeout=timeout):
+                    return
+        with self._bulk_transfer('pull %s' % remote):
+            self.command_output(["pull", remote, os.path.realpath(local)],
+                                timeout=timeout)
+
+    def _pull_archive(self, remote, local, remote_archive, archive,
+                      timeout=None):
+        """Pulls the directory remote as an archive. Returns False if
+        the archive could not be created on the device, for example
+        because of an unreadable file, so that the caller can fall
+        back to adb's per file sync."""
+        try:
+            self.shell_output('%s -c%sf %s -C %s .' % (
+                self._tar, 'z' if archive == 'tgz' else '',
+                remote_archive, remote), timeout=timeout)
+        except ADBError, e:
+            self._logger.warning('Unable to archive %s, pulling it without '
+                                 'an archive: %s' % (remote, e))
+            self.rm(remote_archive, force=True, timeout=timeout)
+            return False
+        local_archive = tempfile.NamedTemporaryFile(suffix='.%s' % archive)
+        try:
+            try:
+                with self._bulk_transfer('pull %s' % remote):
+                    self.command_output(["pull", remote_archive,
+                                         local_archive.name],
+                                        timeout=timeout)
+            finally:
+                self.rm(remote_archive, force=True, timeout=timeout)
+            if not os.path.isdir(local):
+                os.makedirs(local)
+            tar = tarfile.open(local_archive.name)
+            try:
+                tar.extractall(local, self._get_archive_members(tar, local))
+            finally:
+                tar.close()
+        finally:
+            local_archive.close()
+        return True
+
+    def _get_archive_members(self, tar, local):
+        """Returns the members of the archive made on the device which
+        are extracted beneath local. Members with absolute paths or
+        with .. entries which escape local, and links to files outside
+        of local, are skipped."""
+        local = os.path.realpath(local)
+
+        def is_within(path):
+            path = os.path.normpath(os.path.join(local, path))
+            return path == local or path.startswith(local + os.sep)
+
+        members = []
+        for member in tar.getmembers():
+            if not is_within(member.name):
+                self._logger.warning('Skipping archive member %s outside '
+                                     'of %s' % (member.name, local))
+                continue
+            if member.issym():
+                target = posixpath.join(posixpath.dirname(member.name),
+                                        member.linkname)
+            elif member.islnk():
+                target = member.linkname
+            else:
+                target = None
+            if target is not None and not is_within(target):
+                self._logger.warning('Skipping archive member %s linked '
+                                     'to %s outside of %s' % (
+                                         member.name, member.linkname,
+                                         local))
+                continue
+            members.append(member)
+        return members
 
+    @_device_modification(paths=('path',))
     def rm(self, path, recursive=False, force=False, timeout=None, root=False):
         """Delete files or directories on the device.
 
@@ -1689,6 +3272,7 @@ class ADBDevice(ADBCommand):
             if not force and 'No such file or directory' in e.message:
                 raise
 
+    @_device_modification(paths=('path',))
     def rmdir(self, path, timeout=None, root=False):
         """Delete empty directory on the device.
 
@@ -1856,6 +3440,32 @@ class ADBDevice(ADBCommand):
             if self.process_exist(appname, timeout=timeout):
                 raise e
 
+    def _get_process_app(self, process_name):
+        """Returns the name which identifies process_name in the
+        process list.
+
+        :param str process_name: The name of the process, optionally
+            preceded by a quoted environment string and followed by
+            arguments.
+        :raises: * ADBError
+        """
+        if not isinstance(process_name, basestring):
+            raise ADBError("Process name %s is not a string" % process_name)
+
+        # Filter out extra spaces.
+        parts = [x for x in process_name.split(' ') if x != '']
+        process_name = ' '.join(parts)
+
+        # Filter out the quoted env string if it exists
+        # ex: '"name=value;name2=value2;etc=..." process args' -> 'process args'
+        parts = process_name.split('"')
+        if len(parts) > 2:
+            process_name = ' '.join(parts[2:]).strip()
+
+        pieces = process_name.split(' ')
+        parts = pieces[0].split('/')
+        return parts[-1]
+
     def process_exist(self, process_name, timeout=None):
         """Returns True if process with name process_name is running on
         device.
@@ -1875,22 +3485,7 @@ class ADBDevice(ADBCommand):
         :raises: * ADBTimeoutError
                  * ADBError
         """
-        if not isinstance(process_name, basestring):
-            raise ADBError("Process name %s is not a string" % process_name)
-
-        # Filter out extra spaces.
-        parts = [x for x in process_name.split(' ') if x != '']
-        process_name = ' '.join(parts)
-
-        # Filter out the quoted env string if it exists
-        # ex: '"name=value;name2=value2;etc=..." process args' -> 'process args'
-        parts = process_name.split('"')
-        if len(parts) > 2:
-            process_name = ' '.join(parts[2:]).strip()
-
-        pieces = process_name.split(' ')
-        parts = pieces[0].split('/')
-        app = parts[-1]
+        app = self._get_process_app(process_name)
 
         proc_list = self.get_process_list(timeout=timeout)
         if not proc_list:
@@ -1904,6 +3499,60 @@ class ADBDevice(ADBCommand):
                 return True
         return False
 
+    def wait_for_process_exit(self, process_names, max_wait_time=60,
+                              timeout=None):
+        """Waits for up to max_wait_time seconds for the processes
+        named in process_names to exit.
+
+        The process list is checked once a second by a loop which
+        runs on the device in a single adb shell, so the wait returns
+        within a second of the processes exiting without an adb
+        round trip for each check.
+
+        :param process_names: The name or list of names of the
+            processes. Note that only the first 75 characters of the
+            process names are significant.
+        :param max_wait_time: The maximum time in seconds to wait
+            for the processes to exit.
+        :param timeout: The maximum time in
+            seconds for any spawned adb process to complete in
+            addition to max_wait_time before throwing an
+            ADBTimeoutError. If it is not specified, the value set
+            in the ADBDevice constructor is used.
+        :type timeout: integer or None
+        :returns: boolean - True if none of the processes are running.
+
+        :raises: * ADBTimeoutError
+                 * ADBError
+        """
+        if isinstance(process_names, basestring):
+            process_names = [process_names]
+        tests = []
+        for process_name in process_names:
+            app = self._get_process_app(process_name)[:75]
+            if "'" in app:
+                raise ADBError("Process name %s contains a quote" % app)
+            tests.append('[ "${w##*/}" = \'%s\' ]' % app)
+        # Each word of the ps output is compared against the process
+        # names as get_process_list() and process_exist() would compare
+        # its last column.
+        cmd = ('i=0; while :; do r=; '
+               'for w in $(ps); do if %s; then r=1; break; fi; done; '
+               'if [ -z "$r" ]; then echo exited; break; fi; '
+               'if [ $i -ge %d ]; then echo running; break; fi; '
+               'sleep 1; i=$((i+1)); done' % (' || '.join(tests),
+                                              max_wait_time))
+        if timeout is None:
+            timeout = self._timeout
+        output = self.shell_output(cmd, timeout=timeout + max_wait_time)
+        if output == 'exited':
+            return True
+        if output == 'running':
+            return False
+        raise ADBError('wait_for_process_exit: unexpected output: %s' %
+                       output)
+
+    @_device_modification(paths=('destination',))
     def cp(self, source, destination, recursive=False, timeout=None,
            root=False):
         """Copies a file or directory on the device.
@@ -1976,6 +3625,7 @@ class ADBDevice(ADBCommand):
                     recursive=recursive,
                     timeout=timeout, root=root)
 
+    @_device_modification(paths=('source', 'destination'))
     def mv(self, source, destination, timeout=None, root=False):
         """Moves a file or directory on the device.
 
@@ -1998,6 +3648,7 @@ class ADBDevice(ADBCommand):
         self.shell_output('mv %s %s' % (source, destination), timeout=timeout,
                           root=root)
 
+    @_device_modification(clear=True)
     def reboot(self, timeout=None):
         """Reboots the device.
 
@@ -2014,6 +3665,8 @@ class ADBDevice(ADBCommand):
         wait for the device to complete rebooting, then calls is_device_ready()
         to determine if the device has completed booting.
         """
+        self.close_shell_session()
+        self._props = None
         self.command_output(["reboot"], timeout=timeout)
         # command_output automatically inserts a 'wait-for-device'
         # argument to adb. Issuing an empty command is the same as adb
@@ -2094,8 +3747,8 @@ class ADBDevice(ADBCommand):
         if 'id' in directives:
             info['id'] = self.command_output(['get-serialno'], timeout=timeout)
         if 'os' in directives:
-            info['os'] = self.shell_output('getprop ro.build.display.id',
-                                           timeout=timeout)
+            info['os'] = self.get_prop('ro.build.display.id',
+                                       timeout=timeout)
         if 'process' in directives:
             ps = self.shell_output('ps', timeout=timeout)
             info['process'] = ps.splitlines()
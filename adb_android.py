@@ -10,7 +10,7 @@ from abc import ABCMeta
 
 import version_codes
 
-from adb import ADBDevice, ADBError
+from adb import ADBDevice, ADBError, _device_modification, _device_query
 
 
 class ADBAndroid(ADBDevice):
@@ -28,6 +28,8 @@ class ADBAndroid(ADBDevice):
     """
     __metaclass__ = ABCMeta
 
+    _capability_names = ADBDevice._capability_names + ('selinux', 'version')
+
     def __init__(self,
                  device=None,
                  adb='adb',
@@ -38,7 +40,11 @@ class ADBAndroid(ADBDevice):
                  timeout=300,
                  verbose=False,
                  device_ready_retry_wait=20,
-                 device_ready_retry_attempts=3):
+                 device_ready_retry_attempts=3,
+                 use_shell_session=False,
+                 transport=None,
+                 output_buffer_size=0,
+                 capability_cache=None):
         """Initializes the ADBAndroid object.
 
         :param device: When a string is passed, it is interpreted as the
@@ -68,6 +74,22 @@ class ADBAndroid(ADBDevice):
             reboot.
         :param integer device_ready_retry_attempts: number of attempts when
             checking if a device is ready.
+        :param bool use_shell_session: Flag indicating that shell
+            commands are to be executed in a persistent adb shell
+            session rather than in a new adb process per command.
+            Defaults to False.
+        :param transport: Optional transport such as
+            :class:`adb_transport.ADBServerTransport` used to execute
+            the commands it supports without spawning an adb process.
+            Defaults to None.
+        :param integer output_buffer_size: If non-zero, the output of
+            adb processes is captured in memory and only written to
+            temporary files if it exceeds this many bytes. Defaults
+            to 0 which always uses temporary files.
+        :param capability_cache: Optional :class:`adb.ADBCapabilityCache`
+            used to avoid probing the device's capabilities if they
+            were saved for the device's current build. Defaults to
+            None.
 
         :raises: * ADBError
                  * ADBTimeoutError
@@ -79,23 +101,36 @@ class ADBAndroid(ADBDevice):
                            logger_name=logger_name, timeout=timeout,
                            verbose=verbose,
                            device_ready_retry_wait=device_ready_retry_wait,
-                           device_ready_retry_attempts=device_ready_retry_attempts)
+                           device_ready_retry_attempts=device_ready_retry_attempts,
+                           use_shell_session=use_shell_session,
+                           transport=transport,
+                           output_buffer_size=output_buffer_size,
+                           capability_cache=capability_cache)
         # https://source.android.com/devices/tech/security/selinux/index.html
         # setenforce
         # usage:  setenforce [ Enforcing | Permissive | 1 | 0 ]
         # getenforce returns either Enforcing or Permissive
 
         try:
-            self.selinux = True
-            if self.shell_output('getenforce', timeout=timeout) != 'Permissive':
+            if (self.selinux and
+                self.shell_output('getenforce', timeout=timeout) != 'Permissive'):
                 self._logger.info('Setting SELinux Permissive Mode')
                 self.shell_output("setenforce Permissive", timeout=timeout, root=True)
         except ADBError:
             self.selinux = False
 
-        self.version = int(self.shell_output("getprop ro.build.version.sdk",
-                                             timeout=timeout))
+    def _probe_capabilities(self, timeout=None):
+        ADBDevice._probe_capabilities(self, timeout=timeout)
+        try:
+            self.shell_output('getenforce', timeout=timeout)
+            self.selinux = True
+        except ADBError:
+            self.selinux = False
+
+        self.version = int(self.get_prop("ro.build.version.sdk",
+                                         timeout=timeout))
 
+    @_device_modification(clear=True)
     def reboot(self, timeout=None):
         """Reboots the device.
 
@@ -198,33 +233,49 @@ class ADBAndroid(ADBDevice):
                     failure = "Device state: %s" % state
                     success = False
                 else:
-                    if (self.selinux and
-                        self.shell_output('getenforce',
-                                          timeout=timeout) != 'Permissive'):
+                    # Check SELinux and the test root in a single adb
+                    # shell invocation as root.
+                    cmds = ['rmdir %s' % ready_path,
+                            'mkdir %s' % ready_path,
+                            'rmdir %s' % ready_path]
+                    if self.selinux:
+                        cmds.append('getenforce')
+                    results = self.shell_batch(cmds, timeout=timeout,
+                                               root=True)
+                    if self.selinux and results.pop()[0] != 'Permissive':
                         self._logger.info('Setting SELinux Permissive Mode')
                         self.shell_output("setenforce Permissive", timeout=timeout, root=True)
-                    if self.is_dir(ready_path, timeout=timeout, root=True):
-                        self.rmdir(ready_path, timeout=timeout, root=True)
-                    self.mkdir(ready_path, timeout=timeout, root=True)
-                    self.rmdir(ready_path, timeout=timeout, root=True)
-                    # Invoke the pm list commands to see if it is up and
+                    # The result of the initial rmdir of a ready
+                    # directory left over from a previous check is
+                    # ignored.
+                    for cmd, (data, exitcode) in zip(cmds[1:], results[1:]):
+                        if exitcode != 0:
+                            failure = '%s: %s' % (cmd, data)
+                            success = False
+                            break
+                if success:
+                    # Invoke the pm list commands in a second invocation
+                    # without root, since pm is broken under su on some
+                    # builds, to see if the package manager is up and
                     # running.
-                    for pm_list_cmd in pm_list_commands:
-                        data = self.shell_output("pm list %s" % pm_list_cmd,
-                                                 timeout=timeout)
+                    cmds = ['pm list %s' % pm_list_cmd
+                            for pm_list_cmd in pm_list_commands]
+                    results = self.shell_batch(cmds, timeout=timeout)
+                    for cmd, (data, exitcode) in zip(cmds, results):
                         if pm_error_string in data:
-                            failure = data
+                            failure = '%s: %s' % (cmd, data)
                             success = False
                             break
             except ADBError, e:
                 success = False
                 failure = e.message
 
-            if not success:
-                self._logger.debug('Attempt %s of %s device not ready: %s' % (
-                    attempt+1, self._device_ready_retry_attempts,
-                    failure))
-                time.sleep(self._device_ready_retry_wait)
+            if success:
+                break
+            self._logger.debug('Attempt %s of %s device not ready: %s' % (
+                attempt+1, self._device_ready_retry_attempts,
+                failure))
+            time.sleep(self._device_ready_retry_wait)
 
         return success
 
@@ -254,6 +305,7 @@ class ADBAndroid(ADBDevice):
 
     # Application management methods
 
+    @_device_modification(all_apps=True)
     def install_app(self, apk_path, timeout=None):
         """Installs an app on the device.
 
@@ -272,11 +324,13 @@ class ADBAndroid(ADBDevice):
         if self.version >= version_codes.M:
             cmd.append("-g")
         cmd.append(apk_path)
-        data = self.command_output(cmd, timeout=timeout)
+        with self._bulk_transfer('install %s' % apk_path):
+            data = self.command_output(cmd, timeout=timeout)
         if data.find('Success') == -1:
             raise ADBError("install failed for %s. Got: %s" %
                            (apk_path, data))
 
+    @_device_query('app_name')
     def is_app_installed(self, app_name, timeout=None):
         """Returns True if an app is installed on the device.
 
@@ -444,6 +498,7 @@ class ADBAndroid(ADBDevice):
                 # racey, but it's the best we can do)
                 time.sleep(1)
 
+    @_device_modification(apps=('app_name',))
     def uninstall_app(self, app_name, reboot=False, timeout=None):
         """Uninstalls an app on the device.
 
@@ -470,6 +525,48 @@ class ADBAndroid(ADBDevice):
             if reboot:
                 self.reboot(timeout=timeout)
 
+    @_device_modification(apps=('app_names',))
+    def uninstall_apps(self, app_names, reboot=False, timeout=None):
+        """Uninstalls a list of apps on the device. The installed
+        packages are listed and the installed apps are uninstalled
+        using a single adb shell invocation each.
+
+        :param list app_names: The names of the apps to be
+            uninstalled.
+        :param bool reboot: Flag indicating that the device should
+            be rebooted after the apps are uninstalled. No reboot occurs
+            if none of the apps are installed.
+        :param timeout: The maximum time in
+            seconds for any spawned adb process to complete before
+            throwing an ADBTimeoutError.
+            This timeout is per adb call. The total time spent
+            may exceed this value. If it is not specified, the value
+            set in the ADB constructor is used.
+        :type timeout: integer or None
+        :raises: * ADBTimeoutError
+                 * ADBError
+        """
+        pm_error_string = 'Error: Could not access the Package Manager'
+        data = self.shell_output("pm list package", timeout=timeout)
+        if pm_error_string in data:
+            raise ADBError(pm_error_string)
+        packages = set([line.replace('package:', '').strip()
+                        for line in data.splitlines()])
+        installed = [app_name for app_name in app_names
+                     if app_name in packages]
+        if not installed:
+            return
+        results = self.shell_batch(["pm uninstall %s" % app_name
+                                    for app_name in installed],
+                                   timeout=timeout)
+        for app_name, (data, exitcode) in zip(installed, results):
+            if data.find('Success') == -1:
+                self._logger.debug('uninstall_apps failed: %s' % data)
+                raise ADBError("uninstall failed for %s. Got: %s" % (app_name, data))
+        if reboot:
+            self.reboot(timeout=timeout)
+
+    @_device_modification(all_apps=True, clear=True)
     def update_app(self, apk_path, timeout=None):
         """Updates an app on the device and reboots.
 
@@ -489,6 +586,7 @@ class ADBAndroid(ADBDevice):
         if self.version >= version_codes.M:
             cmd.append("-g")
         cmd.append(apk_path)
-        output = self.command_output(cmd, timeout=timeout)
+        with self._bulk_transfer('update %s' % apk_path):
+            output = self.command_output(cmd, timeout=timeout)
         self.reboot(timeout=timeout)
         return output
@@ -0,0 +1,472 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import StringIO
+import errno
+import logging
+import os
+import posixpath
+import socket
+import stat
+import struct
+import time
+
+from adb import ADBCompletedProcess
+
+# Maximum size of a sync DATA packet.
+SYNC_DATA_MAX = 64 * 1024
+
+
+class ADBServerFailure(Exception):
+    """ADBServerFailure is raised when the adb server or the device
+    responds to a request with FAIL."""
+    pass
+
+
+class ADBServerTransport(object):
+    """ADBServerTransport executes adb commands by speaking the adb
+    server's wire protocol directly over TCP rather than spawning an
+    adb process per command.
+
+    Pass an instance as the transport argument to :class:`ADBHost`,
+    :class:`ADBDevice` or :class:`ADBAndroid`. Commands which the
+    transport does not implement, or which can not be sent because
+    the adb server is not running, are executed by the adb executable
+    as usual.
+
+    ::
+
+       from adb_android import ADBAndroid
+       from adb_transport import ADBServerTransport
+
+       adbdevice = ADBAndroid(device='0123456789ABCDEF',
+                              transport=ADBServerTransport())
+
+    Requests are sent as a four digit hexadecimal length followed by
+    the request. The server responds with OKAY or with FAIL followed
+    by a hexadecimal length and an error message. Device services are
+    requested by first switching the connection to the device via
+    host:transport:<serial>.
+    """
+
+    def __init__(self, adb_host=None, adb_port=None, logger_name='adb'):
+        """Initializes the ADBServerTransport object.
+
+        :param adb_host: host of the adb server. Defaults to localhost.
+        :type adb_host: str or None
+        :param adb_port: port of the adb server. Defaults to 5037.
+        :type adb_port: integer or None
+        :param str logger_name: logging logger name. Defaults to 'adb'.
+        """
+        self.adb_host = adb_host or 'localhost'
+        self.adb_port = int(adb_port or 5037)
+        self._logger = logging.getLogger(logger_name)
+        #: Seconds to wait between attempts to connect to a device
+        #: which is not yet available.
+        self.device_wait_interval = 1
+
+    # Low level protocol methods
+
+    def _connect(self, deadline):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout('timed out connecting to adb server')
+        sock = socket.create_connection((self.adb_host, self.adb_port),
+                                        timeout=remaining)
+        return sock
+
+    def _settimeout(self, sock, deadline):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout('timed out')
+        sock.settimeout(remaining)
+
+    def _send(self, sock, data, deadline):
+        self._settimeout(sock, deadline)
+        sock.sendall(data)
+
+    def _send_request(self, sock, request, deadline):
+        self._send(sock, '%04x%s' % (len(request), request), deadline)
+
+    def _recv_exactly(self, sock, length, deadline):
+        chunks = []
+        while length > 0:
+            self._settimeout(sock, deadline)
+            chunk = sock.recv(min(length, SYNC_DATA_MAX))
+            if not chunk:
+                raise EOFError('adb server closed the connection')
+            chunks.append(chunk)
+            length -= len(chunk)
+        return ''.join(chunks)
+
+    def _recv_all(self, sock, deadline):
+        chunks = []
+        while True:
+            self._settimeout(sock, deadline)
+            chunk = sock.recv(SYNC_DATA_MAX)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def _recv_hex_data(self, sock, deadline):
+        length = int(self._recv_exactly(sock, 4, deadline), 16)
+        return self._recv_exactly(sock, length, deadline)
+
+    def _recv_status(self, sock, deadline):
+        status = self._recv_exactly(sock, 4, deadline)
+        if status == 'OKAY':
+            return
+        if status == 'FAIL':
+            raise ADBServerFailure(self._recv_hex_data(sock, deadline))
+        raise ADBServerFailure('unexpected response from adb server: %s' %
+                               status)
+
+    def _request(self, request, deadline, sock=None):
+        if sock is None:
+            sock = self._connect(deadline)
+        try:
+            self._send_request(sock, request, deadline)
+            self._recv_status(sock, deadline)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def _device_connection(self, device_serial, deadline):
+        """Returns a socket connected to the device's adbd. As with adb
+        wait-for-device, waits until the device is available or the
+        deadline passes."""
+        if device_serial:
+            request = 'host:transport:%s' % device_serial
+        else:
+            request = 'host:transport-any'
+        while True:
+            try:
+                return self._request(request, deadline)
+            except ADBServerFailure, e:
+                message = str(e)
+                if ('not found' not in message and
+                    'offline' not in message and
+                    'no devices' not in message):
+                    raise
+                if time.time() + self.device_wait_interval >= deadline:
+                    raise socket.timeout('waiting for device: %s' % message)
+                time.sleep(self.device_wait_interval)
+
+    def host_query(self, request, timeout=300):
+        """Sends a host request to the adb server and returns its
+        length prefixed response.
+
+        :param str request: The host request, e.g. host:devices.
+        :param integer timeout: The maximum time in seconds.
+        :returns: string - the response data.
+        :raises: * ADBServerFailure
+                 * socket.error
+        """
+        deadline = time.time() + timeout
+        sock = self._request(request, deadline)
+        try:
+            return self._recv_hex_data(sock, deadline)
+        finally:
+            sock.close()
+
+    def device_service(self, service, device_serial=None, timeout=300):
+        """Requests a service on the device such as shell:<cmd> and
+        returns everything the service writes until it closes the
+        connection.
+
+        :param str service: The device service.
+        :param device_serial: The device's serial number.
+        :type device_serial: str or None
+        :param integer timeout: The maximum time in seconds.
+        :returns: string - the output of the service.
+        :raises: * ADBServerFailure
+                 * socket.error
+        """
+        deadline = time.time() + timeout
+        sock = self._device_connection(device_serial, deadline)
+        try:
+            self._request(service, deadline, sock=sock)
+            return self._recv_all(sock, deadline)
+        finally:
+            sock.close()
+
+    # Sync protocol methods
+
+    def _sync_send_request(self, sock, sync_id, path, deadline):
+        self._send(sock, sync_id + struct.pack('<I', len(path)) + path,
+                   deadline)
+
+    def _sync_recv_header(self, sock, deadline):
+        header = self._recv_exactly(sock, 8, deadline)
+        sync_id = header[:4]
+        length = struct.unpack('<I', header[4:])[0]
+        if sync_id == 'FAIL':
+            raise ADBServerFailure(self._recv_exactly(sock, length, deadline))
+        return sync_id, length
+
+    def _sync_stat(self, sock, path, deadline):
+        self._sync_send_request(sock, 'STAT', path, deadline)
+        data = self._recv_exactly(sock, 16, deadline)
+        if data[:4] != 'STAT':
+            raise ADBServerFailure('unexpected sync response: %s' % data[:4])
+        mode, size, mtime = struct.unpack('<III', data[4:])
+        return mode, size, mtime
+
+    def _sync_list(self, sock, path, deadline):
+        self._sync_send_request(sock, 'LIST', path, deadline)
+        entries = []
+        while True:
+            data = self._recv_exactly(sock, 20, deadline)
+            sync_id = data[:4]
+            if sync_id == 'DONE':
+                break
+            if sync_id != 'DENT':
+                raise ADBServerFailure('unexpected sync response: %s' %
+                                       sync_id)
+            mode, size, mtime, namelen = struct.unpack('<IIII', data[4:])
+            name = self._recv_exactly(sock, namelen, deadline)
+            if name not in ('.', '..'):
+                entries.append((name, mode))
+        return entries
+
+    def _sync_send_file(self, sock, local, remote, deadline):
+        st = os.stat(local)
+        self._sync_send_request(sock, 'SEND',
+                                '%s,%d' % (remote, stat.S_IMODE(st.st_mode)),
+                                deadline)
+        with open(local, 'rb') as f:
+            while True:
+                data = f.read(SYNC_DATA_MAX)
+                if not data:
+                    break
+                self._send(sock, 'DATA' + struct.pack('<I', len(data)) + data,
+                           deadline)
+        self._send(sock, 'DONE' + struct.pack('<I', int(st.st_mtime)),
+                   deadline)
+        self._sync_recv_header(sock, deadline)
+
+    def _sync_recv_file(self, sock, remote, local, deadline):
+        self._sync_send_request(sock, 'RECV', remote, deadline)
+        with open(local, 'wb') as f:
+            while True:
+                sync_id, length = self._sync_recv_header(sock, deadline)
+                if sync_id == 'DONE':
+                    break
+                if sync_id != 'DATA':
+                    raise ADBServerFailure('unexpected sync response: %s' %
+                                           sync_id)
+                f.write(self._recv_exactly(sock, length, deadline))
+
+    def push(self, local, remote, device_serial=None, timeout=300):
+        """Pushes a file or the contents of a directory to the device
+        using the sync protocol. The semantics match those of adb push.
+
+        :param str local: The local file or directory.
+        :param str remote: The remote file or directory.
+        :param device_serial: The device's serial number.
+        :type device_serial: str or None
+        :param integer timeout: The maximum time in seconds.
+        :returns: string - a summary of the transfer.
+        :raises: * ADBServerFailure
+                 * socket.error
+                 * IOError
+        """
+        deadline = time.time() + timeout
+        sock = self._device_connection(device_serial, deadline)
+        count = 0
+        try:
+            self._request('sync:', deadline, sock=sock)
+            if os.path.isdir(local):
+                for dirpath, dirnames, filenames in os.walk(local):
+                    relpath = os.path.relpath(dirpath, local)
+                    for filename in filenames:
+                        if relpath == '.':
+                            remote_path = posixpath.join(remote, filename)
+                        else:
+                            remote_path = posixpath.join(
+                                remote, relpath.replace(os.sep, '/'), filename)
+                        self._sync_send_file(sock,
+                                             os.path.join(dirpath, filename),
+                                             remote_path, deadline)
+                        count += 1
+            else:
+                mode = self._sync_stat(sock, remote, deadline)[0]
+                if stat.S_ISDIR(mode):
+                    remote = posixpath.join(remote, os.path.basename(local))
+                self._sync_send_file(sock, local, remote, deadline)
+                count += 1
+            self._send(sock, 'QUIT' + struct.pack('<I', 0), deadline)
+        finally:
+            sock.close()
+        return '%d file(s) pushed.' % count
+
+    def pull(self, remote, local, device_serial=None, timeout=300):
+        """Pulls a file or the contents of a directory from the device
+        using the sync protocol. The semantics match those of adb pull.
+
+        :param str remote: The remote file or directory.
+        :param str local: The local file or directory.
+        :param device_serial: The device's serial number.
+        :type device_serial: str or None
+        :param integer timeout: The maximum time in seconds.
+        :returns: string - a summary of the transfer.
+        :raises: * ADBServerFailure
+                 * socket.error
+                 * IOError
+        """
+        deadline = time.time() + timeout
+        sock = self._device_connection(device_serial, deadline)
+        count = 0
+        try:
+            self._request('sync:', deadline, sock=sock)
+            mode = self._sync_stat(sock, remote, deadline)[0]
+            if mode == 0:
+                raise ADBServerFailure("remote object '%s' does not exist" %
+                                       remote)
+            if stat.S_ISDIR(mode):
+                pending = [(remote, local)]
+                while pending:
+                    remote_dir, local_dir = pending.pop()
+                    if not os.path.isdir(local_dir):
+                        os.makedirs(local_dir)
+                    for name, mode in self._sync_list(sock, remote_dir,
+                                                      deadline):
+                        remote_path = posixpath.join(remote_dir, name)
+                        local_path = os.path.join(local_dir, name)
+                        if stat.S_ISDIR(mode):
+                            pending.append((remote_path, local_path))
+                        elif stat.S_ISREG(mode) or stat.S_ISLNK(mode):
+                            self._sync_recv_file(sock, remote_path,
+                                                 local_path, deadline)
+                            count += 1
+            else:
+                if os.path.isdir(local):
+                    local = os.path.join(local, posixpath.basename(remote))
+                self._sync_recv_file(sock, remote, local, deadline)
+                count += 1
+            self._send(sock, 'QUIT' + struct.pack('<I', 0), deadline)
+        finally:
+            sock.close()
+        return '%d file(s) pulled.' % count
+
+    # ADBCommand interface
+
+    def _quote(self, arg):
+        return "'%s'" % arg.replace("'", "'\\''")
+
+    def command(self, args, cmds, device_serial=None, timeout=300):
+        """Executes an adb command via the adb server.
+
+        :param list args: The equivalent adb command line, used to
+            describe the command in the result.
+        :param list cmds: The adb command and its arguments.
+        :param device_serial: The device's serial number if the
+            command is to be executed against a specific device.
+        :type device_serial: str or None
+        :param integer timeout: The maximum time in seconds.
+        :returns: :class:`ADBCompletedProcess` or None if the command
+            is not supported by the transport or the adb server could
+            not be reached, in which case the caller should execute
+            the command with the adb executable.
+        """
+        if not cmds:
+            handler = self._wait_for_device
+        else:
+            handler = getattr(self, '_cmd_%s' % cmds[0].replace('-', '_'),
+                              None)
+        if handler is None:
+            return None
+
+        adb_process = ADBCompletedProcess(args)
+        deadline = time.time() + timeout
+        try:
+            output = handler(cmds[1:], device_serial, deadline)
+            if output is None:
+                return None
+            adb_process.stdout_file = StringIO.StringIO(output)
+            adb_process.exitcode = 0
+        except socket.timeout, e:
+            adb_process.timedout = True
+            adb_process.stderr_file = StringIO.StringIO('%s' % e)
+        except socket.error, e:
+            if e.errno == errno.ECONNREFUSED:
+                # The adb server is not running. Let the adb
+                # executable start it.
+                self._logger.debug('adb server transport: %s' % e)
+                return None
+            adb_process.exitcode = 1
+            adb_process.stderr_file = StringIO.StringIO('error: %s' % e)
+        except (ADBServerFailure, EOFError, IOError, OSError), e:
+            adb_process.exitcode = 1
+            adb_process.stderr_file = StringIO.StringIO('error: %s' % e)
+        return adb_process
+
+    def _wait_for_device(self, cmds, device_serial, deadline):
+        self._device_connection(device_serial, deadline).close()
+        return ''
+
+    def _cmd_devices(self, cmds, device_serial, deadline):
+        if cmds and cmds[0] == '-l':
+            request = 'host:devices-l'
+        elif cmds:
+            return None
+        else:
+            request = 'host:devices'
+        data = self.host_query(request, timeout=deadline - time.time())
+        return 'List of devices attached \n%s\n' % data
+
+    def _host_serial_query(self, query, device_serial, deadline):
+        if device_serial:
+            request = 'host-serial:%s:%s' % (device_serial, query)
+        else:
+            request = 'host:%s' % query
+        return self.host_query(request, timeout=deadline - time.time())
+
+    def _cmd_get_state(self, cmds, device_serial, deadline):
+        return self._host_serial_query('get-state', device_serial, deadline)
+
+    def _cmd_get_serialno(self, cmds, device_serial, deadline):
+        return self._host_serial_query('get-serialno', device_serial,
+                                       deadline)
+
+    def _device_service(self, service, device_serial, deadline):
+        return self.device_service(service, device_serial=device_serial,
+                                   timeout=deadline - time.time())
+
+    def _cmd_shell(self, cmds, device_serial, deadline):
+        if not cmds:
+            # Interactive shells are left to the adb executable.
+            return None
+        return self._device_service('shell:%s' % ' '.join(cmds),
+                                    device_serial, deadline)
+
+    def _cmd_logcat(self, cmds, device_serial, deadline):
+        return self._device_service(
+            'shell:export ANDROID_LOG_TAGS="" ; exec logcat %s' %
+            ' '.join([self._quote(arg) for arg in cmds]),
+            device_serial, deadline)
+
+    def _cmd_reboot(self, cmds, device_serial, deadline):
+        return self._device_service('reboot:%s' % ''.join(cmds[:1]),
+                                    device_serial, deadline)
+
+    def _cmd_root(self, cmds, device_serial, deadline):
+        return self._device_service('root:', device_serial, deadline)
+
+    def _cmd_remount(self, cmds, device_serial, deadline):
+        return self._device_service('remount:', device_serial, deadline)
+
+    def _cmd_push(self, cmds, device_serial, deadline):
+        if len(cmds) != 2:
+            return None
+        return self.push(cmds[0], cmds[1], device_serial=device_serial,
+                         timeout=deadline - time.time())
+
+    def _cmd_pull(self, cmds, device_serial, deadline):
+        if len(cmds) != 2:
+            return None
+        return self.pull(cmds[0], cmds[1], device_serial=device_serial,
+                         timeout=deadline - time.time())
@@ -19,6 +19,7 @@ import socket
 import subprocess
 import sys
 import threading
+import time
 import traceback
 
 from manifestparser import TestManifest
@@ -28,8 +29,9 @@ import buildserver
 import jobs
 import utils
 
-from adb import ADBHost
+from adb import ADBCapabilityCache, ADBHost, ADBQueryCache
 from adb_android import ADBAndroid
+from adb_transport import ADBServerTransport
 from autophonepulsemonitor import AutophonePulseMonitor
 from autophonetreeherder import AutophoneTreeherder
 from mailer import Mailer
@@ -38,6 +40,7 @@ from phonestatus import PhoneStatus
 from phonetest import PhoneTest
 from process_states import ProcessStates
 from sensitivedatafilter import SensitiveDataFilter
+from transferscheduler import TransferScheduler
 from worker import PhoneWorker
 
 logger = None
@@ -121,11 +124,23 @@ class AutoPhone(object):
         self.mailer = Mailer(options.emailcfg, '[autophone] ')
 
         self._next_worker_num = 0
+        # Workers are notified of their new jobs through the job
+        # notifier, which must be given each worker's device before the
+        # worker is started.
+        self.job_notifier = jobs.JobNotifier()
         self.jobs = jobs.Jobs(self.mailer,
-                              allow_duplicates=options.allow_duplicate_jobs)
+                              allow_duplicates=options.allow_duplicate_jobs,
+                              notifier=self.job_notifier)
         self.phone_workers = {}  # indexed by phone id
         self.lock = threading.RLock()
         self.shared_lock = multiprocessing.Lock()
+        # The transfer scheduler's shared state must be created
+        # before the workers are started.
+        if options.max_concurrent_transfers > 0:
+            self.transfer_scheduler = TransferScheduler(
+                options.max_concurrent_transfers)
+        else:
+            self.transfer_scheduler = None
         self._tests = []
         self._devices = {} # dict indexed by device names found in devices ini file
         self.server = None
@@ -475,40 +490,36 @@ class AutoPhone(object):
 
         logger.debug('new_job: revision_hash %s' % revision_hash)
 
+        # Determine which phones will test this build and which tests
+        # they will run, then queue the jobs for all of them at once.
+        device_tests = {}
         phoneids = set([test.phone.id for test in tests])
         for phoneid in phoneids:
-            p = self.phone_workers[phoneid]
             logger.debug('new_job: worker phoneid %s' % phoneid)
-            # Determine if we will test this build, which tests to run and if we
-            # need to enable unittests.
             runnable_tests = PhoneTest.match(tests=tests, phoneid=phoneid)
             if not runnable_tests:
                 logger.debug('new_job: Ignoring build %s for phone %s' % (build_url, phoneid))
                 continue
-            enable_unittests = False
-            for t in runnable_tests:
-                enable_unittests = enable_unittests or t.enable_unittests
-
-            new_tests = self.jobs.new_job(build_url,
-                                          build_id=build_data['id'],
-                                          changeset=build_data['changeset'],
-                                          tree=build_data['repo'],
-                                          revision=build_data['revision'],
-                                          revision_hash=revision_hash,
-                                          tests=runnable_tests,
-                                          enable_unittests=enable_unittests,
-                                          device=phoneid)
-            if new_tests:
-                self.treeherder.submit_pending(phoneid,
-                                               build_url,
-                                               build_data['repo'],
-                                               revision_hash,
-                                               tests=new_tests)
-                logger.info('new_job: Notifying device %s of new job '
-                                 '%s for tests %s, enable_unittests=%s.' %
-                                 (phoneid, build_url, runnable_tests,
-                                  enable_unittests))
-                p.new_job()
+            device_tests[phoneid] = runnable_tests
+
+        # enable_unittests is set for a phone's job if any of its tests
+        # enable unittests.
+        new_tests = self.jobs.new_jobs(build_url,
+                                       device_tests,
+                                       build_id=build_data['id'],
+                                       changeset=build_data['changeset'],
+                                       tree=build_data['repo'],
+                                       revision=build_data['revision'],
+                                       revision_hash=revision_hash)
+        self.treeherder.submit_pending_jobs(build_url,
+                                            build_data['repo'],
+                                            revision_hash,
+                                            new_tests)
+        for phoneid, phone_tests in new_tests.iteritems():
+            if phone_tests:
+                logger.info('new_job: Queued new job %s for device %s '
+                            'for tests %s.' %
+                            (build_url, phoneid, device_tests[phoneid]))
 
     def route_cmd(self, data):
         response = ''
@@ -537,7 +548,8 @@ class AutoPhone(object):
             # PhoneWorker methods by stripping the leading 'device-'
             # from the command.  The device id is the first parameter.
             valid_cmds = ('is_alive', 'stop', 'shutdown', 'reboot', 'disable',
-                          'enable', 'ping', 'status', 'restart')
+                          'enable', 'ping', 'status', 'restart', 'reprobe',
+                          'adbstats')
             cmd = cmd.replace('device-', '').replace('-', '_')
             if cmd not in valid_cmds:
                 response = 'Unknown command device-%s' % cmd
@@ -587,6 +599,16 @@ class AutoPhone(object):
             phoneids.sort()
             for i in phoneids:
                 response += self.phone_workers[i].status()
+            if self.transfer_scheduler:
+                response += '%s\n' % self.transfer_scheduler
+            response += self.jobs.status()
+            response += 'ok'
+        elif cmd == 'autophone-adbstats':
+            response = ''
+            phoneids = self.phone_workers.keys()
+            phoneids.sort()
+            for i in phoneids:
+                response += self.phone_workers[i].adbstats()
             response += 'ok'
         elif cmd == 'autophone-help':
             response = '''
@@ -595,6 +617,10 @@ Autophone command help:
 autophone-help
     Generate this message.
 
+autophone-adbstats
+    Generate a report of the latency of the adb commands executed
+    for each device, by command.
+
 autophone-add-device <devicename> <serialno>
     Adds a new device to the active workers. <devicename> refers to
     the name given to the device in the devices.ini file while
@@ -615,6 +641,10 @@ autophone-stop
     Immediately stop autophone and all worker processes; may be
     delayed by pending download.
 
+device-adbstats <devicename>
+   Generate a report of the latency of the adb commands executed for
+   the device, by command.
+
 device-disable <devicename>
    Disable the device's worker and cancel its pending jobs.
 
@@ -631,6 +661,11 @@ device-ping <devicename>
 device-reboot  <devicename>
    Reboot the device.
 
+device-reprobe <devicename>
+   Probe the device's capabilities again, replacing any cached
+   capabilities. Use after the device has been rooted or otherwise
+   modified without being reflashed.
+
 device-restart <devicename>
    Shutdown the device's worker process after the current test, then
    restart the worker picking up test manifest and test configuration
@@ -657,6 +692,11 @@ ok
     def create_worker(self, phone):
         logger.info('Creating worker for %s: %s.' % (phone, self.options))
         dm = self._devices[phone.id]['dm']
+        dm.transfer_scheduler = self.transfer_scheduler
+        dm.archive_transfers = self.options.device_archive_transfers
+        if self.options.device_query_cache_ttl > 0:
+            dm.query_cache = ADBQueryCache(
+                ttl=self.options.device_query_cache_ttl)
         tests = []
         for test_class, config_file, test_devices_repos in self._tests:
             logger.debug('create_worker: %s %s %s' % (
@@ -697,7 +737,8 @@ ok
                              tests, phone, self.options,
                              self.queue,
                              '%s-%s' % (logfile_prefix, phone.id),
-                             self.loglevel, self.mailer, self.shared_lock)
+                             self.loglevel, self.mailer, self.shared_lock,
+                             self.job_notifier)
         self.phone_workers[phone.id] = worker
         return worker
 
@@ -771,6 +812,13 @@ ok
         else:
             devices = cfg.sections()
 
+        if self.options.device_capability_cache:
+            capability_cache = ADBCapabilityCache(
+                self.options.device_capability_cache)
+        else:
+            capability_cache = None
+
+        queued = []
         for device_name in devices:
             # failure for a device to have a serialno option is fatal.
             serialno = cfg.get(device_name, 'serialno')
@@ -778,48 +826,127 @@ ok
                 test_root = cfg.get(device_name, 'test_root')
             else:
                 test_root = self.options.device_test_root
-
-            console_logger.info("Initializing device name=%s, serialno=%s" % (device_name, serialno))
+            queued.append((device_name, serialno, test_root))
+
+        # Initialize up to device_init_threads devices at a time on
+        # separate threads. Each device is registered on this thread
+        # as soon as it has been initialized. A device which has not
+        # been initialized within device_init_timeout seconds is
+        # treated as having failed and its thread is abandoned so
+        # that it does not delay the remaining devices.
+        results = Queue.Queue()
+        running = {}
+        failures = []
+        total = len(queued)
+        completed = 0
+        while queued or running:
+            while queued and len(running) < max(1, self.options.device_init_threads):
+                device_name, serialno, test_root = queued.pop(0)
+                console_logger.info("Initializing device name=%s, serialno=%s" % (device_name, serialno))
+                thread = threading.Thread(
+                    target=self._init_device_thread,
+                    args=(results, device_name, serialno, test_root,
+                          capability_cache),
+                    name='init-%s' % device_name)
+                thread.daemon = True
+                running[device_name] = time.time() + self.options.device_init_timeout
+                thread.start()
             try:
-                dm = ADBAndroid(
-                    device=serialno,
-                    device_ready_retry_wait=self.options.device_ready_retry_wait,
-                    device_ready_retry_attempts=self.options.device_ready_retry_attempts,
-                    verbose=self.options.verbose,
-                    test_root=test_root)
-                dm.power_on()
-                device = {"device_name": device_name,
-                          "serialno": serialno,
-                          "dm" : dm}
-                device['osver'] = dm.get_prop('ro.build.version.release')
-                device['hardware'] = dm.get_prop('ro.product.model')
-                device['abi'] = dm.get_prop('ro.product.cpu.abi')
+                device_name, device, error = results.get(
+                    timeout=max(0, min(running.values()) - time.time()))
+            except Queue.Empty:
+                now = time.time()
+                for device_name, deadline in running.items():
+                    if deadline <= now:
+                        del running[device_name]
+                        completed += 1
+                        error = 'timed out after %d seconds' % self.options.device_init_timeout
+                        console_logger.error('Device %s %s (%d of %d).' % (
+                            device_name, error, completed, total))
+                        failures.append((device_name, error))
+                        self.purge_worker(device_name)
+                continue
+            if device_name not in running:
+                # The device has already been reported as timed out.
+                continue
+            del running[device_name]
+            completed += 1
+            if not error:
                 try:
-                    sdk = int(dm.get_prop('ro.build.version.sdk'))
-                    if sdk <= 10:
-                        device['sdk'] = 'api-9'
-                    elif sdk < 15:
-                        device['sdk'] = 'api-11'
-                    else:
-                        device['sdk'] = 'api-15'
-                except ValueError:
-                    device['sdk'] = 'api-9'
-                self._devices[device_name] = device
-                if new_device_name:
-                    self.read_tests()
-                self.register_cmd(device)
-            except Exception, e:
-                console_logger.error('Unable to initialize device %s due to %s.' %
-                                     (device_name, e))
-                msg_subj = '%s unable to initialize device %s' % (utils.host(),
-                                                                  device_name)
-                msg_body = ('Hello, this is Autophone. '
-                            'Just to let you know, '
-                            'phone %s '
-                            'failed to initialize due to %s.\n' %
-                            (device_name, e))
-                self.mailer.send(msg_subj, msg_body)
+                    self._devices[device_name] = device
+                    if new_device_name:
+                        self.read_tests()
+                    self.register_cmd(device)
+                except Exception, e:
+                    error = e
+            if error:
+                console_logger.error('Unable to initialize device %s due to %s '
+                                     '(%d of %d).' % (device_name, error,
+                                                      completed, total))
+                failures.append((device_name, error))
                 self.purge_worker(device_name)
+            else:
+                console_logger.info('Initialized device %s (%d of %d).' % (
+                    device_name, completed, total))
+
+        if failures:
+            msg_subj = '%s unable to initialize %s' % (
+                utils.host(),
+                ', '.join([device_name for device_name, error in failures]))
+            msg_body = ('Hello, this is Autophone. '
+                        'Just to let you know, '
+                        'the following phones failed to initialize:\n\n')
+            for device_name, error in failures:
+                msg_body += 'phone %s failed to initialize due to %s.\n' % (
+                    device_name, error)
+            console_logger.error('%d of %d devices failed to initialize: %s' % (
+                len(failures), total,
+                ', '.join([device_name for device_name, error in failures])))
+            self.mailer.send(msg_subj, msg_body)
+
+    def _init_device_thread(self, results, device_name, serialno, test_root,
+                            capability_cache):
+        """Creates the ADBAndroid dm for a device and collects the device's
+        properties. Called on a separate thread by read_devices() which
+        is passed (device_name, device, error) via the results queue."""
+        try:
+            if self.options.device_adb_server_transport:
+                transport = ADBServerTransport()
+            else:
+                transport = None
+            dm = ADBAndroid(
+                device=serialno,
+                device_ready_retry_wait=self.options.device_ready_retry_wait,
+                device_ready_retry_attempts=self.options.device_ready_retry_attempts,
+                verbose=self.options.verbose,
+                test_root=test_root,
+                use_shell_session=self.options.device_shell_session,
+                transport=transport,
+                output_buffer_size=self.options.device_output_buffer_size,
+                capability_cache=capability_cache)
+            dm.power_on()
+            device = {"device_name": device_name,
+                      "serialno": serialno,
+                      "dm" : dm}
+            device['osver'] = dm.get_prop('ro.build.version.release')
+            device['hardware'] = dm.get_prop('ro.product.model')
+            device['abi'] = dm.get_prop('ro.product.cpu.abi')
+            try:
+                sdk = int(dm.get_prop('ro.build.version.sdk'))
+                if sdk <= 10:
+                    device['sdk'] = 'api-9'
+                elif sdk < 15:
+                    device['sdk'] = 'api-11'
+                else:
+                    device['sdk'] = 'api-15'
+            except ValueError:
+                device['sdk'] = 'api-9'
+            # The worker process starts its own shell session.
+            dm.close_shell_session()
+            results.put((device_name, device, None))
+        except Exception, e:
+            logger.exception('Unable to initialize device %s' % device_name)
+            results.put((device_name, None, e))
 
     def read_tests(self):
         self._tests = []
@@ -113,11 +113,20 @@ class AutophoneTreeherder(object):
         return False
 
     def queue_request(self, machine, project, job_collection):
-        logger.debug('AutophoneTreeherder.queue_request: %s' % job_collection.__dict__)
+        self.queue_requests([(machine, project, job_collection)])
+
+    def queue_requests(self, requests):
+        """Queue several requests in a single jobs database transaction.
+
+        :param requests: list of (machine, project, job_collection)
+            tuples.
+        """
+        logger.debug('AutophoneTreeherder.queue_requests: %s' % [
+            job_collection.__dict__ for machine, project, job_collection in requests])
         logger.debug('AutophoneTreeherder shared_lock.acquire')
         self.shared_lock.acquire()
         try:
-            self.jobs.new_treeherder_job(machine, project, job_collection)
+            self.jobs.new_treeherder_jobs(requests)
         finally:
             logger.debug('AutophoneTreeherder shared_lock.release')
             self.shared_lock.release()
@@ -133,11 +142,37 @@ class AutophoneTreeherder(object):
         """
         if tests is None:
             tests = []
-        logger.debug('AutophoneTreeherder.submit_pending: %s' % tests)
+        self.submit_pending_jobs(build_url, project, revision_hash,
+                                 {machine: tests})
+
+    def submit_pending_jobs(self, build_url, project, revision_hash,
+                            machine_tests):
+        """Submit tests pending notifications to Treeherder for
+        several machines, queueing them in a single transaction.
+
+        :param build_url: url to build being tested.
+        :param project: repository of build.
+        :param revision_hash: Treeherder revision hash of build.
+        :param machine_tests: dict mapping machine ids to the lists of
+            tests to be reported.
+        """
+        logger.debug('AutophoneTreeherder.submit_pending_jobs: %s' %
+                     machine_tests)
         if not self.url or not revision_hash:
-            logger.debug('AutophoneTreeherder.submit_pending: no url/revision hash')
+            logger.debug('AutophoneTreeherder.submit_pending_jobs: no url/revision hash')
             return
 
+        requests = []
+        for machine, tests in machine_tests.iteritems():
+            if tests:
+                requests.append(
+                    (machine, project,
+                     self._create_pending_collection(
+                         machine, build_url, project, revision_hash, tests)))
+        self.queue_requests(requests)
+
+    def _create_pending_collection(self, machine, build_url, project,
+                                   revision_hash, tests):
         tjc = TreeherderJobCollection()
 
         for t in tests:
@@ -189,7 +224,7 @@ class AutophoneTreeherder(object):
         logger.debug('AutophoneTreeherder.submit_pending: tjc: %s' % (
             tjc.to_json()))
 
-        self.queue_request(machine, project, tjc)
+        return tjc
 
     def submit_running(self, machine, build_url, project, revision_hash, tests=None):
         """Submit tests running notifications to Treeherder
@@ -360,18 +395,14 @@ class AutophoneTreeherder(object):
                 with tempfile.NamedTemporaryFile(suffix='logcat.txt') as f:
                     try:
                         if self.worker.is_ok():
-                            for line in t.logcat.get(full=True):
-                                f.write('%s\n' % line.encode('UTF-8',
-                                                             errors='replace'))
+                            t.logcat.get(full=True).write(f)
                             t.logcat.reset()
                         else:
                             # Device is in an error state so we can't
                             # get the full logcat but we can output
                             # any logcat output we accumulated
                             # previously.
-                            for line in t.logcat._accumulated_logcat:
-                                f.write('%s\n' % line.encode('UTF-8',
-                                                             errors='replace'))
+                            t.logcat._accumulated_logcat.write(f)
                     except Exception, e:
                         logger.exception('Error reading logcat %s' % fname)
                         t.job_details.append({
@@ -5,8 +5,10 @@
 import datetime
 import json
 import logging
+import multiprocessing
 import os
 import sqlite3
+import threading
 import time
 import traceback
 
@@ -16,50 +18,177 @@ import utils
 # used in a child process.
 logger = logging.getLogger()
 
+# Schema migrations of the jobs database. Migration i upgrades the
+# database from version i to version i + 1. Databases created before
+# the schema was versioned already contain the tables of the first
+# migration, which is why it only creates missing tables.
+SCHEMA_MIGRATIONS = [
+    # 1: initial tables.
+    ['create table if not exists jobs ('
+     'id integer primary key, '
+     'created text, '
+     'last_attempt text, '
+     'build_url text, '
+     'build_id text, '
+     'changeset text, '
+     'tree text, '
+     'revision text, '
+     'revision_hash, '
+     'enable_unittests int, '
+     'attempts int, '
+     'device text)',
+     'create table if not exists tests ('
+     'id integer primary key, '
+     'name text, '
+     'config_file text, '
+     'chunk int, '
+     'guid text, '
+     'repos text, '
+     'jobid integer)',
+     'create table if not exists treeherder ('
+     'id integer primary key, '
+     'attempts int, '
+     'last_attempt text, '
+     'machine text,'
+     'project text,'
+     'job_collection text)'],
+    # 2: store whether the build is a try build so that the jobs can
+    # be ordered by an index, and index the columns used to look up
+    # jobs and tests.
+    ['alter table jobs add column istry int',
+     "update jobs set istry=instr(build_url, 'try')",
+     'create index jobs_device_build_url on jobs (device, build_url)',
+     'create index jobs_device_istry_created '
+     'on jobs (device, istry desc, created)',
+     'create index tests_jobid '
+     'on tests (jobid, name, config_file, chunk, repos)',
+     'create index tests_guid on tests (guid)'],
+]
+
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+
+def migrate_schema(filename, version=SCHEMA_VERSION, timeout=30):
+    """Upgrades the jobs database to the given schema version,
+    creating the database if it does not exist, and returns the
+    version of the database before the upgrade.
+
+    The migrations are applied in a single transaction which holds the
+    database's write lock so that concurrent processes do not apply
+    them twice.
+
+    :param filename: path of the sqlite database.
+    :param version: schema version to upgrade to. Defaults to the
+        current version.
+    :param timeout: seconds to wait for the database's lock.
+    """
+    conn = sqlite3.connect(filename, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute('begin immediate')
+        try:
+            conn.execute('create table if not exists schema_version '
+                         '(version int)')
+            row = conn.execute('select version from schema_version').fetchone()
+            if row:
+                old_version = row[0]
+            else:
+                old_version = 0
+                conn.execute('insert into schema_version values (0)')
+            for i in range(old_version, version):
+                logger.info('jobs: migrating %s to schema version %d' % (
+                    filename, i + 1))
+                for sql in SCHEMA_MIGRATIONS[i]:
+                    conn.execute(sql)
+            if version > old_version:
+                conn.execute('update schema_version set version=?',
+                             (version,))
+            conn.execute('commit')
+        except:
+            conn.execute('rollback')
+            raise
+    finally:
+        conn.close()
+    return old_version
+
+
+class JobNotifier(object):
+    """Notifies the workers of devices when jobs are added for them.
+
+    Each device has a version counter in shared memory which is
+    incremented whenever jobs are added for the device, and a command
+    queue on which a job command is put to wake its worker. A device
+    must be added in the main process before its worker is started so
+    that the worker inherits its counter.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._queues = {}
+
+    def add_device(self, device, queue):
+        """
+        :param device: id of the device.
+        :param queue: command queue of the device's worker.
+        """
+        self._versions[device] = multiprocessing.Value('l', 0)
+        self._queues[device] = queue
+
+    def version(self, device):
+        """Returns the version of the jobs of the device or None if
+        the device is unknown."""
+        version = self._versions.get(device)
+        if version is None:
+            return None
+        return version.value
+
+    def notify(self, device):
+        version = self._versions.get(device)
+        if version is None:
+            return
+        with version.get_lock():
+            version.value += 1
+        self._queues[device].put_nowait(('job', None))
+
+
 class Jobs(object):
 
     MAX_ATTEMPTS = 3
     SQL_RETRY_DELAY = 60
     SQL_MAX_RETRIES = 10
-
-    def __init__(self, mailer, default_device=None, allow_duplicates=False):
+    # Seconds a statement waits for a lock held by another connection
+    # before failing with database is locked.
+    SQL_BUSY_TIMEOUT = 30
+    # Statements taking longer than this many seconds are logged and
+    # counted as slow.
+    SQL_SLOW_STATEMENT = 1
+
+    def __init__(self, mailer, default_device=None, allow_duplicates=False,
+                 notifier=None):
         self.mailer = mailer
         self.default_device = default_device
         self.filename = 'jobs.sqlite'
         self.allow_duplicates = allow_duplicates
-
-        if not os.path.exists(self.filename):
-            conn = self._conn()
-            conn.execute('create table jobs ('
-                         'id integer primary key, '
-                         'created text, '
-                         'last_attempt text, '
-                         'build_url text, '
-                         'build_id text, '
-                         'changeset text, '
-                         'tree text, '
-                         'revision text, '
-                         'revision_hash, '
-                         'enable_unittests int, '
-                         'attempts int, '
-                         'device text)')
-            conn.execute('create table tests ('
-                         'id integer primary key, '
-                         'name text, '
-                         'config_file text, '
-                         'chunk int, '
-                         'guid text, '
-                         'repos text, '
-                         'jobid integer)')
-            conn.execute('create table treeherder ('
-                         'id integer primary key, '
-                         'attempts int, '
-                         'last_attempt text, '
-                         'machine text,'
-                         'project text,'
-                         'job_collection text)')
-            conn.commit()
-            conn.close()
+        # If a JobNotifier is given, workers are notified of new jobs
+        # and get_next_job does not query the database for a device
+        # which had no jobs unless jobs have been added for it since.
+        self.notifier = notifier
+        self._idle_versions = {}
+        # Each thread of each process uses its own connection which is
+        # kept open for the life of the thread so that its prepared
+        # statement cache is reused.
+        self._local = threading.local()
+        # Connections inherited from a parent process must not be used
+        # or closed by the child, so they are kept referenced here.
+        self._inherited_connections = []
+        # The statistics are updated by each thread which uses the
+        # database.
+        self._sql_stats_lock = threading.Lock()
+        self.sql_stats = {'statements': 0,
+                          'errors': 0,
+                          'slow': 0,
+                          'max_seconds': 0.0}
+
+        migrate_schema(self.filename, timeout=self.SQL_BUSY_TIMEOUT)
 
     def report_sql_error(self, attempt, email_sent, sql, values):
         message = '%s %s' % (sql, values)
@@ -78,61 +207,106 @@ class Jobs(object):
         return email_sent
 
     def _conn(self):
+        """Returns the connection of the current thread, opening it in
+        WAL mode if necessary. Any changes left uncommitted by a
+        previous call which failed are rolled back."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.rollback()
+            return conn
+        if conn is not None:
+            self._inherited_connections.append(conn)
         attempt = 0
         email_sent = False
         while True:
             attempt += 1
             try:
-                conn = sqlite3.connect(self.filename)
+                conn = sqlite3.connect(self.filename,
+                                       timeout=self.SQL_BUSY_TIMEOUT)
+                # Write ahead logging lets readers proceed while
+                # another connection is writing.
+                conn.execute('pragma journal_mode=wal')
                 break
             except sqlite3.OperationalError:
                 email_sent = self.report_sql_error(
                     attempt, email_sent,
                     'connect(%s)' % self.filename,
                     None)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
         return conn
 
+    def _record_sql(self, start_time, sql, values=()):
+        elapsed = time.time() - start_time
+        with self._sql_stats_lock:
+            self.sql_stats['statements'] += 1
+            if elapsed > self.sql_stats['max_seconds']:
+                self.sql_stats['max_seconds'] = elapsed
+            if elapsed >= self.SQL_SLOW_STATEMENT:
+                self.sql_stats['slow'] += 1
+        if elapsed >= self.SQL_SLOW_STATEMENT:
+            logger.warning('jobs: %s %s took %.1f seconds' % (
+                sql, values, elapsed))
+
+    def _record_sql_error(self):
+        with self._sql_stats_lock:
+            self.sql_stats['errors'] += 1
+
+    def copy_sql_stats(self):
+        """Returns a copy of the statement statistics, such as to be
+        sent to another process."""
+        with self._sql_stats_lock:
+            return dict(self.sql_stats)
+
+    @staticmethod
+    def format_sql_stats(sql_stats):
+        return ('jobs database: statements %(statements)d, '
+                'errors %(errors)d, slow %(slow)d, '
+                'max %(max_seconds).1fs' % sql_stats)
+
+    def status(self):
+        return '%s\n' % Jobs.format_sql_stats(self.copy_sql_stats())
+
     def _commit_connection(self, conn):
         attempt = 0
         email_sent = False
         while True:
             attempt += 1
+            start_time = time.time()
             try:
                 conn.commit()
+                self._record_sql(start_time, 'commit')
                 break
             except sqlite3.OperationalError:
+                self._record_sql_error()
                 email_sent = self.report_sql_error(
                     attempt, email_sent,
                     '_commit_connection(%s)' % self.filename,
                     None)
 
-    def _close_connection(self, conn):
-        attempt = 0
-        email_sent = False
-        while True:
-            attempt += 1
-            try:
-                conn.close()
-                break
-            except sqlite3.OperationalError:
-                email_sent = self.report_sql_error(
-                    attempt, email_sent,
-                    '_close_connection(%s)' % self.filename,
-                    None)
-
-    def _execute_sql(self, conn, sql, values=()):
+    def _execute_sql(self, conn, sql, values=(), many=False):
         """Execute sql statement.
 
         Returns the cursor which executed the statement if no error
-        occured, otherwise it keeps trying until it succeeds.
+        occured, otherwise it keeps trying until it succeeds. If many
+        is True, the statement is executed for each sequence of values
+        in values.
         """
         attempt = 0
         email_sent = False
         while True:
             attempt += 1
+            start_time = time.time()
             try:
-                return conn.execute(sql, values)
+                if many:
+                    cursor = conn.executemany(sql, values)
+                    self._record_sql(start_time, sql, '%d rows' % len(values))
+                else:
+                    cursor = conn.execute(sql, values)
+                    self._record_sql(start_time, sql, values)
+                return cursor
             except sqlite3.OperationalError:
+                self._record_sql_error()
                 email_sent = self.report_sql_error(attempt, email_sent,
                                                    sql, values)
 
@@ -142,68 +316,140 @@ class Jobs(object):
         self._execute_sql(conn, 'delete from jobs')
         self._execute_sql(conn, 'delete from treeherder')
         self._commit_connection(conn)
-        self._close_connection(conn)
 
     def new_job(self, build_url, build_id=None, changeset=None, tree=None,
                 revision=None, revision_hash=None, tests=None,
                 enable_unittests=False, device=None,
                 attempts=0):
-        logger.debug('jobs.new_job: %s %s %s %s %s %s %s %s %s %s' % (
-            build_url, build_id, changeset, tree, revision, revision_hash,
-            tests, enable_unittests, device, attempts))
         if not device:
             device = self.default_device
+        new_tests = self.new_jobs(build_url, {device: tests or []},
+                                  build_id=build_id, changeset=changeset,
+                                  tree=tree, revision=revision,
+                                  revision_hash=revision_hash,
+                                  enable_unittests=enable_unittests,
+                                  attempts=attempts)
+        return new_tests[device]
+
+    def new_jobs(self, build_url, device_tests, build_id=None,
+                 changeset=None, tree=None, revision=None,
+                 revision_hash=None, enable_unittests=None, attempts=0):
+        """Adds the jobs for a build on several devices in a single
+        transaction and returns a dict mapping each device to the list
+        of its tests which were added.
+
+        Unless duplicates are allowed, an existing job for the build on
+        a device is reused and tests which are already queued for it
+        are not added again.
+
+        :param build_url: url of the build.
+        :param device_tests: dict mapping each device to the list of
+            tests to be run on it.
+        :param enable_unittests: whether the jobs enable unittests. If
+            None, the job for a device enables unittests if any of its
+            tests do.
+        """
+        logger.debug('jobs.new_jobs: %s %s %s %s %s %s %s %s %s' % (
+            build_url, build_id, changeset, tree, revision, revision_hash,
+            device_tests, enable_unittests, attempts))
+        devices = device_tests.keys()
+        if not devices:
+            return {}
         now = datetime.datetime.now().isoformat()
 
         conn = self._conn()
-        job_id = None
+        self._execute_sql(conn, 'begin immediate')
+        job_ids = {}
+        queued_tests = set()
         if not self.allow_duplicates:
+            # Order by descending id so that the oldest job of a
+            # device is the one kept in job_ids.
             job_cursor = self._execute_sql(
                 conn,
-                'select id from jobs where device=? and build_url=?',
-                values=(device, build_url))
-
-            job = job_cursor.fetchone()
+                'select device, id from jobs where build_url=? and '
+                'device in (%s) order by id desc' % (
+                    ', '.join(['?'] * len(devices))),
+                values=[build_url] + devices)
+            job_ids = dict(job_cursor.fetchall())
             job_cursor.close()
-            if job:
-                job_id = job[0]
-        if not job_id:
+        if job_ids:
+            test_cursor = self._execute_sql(
+                conn,
+                'select jobid, name, config_file, chunk, repos from tests '
+                'where jobid in (%s)' % ', '.join(['?'] * len(job_ids)),
+                values=job_ids.values())
+            queued_tests = set(test_cursor.fetchall())
+            test_cursor.close()
+
+        new_devices = [device for device in devices if device not in job_ids]
+        if new_devices:
+            job_rows = []
+            for device in new_devices:
+                if enable_unittests is None:
+                    device_enable_unittests = False
+                    for test in device_tests[device]:
+                        device_enable_unittests = (device_enable_unittests or
+                                                   test.enable_unittests)
+                else:
+                    device_enable_unittests = enable_unittests
+                job_rows.append((now, build_url, build_id, changeset, tree,
+                                 revision, revision_hash,
+                                 device_enable_unittests, attempts, device,
+                                 build_url))
+            self._execute_sql(
+                conn,
+                'insert into jobs (created, build_url, build_id, changeset, '
+                'tree, revision, revision_hash, enable_unittests, attempts, '
+                'device, istry) '
+                "values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, instr(?, 'try'))",
+                values=job_rows, many=True)
+            # The immediate transaction prevents other connections from
+            # adding jobs, so the newest job of each device is the one
+            # just added.
             job_cursor = self._execute_sql(
                 conn,
-                'insert into jobs values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                values=(None, now, None, build_url, build_id, changeset, tree,
-                        revision, revision_hash, enable_unittests, attempts, device))
-            job_id = job_cursor.lastrowid
+                'select device, max(id) from jobs where build_url=? and '
+                'device in (%s) group by device' % (
+                    ', '.join(['?'] * len(new_devices))),
+                values=[build_url] + new_devices)
+            job_ids.update(job_cursor.fetchall())
             job_cursor.close()
 
-        new_tests = []
-        for test in tests:
-            repos = json.dumps(test.repos)
-            if not self.allow_duplicates:
-                test_cursor = self._execute_sql(
-                    conn,
-                    'select * from tests where '
-                    'name=? and config_file=? and chunk=? and repos=? and jobid=?',
-                    values=(test.name, test.config_file, test.chunk, repos, job_id))
-                test_row = test_cursor.fetchone()
-                test_cursor.close()
-                if test_row:
-                    logger.warning(
-                        'jobs.new_job: duplicate test: %s, device: %s, '
-                        'name: %s, config_file: %s, chunk: %s, repos: %s' % (
-                            build_url, device, test.name, test.config_file,
-                            test.chunk, repos))
-                    continue
-            new_tests.append(test)
-            test.generate_guid()
+        new_tests = {}
+        test_rows = []
+        notify_devices = set(new_devices)
+        for device in devices:
+            job_id = job_ids[device]
+            new_tests[device] = []
+            for test in device_tests[device]:
+                repos = json.dumps(test.repos)
+                key = (job_id, test.name, test.config_file, test.chunk, repos)
+                if not self.allow_duplicates:
+                    if key in queued_tests:
+                        logger.warning(
+                            'jobs.new_jobs: duplicate test: %s, device: %s, '
+                            'name: %s, config_file: %s, chunk: %s, '
+                            'repos: %s' % (
+                                build_url, device, test.name,
+                                test.config_file, test.chunk, repos))
+                        continue
+                    queued_tests.add(key)
+                test.generate_guid()
+                new_tests[device].append(test)
+                notify_devices.add(device)
+                test_rows.append((test.name, test.config_file, test.chunk,
+                                  test.job_guid, repos, job_id))
+        if test_rows:
             self._execute_sql(
                 conn,
-                'insert into tests values (?, ?, ?, ?, ?, ?, ?)',
-                values=(None, test.name, test.config_file, test.chunk,
-                        test.job_guid, repos, job_id))
+                'insert into tests (name, config_file, chunk, guid, repos, '
+                'jobid) values (?, ?, ?, ?, ?, ?)',
+                values=test_rows, many=True)
         self._commit_connection(conn)
-        self._close_connection(conn)
 
+        if self.notifier:
+            for device in notify_devices:
+                self.notifier.notify(device)
         return new_tests
 
     def jobs_pending(self, device=None):
@@ -216,7 +462,6 @@ class Jobs(object):
             values=(device,))
         count = cursor.fetchone()[0]
         cursor.close()
-        self._close_connection(conn)
         return count
 
     def set_job_attempts(self, jobid, attempts):
@@ -229,43 +474,53 @@ class Jobs(object):
         self._commit_connection(conn)
 
     def get_next_job(self, lifo=False, device=None, worker=None):
+        """Claims and returns the next job for the device or None if
+        there are no jobs.
+
+        Jobs whose attempts have reached MAX_ATTEMPTS are deleted
+        along with their tests, then the next job is selected and its
+        attempts incremented in a single immediate transaction so that
+        concurrent callers can not claim the same attempt.
+        """
         if not device:
             device = self.default_device
         order = 'desc' if lifo else 'asc'
 
+        # Read the version before querying so that jobs added during
+        # the query change it.
+        version = None
+        if self.notifier:
+            version = self.notifier.version(device)
+        if version is not None and version == self._idle_versions.get(device):
+            return None
+
         conn = self._conn()
+        self._execute_sql(conn, 'begin immediate')
 
-        # Find the ids of the jobs whose attempts exceed the maximum.
-        # First delete the associated tests, then the jobs.
-        job_cursor = self._execute_sql(
+        self._execute_sql(
             conn,
-            'select id from jobs where device=? and attempts>=?',
+            'delete from tests where jobid in '
+            '(select id from jobs where device=? and attempts>=?)',
             values=(device, self.MAX_ATTEMPTS))
-        job_ids = [job[0] for job in job_cursor]
-        for job_id in job_ids:
-            self._execute_sql(conn, 'delete from tests where jobid=?',
-                              values=(job_id,))
-        job_cursor.close()
         self._execute_sql(
             conn,
             'delete from jobs where device=? and attempts>=?',
             values=(device, self.MAX_ATTEMPTS))
 
-        self._commit_connection(conn)
-
         job_cursor = self._execute_sql(
             conn,
             'select id,created,last_attempt,build_url,'
             'build_id,changeset,tree,revision,revision_hash,'
-            'enable_unittests,attempts,instr(build_url,"try") as istry '
+            'enable_unittests,attempts,istry '
             'from jobs where device=? order by istry desc, '
-            'created %s' % order,
+            'created %s limit 1' % order,
             values=(device,))
 
         job_row = job_cursor.fetchone()
         job_cursor.close()
         if not job_row:
-            self._close_connection(conn)
+            self._commit_connection(conn)
+            self._idle_versions[device] = version
             return None
 
         job = {'id': job_row[0],
@@ -289,37 +544,29 @@ class Jobs(object):
             values=(job['attempts'], job['last_attempt'],
                     job['id']))
 
-        job['tests'] = []
         test_cursor = self._execute_sql(
             conn,
             'select name, config_file, chunk, repos, guid '
-            'from tests where jobid=?', values=(job['id'],))
-
-        test_rows = [
-            {
-                'name': test_row[0],
-                'config_file': test_row[1],
-                'chunk': test_row[2],
-                'repos' : json.loads(test_row[3]),
-                'guid': test_row[4]
-            }
-            for test_row in test_cursor
-        ]
+            'from tests where jobid=? order by id', values=(job['id'],))
+        test_rows = test_cursor.fetchall()
         test_cursor.close()
+        self._commit_connection(conn)
 
-        for test_row in test_rows:
-            # Generate the list of tests to be executed for this job
-            test_row['repos'].sort()
-            for test in worker.tests:
-                if (test.name == test_row['name'] and
-                    test.config_file == test_row['config_file'] and
-                    test.chunk == test_row['chunk'] and
-                    test.repos == test_row['repos']):
-                    test.job_guid = test_row['guid']
-                    job['tests'].append(test)
+        # Generate the list of tests to be executed for this job.
+        worker_tests = {}
+        for test in worker.tests:
+            key = (test.name, test.config_file, test.chunk,
+                   tuple(test.repos))
+            worker_tests.setdefault(key, []).append(test)
+        job['tests'] = []
+        for name, config_file, chunk, repos, guid in test_rows:
+            repos = json.loads(repos)
+            repos.sort()
+            key = (name, config_file, chunk, tuple(repos))
+            for test in worker_tests.get(key, []):
+                test.job_guid = guid
+                job['tests'].append(test)
         logger.debug('jobs.get_next_job: %s' % job)
-        self._commit_connection(conn)
-        self._close_connection(conn)
         return job
 
     def cancel_test(self, test_guid, device=None):
@@ -342,7 +589,6 @@ class Jobs(object):
         if not job_ids:
             logger.debug('jobs.cancel_test: test %s for device %s '
                          'already deleted' % (test_guid, device))
-            self._close_connection(conn)
             return
 
         job_id = job_ids[0]
@@ -370,20 +616,33 @@ class Jobs(object):
                 'delete from jobs where id=?',
                 values=(job_id,))
         self._commit_connection(conn)
-        self._close_connection(conn)
 
     def new_treeherder_job(self, machine, project, job_collection):
-        logger.debug('jobs.new_treeherder_job: %s %s %s' % (machine, project, job_collection.__dict__))
+        self.new_treeherder_jobs([(machine, project, job_collection)])
+
+    def new_treeherder_jobs(self, requests):
+        """Queues Treeherder submissions in a single transaction.
+
+        :param requests: list of (machine, project, job_collection)
+            tuples.
+        """
+        logger.debug('jobs.new_treeherder_jobs: %s' % [
+            (machine, project, job_collection.__dict__)
+            for machine, project, job_collection in requests])
+        if not requests:
+            return
         attempts = 0
         now = datetime.datetime.now().isoformat()
         conn = self._conn()
         job_cursor = self._execute_sql(
             conn,
             'insert into treeherder values (?, ?, ?, ?, ?, ?)',
-            values=(None, attempts, now, machine, project, job_collection.to_json()))
+            values=[(None, attempts, now, machine, project,
+                     job_collection.to_json())
+                    for machine, project, job_collection in requests],
+            many=True)
         job_cursor.close()
         self._commit_connection(conn)
-        self._close_connection(conn)
 
     def get_next_treeherder_job(self):
         conn = self._conn()
@@ -395,7 +654,6 @@ class Jobs(object):
         job_row = job_cursor.fetchone()
         job_cursor.close()
         if not job_row:
-            self._close_connection(conn)
             return None
 
         job = {'id': job_row[0],
@@ -414,7 +672,6 @@ class Jobs(object):
 
         logger.debug('jobs.get_next_treeherder_job: %s' % job)
         self._commit_connection(conn)
-        self._close_connection(conn)
         return job
 
     def treeherder_job_completed(self, id):
@@ -422,14 +679,12 @@ class Jobs(object):
         conn = self._conn()
         self._execute_sql(conn, 'delete from treeherder where id=?', values=(id,))
         self._commit_connection(conn)
-        self._close_connection(conn)
 
     def test_completed(self, test_guid):
         logger.debug('jobs.test_completed: %s' % test_guid)
         conn = self._conn()
         self._execute_sql(conn, 'delete from tests where guid=?', values=(test_guid,))
         self._commit_connection(conn)
-        self._close_connection(conn)
 
     def job_completed(self, job_id):
         logger.debug('jobs.job_completed: %s' % job_id)
@@ -437,4 +692,3 @@ class Jobs(object):
         self._execute_sql(conn, 'delete from tests where jobid=?', values=(job_id,))
         self._execute_sql(conn, 'delete from jobs where id=?', values=(job_id,))
         self._commit_connection(conn)
-        self._close_connection(conn)
@@ -0,0 +1,120 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import gzip
+import os
+import tempfile
+
+
+class LogcatStore(object):
+    """Append-only store of the logcat lines accumulated during a test.
+
+    At most max_lines of the most recent lines are kept in memory.
+    When the limit is exceeded, the older half of the lines are
+    appended to a gzip compressed segment file which is removed by
+    close(). Iterating over the store returns all of the lines in the
+    order they were added, reading the segment file incrementally so
+    that the full log is never built in memory.
+
+    ::
+
+        store = LogcatStore()
+        store.extend(lines)
+        with open(path, 'w') as f:
+            store.write(f)
+        store.close()
+    """
+    def __init__(self, max_lines=10000, spill_dir=None):
+        """
+        :param max_lines: Maximum number of lines to keep in memory.
+        :param spill_dir: Directory where the segment file is
+            created. Defaults to the system's temporary directory.
+        """
+        self.max_lines = max_lines
+        self.spill_dir = spill_dir
+        self._tail = []
+        self._spilled = 0
+        self._spill_path = None
+        #: The most recently added line or None.
+        self.last_line = None
+        #: Set of the most recently added lines which share the
+        #: timestamp of last_line. These are the only lines needed to
+        #: detect duplicates when the device's logcat is collected
+        #: again since the boundary timestamp.
+        self.boundary_lines = set()
+
+    def __len__(self):
+        return self._spilled + len(self._tail)
+
+    def __iter__(self):
+        # Take a snapshot so that lines added or spilled while
+        # iterating are neither repeated nor skipped.
+        spilled = self._spilled
+        tail = list(self._tail)
+        if spilled:
+            f = gzip.open(self._spill_path, 'rb')
+            try:
+                for count, line in enumerate(f):
+                    if count == spilled:
+                        break
+                    yield unicode(line.rstrip('\n'), 'UTF-8',
+                                  errors='replace')
+            finally:
+                f.close()
+        for line in tail:
+            yield line
+
+    @property
+    def boundary(self):
+        """The timestamp, the first 18 characters, of last_line or
+        None if the store is empty."""
+        if self.last_line is None:
+            return None
+        return self.last_line[:18]
+
+    def extend(self, lines):
+        """Appends lines to the store.
+
+        :param lines: list of unicode logcat lines.
+        """
+        for line in lines:
+            if self.last_line is None or line[:18] != self.last_line[:18]:
+                self.boundary_lines = set()
+            self.boundary_lines.add(line)
+            self.last_line = line
+        self._tail.extend(lines)
+        if len(self._tail) > self.max_lines:
+            self._spill()
+
+    def _spill(self):
+        count = len(self._tail) - self.max_lines / 2
+        if not self._spill_path:
+            fd, self._spill_path = tempfile.mkstemp(prefix='logcat-',
+                                                    suffix='.gz',
+                                                    dir=self.spill_dir)
+            os.close(fd)
+        # Each spill appends a new gzip member to the segment file.
+        # GzipFile reads concatenated members as a single stream.
+        f = gzip.open(self._spill_path, 'ab')
+        try:
+            for line in self._tail[:count]:
+                f.write('%s\n' % line.encode('UTF-8', errors='replace'))
+        finally:
+            f.close()
+        del self._tail[:count]
+        self._spilled += count
+
+    def write(self, f):
+        """Writes all of the lines, UTF-8 encoded, to the file object f.
+
+        :param f: file object opened for writing.
+        """
+        for line in self:
+            f.write('%s\n' % line.encode('UTF-8', errors='replace'))
+
+    def close(self):
+        """Discards the lines and removes the segment file."""
+        if self._spill_path and os.path.exists(self._spill_path):
+            os.unlink(self._spill_path)
+        self.__init__(max_lines=self.max_lines, spill_dir=self.spill_dir)
@@ -0,0 +1,129 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Parser for the MM-DD HH:MM:SS.mmm timestamp which begins each line
+of logcat output in the time format.
+
+Timestamps are converted to integer milliseconds since the epoch
+using slicing and integer arithmetic rather than strptime. The values
+are only meaningful relative to each other since logcat does not
+record the time zone.
+"""
+
+import calendar
+import datetime
+
+MS_PER_MINUTE = 60 * 1000
+MS_PER_HOUR = 60 * MS_PER_MINUTE
+MS_PER_DAY = 24 * MS_PER_HOUR
+HALF_YEAR_MS = 183 * MS_PER_DAY
+
+# Cache of the epoch milliseconds at the start of each month keyed by
+# year. Index 0 is unused so that months can be used as indexes.
+_month_starts = {}
+
+
+def _get_month_starts(year):
+    month_starts = _month_starts.get(year)
+    if month_starts is None:
+        month_starts = [None]
+        for month in range(1, 13):
+            month_starts.append(
+                calendar.timegm((year, month, 1, 0, 0, 0)) * 1000)
+        # The start of the following year bounds December.
+        month_starts.append(calendar.timegm((year + 1, 1, 1, 0, 0, 0)) * 1000)
+        _month_starts[year] = month_starts
+    return month_starts
+
+
+def parse_logcat_time(line, year):
+    """Returns the timestamp at the start of a logcat line as epoch
+    milliseconds in the given year or None if the line does not begin
+    with a valid timestamp.
+
+    :param line: logcat line beginning with MM-DD HH:MM:SS.mmm.
+    :param year: year of the timestamp.
+    """
+    if (len(line) < 18 or line[2] != '-' or line[5] != ' ' or
+        line[8] != ':' or line[11] != ':' or line[14] != '.'):
+        return None
+    try:
+        month = int(line[0:2])
+        day = int(line[3:5])
+        hour = int(line[6:8])
+        minute = int(line[9:11])
+        second = int(line[12:14])
+        millisecond = int(line[15:18])
+    except ValueError:
+        return None
+    if (month < 1 or month > 12 or day < 1 or hour > 23 or minute > 59 or
+        second > 59 or millisecond < 0):
+        return None
+    month_starts = _get_month_starts(year)
+    value = month_starts[month] + (day - 1) * MS_PER_DAY
+    if value >= month_starts[month + 1]:
+        # The day is past the end of the month.
+        return None
+    return (value + hour * MS_PER_HOUR + minute * MS_PER_MINUTE +
+            second * 1000 + millisecond)
+
+
+class LogcatTimeParser(object):
+    """Parses logcat timestamps, inferring the missing year.
+
+    Each timestamp is placed in whichever of the previous, current or
+    next year puts it within half a year of the reference time. Every
+    timestamp parsed by a parser is therefore assigned a year
+    consistently, so that times collected across a new year remain in
+    order, e.g. 12-31 23:59:59.999 precedes 01-01 00:00:00.000 when
+    parsed on either day.
+
+    ::
+
+        parser = LogcatTimeParser()
+        start = parser.parse(start_line)
+        stop = parser.parse(stop_line)
+        elapsed_ms = stop - start
+    """
+    def __init__(self, now=None):
+        """
+        :param now: reference datetime in local time. Defaults to the
+            current time.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        self.year = now.year
+        self.now = calendar.timegm(now.timetuple()) * 1000
+        # Consecutive logcat lines usually share the same second, so
+        # remember the MM-DD HH:MM:SS prefix of the previous line and
+        # the time at the start of that second.
+        self._prefix = None
+        self._second = None
+
+    def parse(self, line):
+        """Returns the timestamp at the start of line as epoch
+        milliseconds or None if the line does not begin with a valid
+        timestamp.
+
+        :param line: logcat line beginning with MM-DD HH:MM:SS.mmm.
+        """
+        if len(line) >= 18 and line[:14] == self._prefix and line[14] == '.':
+            try:
+                millisecond = int(line[15:18])
+                if millisecond >= 0:
+                    return self._second + millisecond
+            except ValueError:
+                pass
+            return None
+        value = parse_logcat_time(line, self.year)
+        if value is None:
+            return None
+        if value - self.now > HALF_YEAR_MS:
+            value = parse_logcat_time(line, self.year - 1)
+        elif self.now - value > HALF_YEAR_MS:
+            value = parse_logcat_time(line, self.year + 1)
+        if value is not None:
+            self._prefix = line[:14]
+            self._second = value - value % 1000
+        return value
@@ -69,6 +69,22 @@ class AutophoneOptions(object):
         self.phone_command_queue_timeout = PhoneWorker.PHONE_COMMAND_QUEUE_TIMEOUT
         self.phone_crash_window = Crashes.CRASH_WINDOW
         self.phone_crash_limit = Crashes.CRASH_LIMIT
+        self.device_shell_session = False
+        self.device_adb_server_transport = False
+        self.device_output_buffer_size = 1024 * 1024
+        self.device_capability_cache = ''
+        self.device_init_threads = 8
+        self.device_init_timeout = 900
+        self.device_logcat_stream = False
+        self.device_sync_local_pages = False
+        self.device_skip_identical_install = False
+        self.reboot_every_jobs = 1
+        self.reboot_every_minutes = 0
+        self.reboot_on_failure = True
+        self.reboot_before_perf_tests = False
+        self.max_concurrent_transfers = 0
+        self.device_archive_transfers = ''
+        self.device_query_cache_ttl = 0
         # other
         self.debug = 3
 
@@ -133,6 +149,22 @@ class AutophoneOptions(object):
                      'phone_command_queue_timeout',
                      'phone_crash_window',
                      'phone_crash_limit',
+                     'device_shell_session',
+                     'device_adb_server_transport',
+                     'device_output_buffer_size',
+                     'device_capability_cache',
+                     'device_init_threads',
+                     'device_init_timeout',
+                     'device_logcat_stream',
+                     'device_sync_local_pages',
+                     'device_skip_identical_install',
+                     'reboot_every_jobs',
+                     'reboot_every_minutes',
+                     'reboot_on_failure',
+                     'reboot_before_perf_tests',
+                     'max_concurrent_transfers',
+                     'device_archive_transfers',
+                     'device_query_cache_ttl',
                      'debug')
         d = {}
         for attr in whitelist:
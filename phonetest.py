@@ -12,6 +12,7 @@ import re
 import sys
 import shutil
 import tempfile
+import time
 
 from time import sleep
 
@@ -20,6 +21,8 @@ from mozprofile import FirefoxProfile
 import utils
 from autophonecrash import AutophoneCrashProcessor
 from adb import ADBError
+from logcatstore import LogcatStore
+from logcattime import LogcatTimeParser, MS_PER_HOUR
 from logdecorator import LogDecorator
 from phonestatus import PhoneStatus
 from sensitivedatafilter import SensitiveDataFilter
@@ -31,12 +34,25 @@ logger = logging.getLogger()
 # Define the Adobe Flash Player package name as a constant for reuse.
 FLASH_PACKAGE = 'com.adobe.flashplayer'
 
+# Name of the manifest of the local pages' digests which is kept on
+# the device in the local pages' destination directory.
+LOCAL_PAGES_MANIFEST = '.autophone-manifest'
+
 class Logcat(object):
     def __init__(self, phonetest, logger):
         logger.debug('Logcat()')
         self.phonetest = phonetest
         self.logger = logger
-        self._accumulated_logcat = []
+        self._accumulated_logcat = LogcatStore()
+        # Position in the device's logcat reader of the next line to
+        # be collected when streaming.
+        self._cursor = 0
+
+    @property
+    def streaming(self):
+        """True if logcat is collected from the device's streaming
+        logcat reader rather than by dumping the device's buffer."""
+        return self.phonetest.options.device_logcat_stream
 
     def get(self, full=False):
         """Return the contents of logcat as list of strings.
@@ -46,17 +62,29 @@ class Logcat(object):
                      output since the last call to clear(). If
                      full is True, then get() will return all
                      logcat output since the test was initialized or
-                     teardown_job was last called.
+                     teardown_job was last called as an iterable
+                     LogcatStore which may be iterated without
+                     loading the output into memory.
         """
+        if self.streaming:
+            # Only the lines received by the reader since the previous
+            # call are collected, so there are no duplicates to remove.
+            reader = self.phonetest.dm.get_logcat_reader()
+            lines, self._cursor = reader.get_lines(self._cursor)
+            current_logcat = [unicode(x, 'UTF-8', errors='replace').strip()
+                              for x in lines]
+            self._accumulated_logcat.extend(current_logcat)
+            if full:
+                return self._accumulated_logcat
+            return current_logcat
 
         # Get the datetime from the last logcat message
         # previously collected. Note that with the time
         # format, logcat lines begin with a date time of the
         # form: 09-17 16:45:04.370 which is the first 18
         # characters of the line.
-        if self._accumulated_logcat:
-            logcat_datestr = self._accumulated_logcat[-1][:18]
-        else:
+        logcat_datestr = self._accumulated_logcat.boundary
+        if logcat_datestr is None:
             logcat_datestr = '00-00 00:00:00.000'
 
         self.logger.debug('Logcat.get() since %s' % logcat_datestr)
@@ -90,40 +118,35 @@ class Logcat(object):
 
         current_logcat = []
         prev_line_date = None
+        prev_line_datestr = None
         curr_line_date = None
-        curr_year = datetime.datetime.now().year
-        hour = datetime.timedelta(hours=1)
+        parser = LogcatTimeParser()
 
         for line in raw_logcat:
-            try:
-                curr_line_date = datetime.datetime.strptime('%4d-%s' % (
-                    curr_year, line[:18]), '%Y-%m-%d %H:%M:%S.%f')
-            except ValueError:
-                curr_line_date = None
+            curr_line_date = parser.parse(line)
             if curr_line_date and prev_line_date:
                 delta = curr_line_date - prev_line_date
-                prev_line_datestr = prev_line_date.strftime('%m-%d %H:%M:%S.%f')
-                if delta <= -hour:
+                if delta <= -MS_PER_HOUR:
                     # The previous line's date is one or more hours in
                     # the future compared to the current line. Keep
                     # the current lines which are before the previous
                     # line's date.
                     new_current_logcat = []
                     for x in current_logcat:
-                        if x < prev_line_datestr:
+                        if x[:18] <= prev_line_datestr:
                             self.logger.debug('Logcat.get(): Discarding future line: %s' % x)
                         else:
                             self.logger.debug('Logcat.get(): keeping line: %s' % x)
                             new_current_logcat.append(x)
                     current_logcat = new_current_logcat
-                elif delta >= hour:
+                elif delta >= MS_PER_HOUR:
                     # The previous line's date is one or more hours in
                     # the past compared to the current line. Keep the
                     # current lines which are after the previous
                     # line's date.
                     new_current_logcat = []
                     for x in current_logcat:
-                        if x > prev_line_datestr:
+                        if x[:18] > prev_line_datestr:
                             self.logger.debug('Logcat.get(): Discarding past line: %s' % x)
                         else:
                             self.logger.debug('Logcat.get(): keeping line: %s' % x)
@@ -134,17 +157,13 @@ class Logcat(object):
             if line >= logcat_datestr:
                 current_logcat.append(line)
             prev_line_date = curr_line_date
+            prev_line_datestr = line[:18]
 
         # In order to eliminate the possible duplicate
-        # messages, partition the messages by before, on and
-        # after the logcat_datestr.
-        accumulated_logcat_before = []
-        accumulated_logcat_now = []
-        for x in self._accumulated_logcat:
-            if x < logcat_datestr:
-                accumulated_logcat_before.append(x)
-            elif x[:18] == logcat_datestr:
-                accumulated_logcat_now.append(x)
+        # messages, partition the messages by on and after the
+        # logcat_datestr. Only the previously accumulated messages
+        # on the logcat_datestr can be duplicated.
+        accumulated_logcat_now = self._accumulated_logcat.boundary_lines
 
         current_logcat_now = []
         current_logcat_after = []
@@ -157,31 +176,200 @@ class Logcat(object):
         # Remove any previously received messages from
         # current_logcat_now for the logcat_datestr.
         current_logcat_now = set(current_logcat_now).difference(
-            set(accumulated_logcat_now))
+            accumulated_logcat_now)
         current_logcat_now = list(current_logcat_now)
         current_logcat_now.sort()
 
         current_logcat = current_logcat_now + current_logcat_after
-        self._accumulated_logcat += current_logcat
+        self._accumulated_logcat.extend(current_logcat)
 
         if full:
             return self._accumulated_logcat
         return current_logcat
 
+    def wait(self, timeout):
+        """Waits for up to timeout seconds for new logcat output. When
+        streaming, returns as soon as new output has been received
+        by the device's logcat reader. Otherwise sleeps for the
+        timeout since the device's buffer must be polled.
+
+        :param timeout: The maximum time in seconds to wait.
+        """
+        if self.streaming:
+            self.phonetest.dm.get_logcat_reader().wait(self._cursor, timeout)
+        else:
+            sleep(timeout)
+
     def reset(self):
         """Clears the Logcat buffers and the device's logcat buffer."""
         self.logger.debug('Logcat.reset()')
+        self._accumulated_logcat.close()
         self.__init__(self.phonetest, self.logger)
         self.phonetest.dm.clear_logcat()
+        if self.streaming:
+            self._cursor = self.phonetest.dm.get_logcat_reader().cursor
 
     def clear(self):
         """Accumulates current logcat buffers, then clears the device's logcat
         buffers. clear() is used to prevent the device's logcat buffer
-        from overflowing while not losing any output.
+        from overflowing while not losing any output. When streaming,
+        the device's logcat buffer is not cleared.
         """
         self.logger.debug('Logcat.clear()')
         self.get()
-        self.phonetest.dm.clear_logcat()
+        if not self.streaming:
+            # The streaming reader consumes the device's buffer as
+            # output arrives so it can not overflow.
+            self.phonetest.dm.clear_logcat()
+
+    def log_full(self, logger, block_size=1000):
+        """Logs the full contents of logcat at debug level in blocks
+        of block_size lines so that the output is never joined into a
+        single string.
+
+        :param logger: logger or LogDecorator to log to.
+        :param block_size: number of lines per log message.
+        """
+        block = []
+        for line in self.get(full=True):
+            block.append(line)
+            if len(block) == block_size:
+                logger.debug('\n'.join(block))
+                block = []
+        if block:
+            logger.debug('\n'.join(block))
+
+
+class LogcatEvents(object):
+    """Extracts named events from the logcat output collected by a
+    Logcat object in a single pass over each line.
+
+    Events are registered with add_event() as regular expressions
+    which are matched at the start of each line. The expressions are
+    compiled into a single combined expression so that each line is
+    scanned once regardless of the number of events. Since a line may
+    match several events, the result for a line is a dict of the
+    names of the events it matched and their groups. At most
+    MAX_MATCHES matching lines are kept.
+
+    ::
+
+        events = LogcatEvents(self.logcat, self.loggerdeco)
+        events.add_event('report', r'.*__start_report([0-9\.]+)__end_report')
+        if events.wait_for_events(['report'], 90):
+            for line, matches in events.matches:
+                value = float(matches['report'][0])
+    """
+    MAX_MATCHES = 10000
+
+    def __init__(self, logcat, logger):
+        self.logcat = logcat
+        self.logger = logger
+        self._events = []
+        self._regex = None
+        self.reset()
+
+    def reset(self):
+        """Discards the events seen so far."""
+        #: list of (line, {name: groups}) tuples for each line which
+        #: matched at least one event, in the order the lines were
+        #: logged.
+        self.matches = []
+        self._seen = set()
+        self._regex = None
+
+    def add_event(self, name, pattern, first_only=False):
+        """Registers an event.
+
+        :param str name: The name of the event.
+        :param str pattern: Regular expression matched at the start of
+            each line. Its groups are returned with each match. It may
+            not contain named groups or backreferences.
+        :param bool first_only: If True, the event is no longer
+            matched once it has been seen.
+        """
+        self._events.append((name, pattern, first_only))
+        self._regex = None
+
+    def _compile(self):
+        # Each event becomes an optional lookahead containing a group
+        # wrapping the event's pattern so that all of the events are
+        # tested at the start of the line by a single match. The
+        # index of the wrapping group and the number of groups in the
+        # pattern locate the event's groups in the combined match.
+        # First only events which have been seen are left out.
+        parts = []
+        self._groups = []
+        index = 0
+        for name, pattern, first_only in self._events:
+            if first_only and name in self._seen:
+                continue
+            count = re.compile(pattern).groups
+            parts.append('(?:(?=(%s)))?' % pattern)
+            self._groups.append((name, index, count, first_only))
+            index += count + 1
+        self._regex = re.compile(''.join(parts))
+
+    def process(self, lines):
+        """Matches the events against lines."""
+        if self._regex is None:
+            self._compile()
+        for line in lines:
+            groups = self._regex.match(line).groups()
+            matches = {}
+            first_only_seen = False
+            for name, index, count, first_only in self._groups:
+                if groups[index] is not None:
+                    matches[name] = groups[index + 1:index + 1 + count]
+                    first_only_seen = first_only_seen or first_only
+            if not matches:
+                continue
+            self._seen.update(matches.keys())
+            if first_only_seen:
+                self._compile()
+            if len(self.matches) < self.MAX_MATCHES:
+                self.logger.debug('LogcatEvents: %s %s' %
+                                  (sorted(matches.keys()), line))
+                self.matches.append((line, matches))
+                if len(self.matches) == self.MAX_MATCHES:
+                    self.logger.warning('LogcatEvents: kept %d matching '
+                                        'lines, discarding later lines' %
+                                        self.MAX_MATCHES)
+
+    def seen(self, name):
+        """Returns True if the event has been seen."""
+        return name in self._seen
+
+    def wait_for_events(self, names, timeout, abort=None,
+                        abort_interval=3):
+        """Collects logcat output until each of the named events has been
+        seen at least once or the timeout expires. When the Logcat is
+        streaming, new output is processed as soon as it arrives.
+
+        :param list names: The names of the events to wait for.
+        :param timeout: The maximum time in seconds to wait.
+        :param abort: Optional callable which is called at most every
+            abort_interval seconds. If it returns True, the wait is
+            abandoned.
+        :param abort_interval: Seconds between calls to abort. When
+            not streaming, this is also the interval at which the
+            device's logcat is polled.
+        :returns: boolean - True if all of the events were seen.
+        """
+        deadline = time.time() + timeout
+        next_abort_check = time.time() + abort_interval
+        while True:
+            self.process(self.logcat.get())
+            if not [name for name in names if name not in self._seen]:
+                return True
+            now = time.time()
+            if now >= next_abort_check:
+                if abort and abort():
+                    return False
+                next_abort_check = now + abort_interval
+            if now >= deadline:
+                return False
+            self.logcat.wait(min(deadline, next_abort_check) - now)
 
 
 class PhoneTest(object):
@@ -190,6 +378,9 @@ class PhoneTest(object):
 
     instances = {}
 
+    # True for tests which measure performance.
+    perf_test = False
+
     @classmethod
     def lookup(cls, phoneid, config_file, chunk):
         key = '%s:%s:%s' % (phoneid, config_file, chunk)
@@ -354,6 +545,8 @@ class PhoneTest(object):
         # crash_processor is an instance of AutophoneCrashProcessor that
         # is used by non-unittests to process device errors and crashes.
         self.crash_processor = None
+        # Set when handle_crashes finds a crash during the current job.
+        self.crash_detected = False
         # Instrument running time
         self.start_time = None
         self.stop_time = None
@@ -729,6 +922,8 @@ class PhoneTest(object):
         for error in self.crash_processor.get_errors(self.build.symbols,
                                                      self.options.minidump_stackwalk,
                                                      clean=False):
+            if error['reason'] in ('java-exception', 'PROCESS-CRASH'):
+                self.crash_detected = True
             if error['reason'] == 'java-exception':
                 self.test_failure(
                     self.name, 'PROCESS-CRASH',
@@ -792,20 +987,18 @@ class PhoneTest(object):
 
         return success
 
-    def wait_for_fennec(self, max_wait_time=60, wait_time=5,
-                        kill_wait_time=20, root=True):
+    def wait_for_fennec(self, max_wait_time=60, kill_wait_time=20,
+                        root=True):
         # Wait for up to a max_wait_time seconds for fennec to close
-        # itself in response to the quitter request. Check that fennec
-        # is still running every wait_time seconds. If fennec doesn't
+        # itself in response to the quitter request. The wait runs on
+        # the device and returns as soon as fennec exits. If fennec doesn't
         # close on its own, attempt up to 3 times to kill fennec, waiting
         # kill_wait_time seconds between attempts.
         # Return True if fennec exits on its own, False if it needs to be killed.
         # Re-raise the last exception if fennec can not be killed.
-        max_wait_attempts = max_wait_time / wait_time
-        for wait_attempt in range(1, max_wait_attempts+1):
-            if not self.dm.process_exist(self.build.app_name):
-                return True
-            sleep(wait_time)
+        if self.dm.wait_for_process_exit(self.build.app_name,
+                                         max_wait_time=max_wait_time):
+            return True
         self.loggerdeco.debug('killing fennec')
         max_killattempts = 3
         for kill_attempt in range(1, max_killattempts+1):
@@ -820,20 +1013,99 @@ class PhoneTest(object):
                 sleep(kill_wait_time)
         return False
 
+    def _get_local_pages_manifest(self):
+        """Returns a dict mapping the device path of each file pushed
+        by install_local_pages to a tuple of its local path and
+        digest."""
+        manifest = {}
+        for push_source, push_dest in self._pushes.iteritems():
+            if not os.path.isdir(push_source):
+                manifest[push_dest] = (push_source,
+                                       utils.file_digest(push_source))
+                continue
+            for root, dirs, files in os.walk(push_source):
+                for name in files:
+                    local = os.path.join(root, name)
+                    relpath = os.path.relpath(local, push_source)
+                    remote = posixpath.join(push_dest,
+                                            *relpath.split(os.sep))
+                    manifest[remote] = (local, utils.file_digest(local))
+        return manifest
+
+    def _sync_local_pages(self):
+        """Updates the local pages on the device using the manifest of
+        the digests of the files installed by the previous sync. Only
+        the files which have changed are pushed and only the files
+        which no longer exist are removed. If the device does not
+        have a manifest, the pages are installed from scratch.
+        """
+        dest = self._paths['dest']
+        manifest_path = posixpath.join(dest, LOCAL_PAGES_MANIFEST)
+        local_manifest = self._get_local_pages_manifest()
+        device_manifest = {}
+        if self.dm.is_file(manifest_path, root=True):
+            for line in self.dm.shell_output('cat %s' % manifest_path,
+                                             root=True).splitlines():
+                digest, sep, path = line.strip().partition(' ')
+                if path:
+                    device_manifest[path] = digest
+
+        if not device_manifest:
+            self.dm.rm(dest, recursive=True, force=True, root=True)
+            self.dm.mkdir(dest, parents=True, root=True)
+            for push_source in self._pushes:
+                self.dm.push(push_source, self._pushes[push_source])
+            changed = local_manifest.keys()
+            deleted = []
+        else:
+            changed = [path for path in local_manifest
+                       if device_manifest.get(path) != local_manifest[path][1]]
+            deleted = [path for path in device_manifest
+                       if path not in local_manifest]
+            if changed or deleted:
+                # Remove the manifest until the update completes so that
+                # an interrupted update is followed by a full install.
+                self.dm.rm(manifest_path, force=True, root=True)
+            if deleted:
+                self.dm.shell_batch(['rm -f "%s"' % path for path in deleted],
+                                    root=True)
+            for path in changed:
+                self.dm.push(local_manifest[path][0], path)
+
+        self.loggerdeco.info('install_local_pages: %d pushed, %d removed, '
+                             '%d unchanged' % (
+                                 len(changed), len(deleted),
+                                 len(local_manifest) - len(changed)))
+        if not changed and not deleted:
+            return
+
+        self.dm.chmod(dest, recursive=True, root=True)
+        manifest_file = tempfile.NamedTemporaryFile(suffix='.manifest')
+        try:
+            for path in sorted(local_manifest):
+                manifest_file.write('%s %s\n' % (local_manifest[path][1], path))
+            manifest_file.flush()
+            self.dm.push(manifest_file.name, manifest_path)
+        finally:
+            manifest_file.close()
+
     def install_local_pages(self):
         success = False
         for attempt in range(1, self.options.phone_retry_limit+1):
             self.loggerdeco.debug('Attempt %d Installing local pages' % attempt)
             try:
-                self.dm.rm(self._paths['dest'], recursive=True, force=True, root=True)
-                self.dm.mkdir(self._paths['dest'], parents=True, root=True)
-                for push_source in self._pushes:
-                    push_dest = self._pushes[push_source]
-                    if os.path.isdir(push_source):
-                        self.dm.push(push_source, push_dest)
-                    else:
-                        self.dm.push(push_source, push_dest)
-                self.dm.chmod(self._paths['dest'], recursive=True, root=True)
+                if self.options.device_sync_local_pages:
+                    self._sync_local_pages()
+                else:
+                    self.dm.rm(self._paths['dest'], recursive=True, force=True, root=True)
+                    self.dm.mkdir(self._paths['dest'], parents=True, root=True)
+                    for push_source in self._pushes:
+                        push_dest = self._pushes[push_source]
+                        if os.path.isdir(push_source):
+                            self.dm.push(push_source, push_dest)
+                        else:
+                            self.dm.push(push_source, push_dest)
+                    self.dm.chmod(self._paths['dest'], recursive=True, root=True)
                 success = True
                 break
             except ADBError:
@@ -865,7 +1137,7 @@ class PhoneTest(object):
         self.job_details = []
         self.loggerdeco.debug('phonetest.setup_job: full logcat before job:')
         try:
-            self.loggerdeco.debug('\n'.join(self.logcat.get(full=True)))
+            self.logcat.log_full(self.loggerdeco)
         except:
             self.loggerdeco.exception('Exception getting logcat')
         try:
@@ -920,6 +1192,7 @@ class PhoneTest(object):
                                                        self.upload_dir,
                                                        self.build.app_name)
         self.crash_processor.clear()
+        self.crash_detected = False
         self.test_result = PhoneTestResult()
         if not self.worker_subprocess.is_disabled():
             self.update_status(phone_status=PhoneStatus.WORKING,
@@ -959,7 +1232,7 @@ class PhoneTest(object):
         # logcat buffers to help prevent the device's buffer from
         # over flowing after the test.
         self.loggerdeco.debug('phonetest.teardown_job full logcat after job:')
-        self.loggerdeco.debug('\n'.join(self.logcat.get(full=True)))
+        self.logcat.log_full(self.loggerdeco)
         try:
             if (self.worker_subprocess.is_disabled() and
                 self.test_result.status != PhoneTestResult.USERCANCEL):
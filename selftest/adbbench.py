@@ -0,0 +1,123 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Micro-benchmark of the host side latency of ADBDevice.shell_output().
+
+The commands are executed by selftest/fakeadb.sh, which runs them on
+the host, or by the fake adb server in selftest/fakeadbserver.py, so
+no device is required. The numbers therefore measure only the cost of
+starting, waiting for and collecting the adb command.
+
+usage: python selftest/adbbench.py [--iterations N]
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+import adb
+from adb import ADBDevice
+from adb_transport import ADBServerTransport
+from fakeadbserver import FakeADBServer
+
+FAKE_ADB = os.path.join(here, 'fakeadb.sh')
+
+
+class BenchADBDevice(ADBDevice):
+
+    def is_device_ready(self, timeout=None):
+        return True
+
+    def get_battery_percentage(self, timeout=None):
+        return 100
+
+
+class PollingADBProcess(adb.ADBProcess):
+    """ADBProcess which waits for the adb process by polling every
+    100 ms as ADBCommand did previously. Used as the baseline."""
+    def wait(self, timeout):
+        start_time = time.time()
+        exitcode = self.proc.poll()
+        while (time.time() - start_time) <= timeout and exitcode is None:
+            time.sleep(0.1)
+            exitcode = self.proc.poll()
+        if exitcode is None:
+            self.proc.kill()
+            self.timedout = True
+            exitcode = self.proc.wait()
+        return exitcode
+
+
+def measure(device, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        output = device.shell_output('echo %d' % i)
+        timings.append(time.time() - start)
+        assert output == str(i), 'unexpected output %r' % output
+    timings.sort()
+    return timings
+
+
+def report(name, timings):
+    count = len(timings)
+    print '%-32s mean %7.2f ms  median %7.2f ms  p95 %7.2f ms' % (
+        name,
+        1000 * sum(timings) / count,
+        1000 * timings[count / 2],
+        1000 * timings[min(count - 1, int(count * 0.95))])
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--iterations', type='int', default=100,
+                      help='number of shell_output calls per mode '
+                      '[default: %default]')
+    options, args = parser.parse_args()
+
+    device = BenchADBDevice(device='FAKE0001', adb=FAKE_ADB)
+
+    real_adb_process = adb.ADBProcess
+    adb.ADBProcess = PollingADBProcess
+    try:
+        report('adb process, 100 ms polling',
+               measure(device, options.iterations))
+    finally:
+        adb.ADBProcess = real_adb_process
+
+    report('adb process, event driven', measure(device, options.iterations))
+
+    device._output_buffer_size = 1024 * 1024
+    report('adb process, in memory output',
+           measure(device, options.iterations))
+    device._output_buffer_size = 0
+
+    device._use_shell_session = True
+    report('shell session', measure(device, options.iterations))
+    device.close_shell_session()
+    device._use_shell_session = False
+
+    device_root = tempfile.mkdtemp()
+    server = FakeADBServer()
+    fake_device = server.add_device('FAKE0001', device_root)
+    fake_device.script(r'^echo ', lambda cmd: (cmd[len('echo '):], 0))
+    server.start()
+    try:
+        device._transport = ADBServerTransport(adb_port=server.port)
+        report('adb server transport', measure(device, options.iterations))
+    finally:
+        device._transport = None
+        server.stop()
+        shutil.rmtree(device_root)
+
+
+if __name__ == '__main__':
+    main()
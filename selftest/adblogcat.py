@@ -0,0 +1,87 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from adb import ADBLogcatReader
+
+
+class ADBLogcatReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.reader = None
+
+    def tearDown(self):
+        if self.reader:
+            self.reader.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def start_reader(self, script, max_lines=100):
+        # Each time the fake adb logcat is started it outputs the
+        # lines in the file named by its invocation count, then exits
+        # if the file ends with exit.
+        path = os.path.join(self.temp_dir, 'logcat.sh')
+        with open(path, 'w') as f:
+            f.write('cd %s\n'
+                    'n=$(cat count 2>/dev/null || echo 0)\n'
+                    'echo $((n + 1)) > count\n'
+                    'cat $n 2>/dev/null\n'
+                    'grep -q exit $n 2>/dev/null || exec sleep 60\n' %
+                    self.temp_dir)
+        for n, lines in enumerate(script):
+            with open(os.path.join(self.temp_dir, str(n)), 'w') as f:
+                f.write(''.join(['%s\r\n' % line for line in lines]))
+        self.reader = ADBLogcatReader(['/bin/sh', path],
+                                      logging.getLogger('adblogcat'),
+                                      max_lines=max_lines,
+                                      restart_wait=0.1)
+
+    def wait_for_lines(self, cursor, count):
+        lines = []
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            new_lines, cursor = self.reader.get_lines(cursor)
+            lines.extend(new_lines)
+            if len(lines) >= count:
+                break
+            self.reader.wait(cursor, deadline - time.time())
+        return lines, cursor
+
+    def test_get_lines(self):
+        self.start_reader([['--------- beginning of main', 'a', 'b']])
+        lines, cursor = self.wait_for_lines(0, 2)
+        self.assertEqual(lines, ['a', 'b'])
+        self.assertEqual(self.reader.get_lines(cursor), ([], cursor))
+        self.assertEqual(self.reader.get_lines(1), (['b'], cursor))
+
+    def test_restart_skips_duplicates(self):
+        self.start_reader([['a', 'b', 'exit'], ['a', 'b', 'exit', 'c']])
+        lines, cursor = self.wait_for_lines(0, 4)
+        self.assertEqual(lines, ['a', 'b', 'exit', 'c'])
+
+    def test_dropped_lines(self):
+        self.start_reader([[str(i) for i in range(10)]], max_lines=4)
+        lines, cursor = self.wait_for_lines(6, 4)
+        self.assertEqual(lines, ['6', '7', '8', '9'])
+        lines, cursor = self.reader.get_lines(2)
+        self.assertEqual(lines, ['6', '7', '8', '9'])
+
+    def test_stop(self):
+        self.start_reader([['a']])
+        self.wait_for_lines(0, 1)
+        self.reader.stop()
+        self.assertFalse(self.reader.alive)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,472 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import StringIO
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from adb import ADBCapabilityCache, ADBError, ADBHost, ADBQueryCache
+from adb_android import ADBAndroid
+from adb_transport import ADBServerTransport
+from fakeadbserver import FakeADBServer
+
+SERIAL = 'FAKE0001'
+
+
+def set_capabilities(cache, serial):
+    for i in range(20):
+        cache.set('%s-%d' % (serial, i), 'build/1', {'i': i})
+
+
+class ADBServerTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device_root = tempfile.mkdtemp()
+        self.local_dir = tempfile.mkdtemp()
+        self.server = FakeADBServer()
+        self.device = self.server.add_device(SERIAL, self.device_root)
+        self.device.script(r'^id$', 'uid=0(root) gid=0(root)')
+        self.device.script(r'^su ', '', 1)
+        self.device.script(r'^/system/bin/ls /$', 'system')
+        self.device.script(r'^/system/bin/ls -1A /$', 'system')
+        self.device.script(r'^type cp$', 'cp is /system/bin/cp')
+        self.device.script(r'^chmod --help$', 'usage: chmod [-R] MODE FILE')
+        self.device.script(r'^getenforce$', 'Permissive')
+        self.props = {'ro.build.version.sdk': '19',
+                      'ro.build.fingerprint': 'build/1',
+                      'ro.product.model': 'Fake Phone',
+                      'wifi.interface': 'wlan0'}
+        self.device.script(r'^getprop$', lambda cmd: (
+            '\n'.join(['[%s]: [%s]' % item
+                       for item in sorted(self.props.items())]), 0))
+        self.server.start()
+        self.transport = ADBServerTransport(adb_port=self.server.port)
+        self.transport.device_wait_interval = 0.1
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.device_root)
+        shutil.rmtree(self.local_dir)
+
+    def create_device(self):
+        # The adb executable is only used for commands the transport
+        # does not support, none of which are used here.
+        return ADBAndroid(device=SERIAL, adb='true',
+                          transport=self.transport, timeout=10)
+
+    def test_devices(self):
+        adbhost = ADBHost(adb='true', transport=self.transport)
+        devices = adbhost.devices()
+        self.assertEqual(devices, [{'device_serial': SERIAL,
+                                    'state': 'device'}])
+
+    def test_device_on_transport(self):
+        adbdevice = self.create_device()
+        self.assertEqual(adbdevice.version, 19)
+        self.assertTrue(adbdevice._have_root_shell)
+        self.assertEqual(adbdevice.get_state(), 'device')
+
+        self.device.script(r'^echo hello$', 'hello')
+        self.device.script(r'^false$', '', 1)
+        self.assertEqual(adbdevice.shell_output('echo hello'), 'hello')
+        self.assertTrue(adbdevice.shell_bool('echo hello'))
+        self.assertFalse(adbdevice.shell_bool('false'))
+        self.assertRaises(ADBError, adbdevice.shell_output, 'false')
+        self.assertTrue('host:transport:%s' % SERIAL in self.server.requests)
+
+    def test_command_stats(self):
+        adbdevice = self.create_device()
+        adbdevice.command_stats.reset()
+        self.device.script(r'^pm list packages$', 'package:org.mozilla.fennec')
+        self.device.script(r'^false$', '', 1)
+        for i in range(3):
+            adbdevice.shell_output('pm list packages')
+        self.assertFalse(adbdevice.shell_bool('false'))
+        self.assertEqual(adbdevice.get_state(), 'device')
+        histograms = adbdevice.command_stats.histograms
+        self.assertEqual(sorted(histograms.keys()),
+                         ['get-state', 'shell:false', 'shell:pm'])
+        self.assertEqual(histograms['shell:pm'].count, 3)
+        self.assertEqual(sum(histograms['shell:pm'].buckets), 3)
+        self.assertEqual(histograms['shell:false'].failures, 1)
+        self.assertTrue('shell:pm' in str(adbdevice.command_stats.copy()))
+
+    def test_query_cache(self):
+        adbdevice = self.create_device()
+        adbdevice.query_cache = ADBQueryCache(ttl=60)
+        files = set(['/sdcard/a'])
+
+        def rm(cmd):
+            files.discard(cmd.split()[-1])
+            return '', 0
+
+        self.device.script(r'^ls -a /sdcard/a/?$', lambda cmd: (
+            '', 0 if '/sdcard/a' in files else 1))
+        self.device.script(r'^ls -a /sdcard/b/?$', '', 1)
+        self.device.script(r'^rm /sdcard/a$', rm)
+        self.device.script(r'^pm list package', 'package:org.mozilla.fennec')
+
+        def count_requests(func, *args):
+            requests = len(self.device.requests)
+            result = func(*args)
+            return result, len(self.device.requests) - requests
+
+        self.assertEqual(count_requests(adbdevice.exists, '/sdcard/a'),
+                         (True, 1))
+        self.assertEqual(count_requests(adbdevice.exists, '/sdcard/a/'),
+                         (True, 0))
+        self.assertEqual(count_requests(adbdevice.is_dir, '/sdcard/b'),
+                         (False, 1))
+        self.assertEqual(count_requests(adbdevice.is_dir, '/sdcard/b'),
+                         (False, 0))
+        self.assertEqual(count_requests(adbdevice.is_app_installed,
+                                        'org.mozilla.fennec'), (True, 1))
+        self.assertEqual(count_requests(adbdevice.is_app_installed,
+                                        'org.mozilla.fennec'), (True, 0))
+        self.assertEqual(adbdevice.command_stats.queries['exists'], [1, 1])
+
+        # Modifying a path invalidates its results but not those of
+        # unrelated paths.
+        adbdevice.rm('/sdcard/a')
+        self.assertEqual(count_requests(adbdevice.exists, '/sdcard/a'),
+                         (False, 1))
+        self.assertEqual(count_requests(adbdevice.is_dir, '/sdcard/b'),
+                         (False, 0))
+
+        # Shell commands may modify the device, so they discard all of
+        # the results.
+        self.assertEqual(count_requests(adbdevice.is_app_installed,
+                                        'org.mozilla.fennec'), (True, 0))
+        files.add('/sdcard/a')
+        self.device.script(r'^touch /sdcard/a$', '')
+        adbdevice.shell_output('touch /sdcard/a')
+        self.assertEqual(count_requests(adbdevice.exists, '/sdcard/a'),
+                         (True, 1))
+        self.assertEqual(count_requests(adbdevice.is_app_installed,
+                                        'org.mozilla.fennec'), (True, 1))
+
+        cache = adbdevice.query_cache
+        cache.invalidate_path('/sdcard')
+        self.assertEqual(cache.get(('is_dir', '/sdcard/b', False)),
+                         (False, None))
+        cache.invalidate_apps(['org.mozilla.fennec'])
+        self.assertEqual(cache.get(('is_app_installed',
+                                    'org.mozilla.fennec')), (False, None))
+
+    def test_props(self):
+        adbdevice = self.create_device()
+        self.props['ro.build.description'] = 'line 1\nline 2'
+        self.assertEqual(adbdevice.get_prop('ro.product.model'), 'Fake Phone')
+        requests = len(self.device.requests)
+        self.assertEqual(adbdevice.get_prop('ro.build.version.sdk'), '19')
+        self.assertEqual(len(self.device.requests), requests)
+
+        # Mutable properties are read from the device each time.
+        self.assertEqual(adbdevice.get_prop('wifi.interface'), 'wlan0')
+        self.props['wifi.interface'] = 'eth0'
+        self.props['ro.product.model'] = 'Changed'
+        self.assertEqual(adbdevice.get_prop('ro.product.model'), 'Fake Phone')
+        self.assertEqual(adbdevice.get_prop('wifi.interface'), 'eth0')
+        self.assertEqual(len(self.device.requests), requests + 2)
+        # Reading them refreshes the whole snapshot.
+        self.assertEqual(adbdevice.get_prop('ro.product.model'), 'Changed')
+        self.assertEqual(adbdevice.get_prop('missing'), '')
+
+        # Unless they are served from the snapshot for prop_cache_ttl
+        # seconds.
+        adbdevice.prop_cache_ttl = 60
+        self.props['wifi.interface'] = 'wlan1'
+        requests = len(self.device.requests)
+        self.assertEqual(adbdevice.get_prop('wifi.interface'), 'eth0')
+        self.assertEqual(len(self.device.requests), requests)
+        self.assertEqual(adbdevice.get_prop('ro.build.description'),
+                         'line 1\nline 2')
+
+    def test_capability_cache(self):
+        cache = ADBCapabilityCache(os.path.join(self.local_dir,
+                                                'capabilities.json'))
+        factory_reset = []
+        self.device.script(r'^ls -a /sdcard/?$',
+                           lambda cmd: ('', 1 if factory_reset else 0))
+        self.device.script(r'^ls -a (/data/local|.*/dummy)/?$', '')
+        self.device.script(r'^(rm|mkdir) ', '')
+
+        def create_device():
+            requests = len(self.device.requests)
+            adbdevice = ADBAndroid(device=SERIAL, adb='true',
+                                   transport=self.transport, timeout=10,
+                                   capability_cache=cache)
+            return adbdevice, self.device.requests[requests:]
+
+        adbdevice, requests = create_device()
+        self.assertTrue('type cp; echo rc=$?' in requests)
+        # The test root is saved once it has been determined.
+        self.assertEqual(adbdevice.test_root, '/sdcard/tests')
+        probed = dict([(name, getattr(adbdevice, name))
+                       for name in adbdevice._capability_names])
+
+        adbdevice, requests = create_device()
+        self.assertFalse('type cp; echo rc=$?' in requests)
+        self.assertEqual(dict([(name, getattr(adbdevice, name))
+                               for name in adbdevice._capability_names]),
+                         probed)
+        self.assertTrue(isinstance(adbdevice._ls, str))
+        requests = len(self.device.requests)
+        self.assertEqual(adbdevice.test_root, '/sdcard/tests')
+        self.assertEqual(len(self.device.requests), requests)
+
+        # A cached test root which no longer works is probed again.
+        factory_reset.append(True)
+        adbdevice, requests = create_device()
+        self.assertFalse('type cp; echo rc=$?' in requests)
+        self.assertEqual(adbdevice.test_root, '/data/local/tests')
+
+        # A reflashed device is probed again.
+        self.props['ro.build.fingerprint'] = 'build/2'
+        adbdevice, requests = create_device()
+        self.assertTrue('type cp; echo rc=$?' in requests)
+
+        cache.remove(SERIAL)
+        self.assertEqual(cache.get(SERIAL, 'build/2'), None)
+
+    def test_capability_cache_processes(self):
+        cache = ADBCapabilityCache(os.path.join(self.local_dir,
+                                                'capabilities.json'))
+        processes = [multiprocessing.Process(target=set_capabilities,
+                                             args=(cache, 'serial%d' % i))
+                     for i in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        # No process's update was lost.
+        for i in range(4):
+            for j in range(20):
+                self.assertEqual(cache.get('serial%d-%d' % (i, j), 'build/1'),
+                                 {'i': j})
+
+    def test_shell_batch(self):
+        adbdevice = self.create_device()
+        self.device.execute = True
+        cmds = ['echo one', 'false', 'printf two', 'echo err >&2; exit 3',
+                'cd / && pwd']
+        cmds.extend(['echo %d' % i for i in range(200)])
+        requests = len(self.device.requests)
+        results = adbdevice.shell_batch(cmds)
+        self.assertEqual(results[:5], [('one', 0), ('', 1), ('two', 0),
+                                       ('err', 3), ('/', 0)])
+        self.assertEqual(results[5:], [(str(i), 0) for i in range(200)])
+        # The commands are split across as few shell invocations as
+        # the maximum command line length permits.
+        self.assertTrue(1 < len(self.device.requests) - requests < 8)
+        self.assertEqual(adbdevice.shell_batch([]), [])
+
+    def test_wait_for_process_exit(self):
+        adbdevice = self.create_device()
+        count_path = os.path.join(self.local_dir, 'ps_count')
+        # The process is listed by the first ps_running calls of ps.
+        ps = ('ps() { n=$(cat %s); echo $((n+1)) > %s; '
+              'echo "USER PID PPID VSIZE RSS WCHAN PC NAME"; '
+              'if [ $n -lt %%d ]; then '
+              'echo "u0_a1 123 1 0 0 0 0 S /system/bin/org.mozilla.fennec"; '
+              'fi; echo "root 1 0 0 0 0 0 S /init"; }; ' % (count_path,
+                                                           count_path))
+        ps_running = []
+
+        def run(cmd):
+            if ps_running[0] is None:
+                return 'sh: syntax error', 0
+            with open(count_path, 'w') as f:
+                f.write('0')
+            proc = subprocess.Popen(['/bin/sh', '-c',
+                                     ps % ps_running[0] + cmd],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            return proc.communicate()[0], proc.returncode
+
+        self.device.script(r'^i=0; while :; do', run)
+        ps_running.append(2)
+        self.assertTrue(adbdevice.wait_for_process_exit('org.mozilla.fennec',
+                                                        max_wait_time=10))
+        with open(count_path) as f:
+            self.assertEqual(f.read().strip(), '3')
+
+        ps_running[0] = 100
+        start = time.time()
+        self.assertFalse(adbdevice.wait_for_process_exit(
+            ['org.mozilla.fennec', 'org.mozilla.fennec:gecko'],
+            max_wait_time=1))
+        self.assertTrue(time.time() - start >= 1)
+
+        # Output other than exited or running is an error.
+        ps_running[0] = None
+        self.assertRaises(ADBError, adbdevice.wait_for_process_exit,
+                          'org.mozilla.fennec')
+
+    def test_push_pull(self):
+        adbdevice = self.create_device()
+        source_dir = os.path.join(self.local_dir, 'source')
+        os.makedirs(os.path.join(source_dir, 'subdir'))
+        contents = {'a.txt': 'a' * 100000,
+                    os.path.join('subdir', 'b.txt'): 'b'}
+        for name, data in contents.iteritems():
+            with open(os.path.join(source_dir, name), 'wb') as f:
+                f.write(data)
+        os.makedirs(os.path.join(self.device_root, 'sdcard', 'tests'))
+
+        adbdevice.push(source_dir, '/sdcard/tests')
+        for name, data in contents.iteritems():
+            with open(os.path.join(self.device_root, 'sdcard', 'tests',
+                                   name), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+        dest_dir = os.path.join(self.local_dir, 'dest')
+        os.makedirs(dest_dir)
+        adbdevice.pull('/sdcard/tests', dest_dir)
+        for name, data in contents.iteritems():
+            with open(os.path.join(dest_dir, name), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+        self.assertRaises(ADBError, adbdevice.pull, '/sdcard/missing',
+                          dest_dir)
+
+    def run_on_host(self, cmd):
+        # Run the command on the host beneath the device root.
+        cmd = re.sub(r' /(?!dev/null)', ' %s/' % self.device_root, cmd)
+        proc = subprocess.Popen(['/bin/sh', '-c', cmd],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        return proc.communicate()[0], proc.returncode
+
+    def create_archive_device(self, run=None):
+        run = run or self.run_on_host
+        os.makedirs(os.path.join(self.device_root, 'proc'))
+        with open(os.path.join(self.device_root, 'proc', 'version'), 'w') as f:
+            f.write('Linux version 3.4.0\n')
+        self.device.script(r'^tar ', run)
+        adbdevice = self.create_device()
+        self.assertEqual(adbdevice._tar, 'tar')
+        self.assertTrue(adbdevice._tar_z)
+        self.device.script(r'^(tar|mkdir|ls|rm) ', run)
+        adbdevice._test_root = '/data/local/tests'
+        os.makedirs(os.path.join(self.device_root, 'data', 'local', 'tests'))
+        return adbdevice
+
+    def test_push_pull_archive(self):
+        adbdevice = self.create_archive_device()
+
+        source_dir = os.path.join(self.local_dir, 'source')
+        contents = {}
+        for i in range(50):
+            contents[os.path.join('dir%d' % (i % 5), 'f%d.txt' % i)] = str(i)
+        for name, data in contents.iteritems():
+            path = os.path.join(source_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(data)
+
+        for archive in ('tar', 'tgz'):
+            remote = '/sdcard/%s' % archive
+            dest_dir = os.path.join(self.local_dir, archive)
+            requests = len(self.device.requests)
+            adbdevice.push(source_dir, remote, archive=archive)
+            adbdevice.pull(remote, dest_dir, archive=archive)
+            for name, data in contents.iteritems():
+                for root in (os.path.join(self.device_root, remote[1:]),
+                             dest_dir):
+                    with open(os.path.join(root, name), 'rb') as f:
+                        self.assertEqual(f.read(), data)
+            self.assertTrue(len(self.device.requests) - requests < 10)
+            # The archives are removed.
+            self.assertEqual(os.listdir(os.path.join(
+                self.device_root, 'data', 'local', 'tests')), [])
+
+    def test_pull_archive_fallback(self):
+        def run(cmd):
+            # The device's tar fails on an unreadable file.
+            if cmd.startswith('tar -c') and '/sdcard/crashes' in cmd:
+                return 'tar: ./unreadable: Permission denied', 1
+            return self.run_on_host(cmd)
+
+        adbdevice = self.create_archive_device(run)
+        os.makedirs(os.path.join(self.device_root, 'sdcard', 'crashes'))
+        with open(os.path.join(self.device_root, 'sdcard', 'crashes',
+                               'a.dmp'), 'w') as f:
+            f.write('dump')
+        dest_dir = os.path.join(self.local_dir, 'crashes')
+        adbdevice.pull('/sdcard/crashes', dest_dir, archive='tar')
+        with open(os.path.join(dest_dir, 'a.dmp')) as f:
+            self.assertEqual(f.read(), 'dump')
+        self.assertEqual(os.listdir(os.path.join(
+            self.device_root, 'data', 'local', 'tests')), [])
+
+    def test_pull_archive_unsafe_members(self):
+        def run(cmd):
+            match = re.match(r'^tar -cf (\S+) -C /sdcard/unsafe \.$', cmd)
+            if not match:
+                return self.run_on_host(cmd)
+            # Create an archive whose members escape the destination.
+            path = os.path.join(self.device_root, match.group(1)[1:])
+            tar = tarfile.open(path, 'w')
+            for name, linkname in (('./ok.txt', None),
+                                   ('../escaped.txt', None),
+                                   (os.path.join(self.local_dir,
+                                                 'absolute.txt'), None),
+                                   ('./dir/../../escaped2.txt', None),
+                                   ('./link', '../..'),
+                                   ('./inside', 'dir/../ok.txt')):
+                info = tarfile.TarInfo(name)
+                if linkname:
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = linkname
+                    tar.addfile(info)
+                else:
+                    info.size = 2
+                    tar.addfile(info, StringIO.StringIO('ok'))
+            tar.close()
+            return '', 0
+
+        adbdevice = self.create_archive_device(run)
+        os.makedirs(os.path.join(self.device_root, 'sdcard', 'unsafe'))
+        dest_dir = os.path.join(self.local_dir, 'unsafe', 'dest')
+        adbdevice.pull('/sdcard/unsafe', dest_dir, archive='tar')
+        self.assertEqual(sorted(os.listdir(dest_dir)), ['inside', 'ok.txt'])
+        self.assertEqual(os.listdir(os.path.join(self.local_dir, 'unsafe')),
+                         ['dest'])
+        self.assertFalse(os.path.exists(os.path.join(self.local_dir,
+                                                     'absolute.txt')))
+
+    def test_wait_for_missing_device(self):
+        result = self.transport.command(['adb', 'shell', 'id'],
+                                        ['shell', 'id'],
+                                        device_serial='MISSING',
+                                        timeout=0.5)
+        self.assertTrue(result.timedout)
+
+    def test_server_not_running(self):
+        port = self.server.port
+        self.server.stop()
+        transport = ADBServerTransport(adb_port=port)
+        self.assertEqual(transport.command(['adb', 'devices'], ['devices'],
+                                           timeout=1), None)
+        # Restart a server so that tearDown can stop it.
+        self.server = FakeADBServer()
+        self.server.start()
+
+    def test_unsupported_command(self):
+        self.assertEqual(self.transport.command(['adb', 'install', 'x.apk'],
+                                                ['install', 'x.apk'],
+                                                device_serial=SERIAL),
+                         None)
@@ -0,0 +1,46 @@
+#!/bin/bash
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Minimal stand-in for the adb executable which runs shell commands
+# on the host. Used to benchmark the host side cost of adb commands
+# without a device. /system/bin/ is stripped from shell commands so
+# that the probes performed by ADBDevice succeed.
+
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -H|-P|-s)
+            shift 2
+            ;;
+        wait-for-device)
+            shift
+            ;;
+        help|version)
+            echo "Android Debug Bridge version 1.0.32 (fake)"
+            exit 0
+            ;;
+        get-state)
+            echo device
+            exit 0
+            ;;
+        root)
+            echo "adbd is already running as root"
+            exit 0
+            ;;
+        shell)
+            shift
+            if [ $# -eq 0 ]; then
+                exec /bin/sh
+            fi
+            cmd="$*"
+            exec /bin/sh -c "${cmd//\/system\/bin\//}"
+            ;;
+        *)
+            echo "fakeadb: unsupported command $1" >&2
+            exit 1
+            ;;
+    esac
+done
+exit 0
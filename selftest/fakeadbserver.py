@@ -0,0 +1,267 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""A scriptable fake adb server which speaks enough of the adb
+server's wire protocol to exercise adb_transport.ADBServerTransport
+without a device.
+
+::
+
+    server = FakeADBServer()
+    device = server.add_device('0123456789ABCDEF', tempfile.mkdtemp())
+    device.script(r'getprop ro.build.version.sdk', '19')
+    server.start()
+    transport = ADBServerTransport(adb_port=server.port)
+    ...
+    server.stop()
+"""
+
+import SocketServer
+import os
+import re
+import stat
+import struct
+import subprocess
+import threading
+import time
+
+
+class FakeADBDevice(object):
+    """A fake device attached to a FakeADBServer.
+
+    Shell commands are matched against the scripted responses in the
+    order they were added. Unmatched commands are executed with
+    /bin/sh on the host if execute is True, otherwise they fail with
+    exit code 127. Files pushed or pulled via the sync protocol are
+    stored beneath root on the host.
+    """
+    def __init__(self, serial, root, state='device', execute=False):
+        self.serial = serial
+        self.root = root
+        self.state = state
+        self.execute = execute
+        self.reboots = 0
+        self.requests = []
+        self._scripts = []
+        self._lock = threading.Lock()
+
+    def script(self, pattern, output='', exitcode=0):
+        """Responds to shell commands matching the regular expression
+        pattern with output and exitcode. output may also be a callable
+        which is passed the command and returns (output, exitcode)."""
+        self._scripts.append((re.compile(pattern), output, exitcode))
+
+    def local_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def shell(self, cmd):
+        """Returns the output of cmd as the adbd shell service would.
+        Commands submitted by ADBDevice.shell() end with '; echo rc=$?'
+        which is emulated for scripted commands."""
+        with self._lock:
+            self.requests.append(cmd)
+        suffix = '; echo rc=$?'
+        echo_rc = cmd.endswith(suffix)
+        command = cmd[:-len(suffix)] if echo_rc else cmd
+        for regex, output, exitcode in self._scripts:
+            if regex.search(command):
+                if callable(output):
+                    output, exitcode = output(command)
+                break
+        else:
+            if self.execute:
+                proc = subprocess.Popen(['/bin/sh', '-c', cmd],
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+                return proc.communicate()[0]
+            output, exitcode = '/system/bin/sh: %s: not found\n' % command, 127
+        if output and not output.endswith('\n'):
+            output += '\n'
+        if echo_rc:
+            output += 'rc=%d\n' % exitcode
+        return output
+
+
+class FakeADBRequestHandler(SocketServer.BaseRequestHandler):
+
+    def _recv_exactly(self, length):
+        data = ''
+        while len(data) < length:
+            chunk = self.request.recv(length - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def _recv_request(self):
+        length = int(self._recv_exactly(4), 16)
+        return self._recv_exactly(length)
+
+    def _okay(self, data=None):
+        if data is None:
+            self.request.sendall('OKAY')
+        else:
+            self.request.sendall('OKAY%04x%s' % (len(data), data))
+
+    def _fail(self, message):
+        self.request.sendall('FAIL%04x%s' % (len(message), message))
+
+    def _sync_fail(self, message):
+        self.request.sendall('FAIL' + struct.pack('<I', len(message)) +
+                             message)
+
+    def handle(self):
+        server = self.server
+        device = None
+        try:
+            while True:
+                request = self._recv_request()
+                server.requests.append(request)
+                if request == 'host:version':
+                    self._okay('001f')
+                    return
+                elif request in ('host:devices', 'host:devices-l'):
+                    self._okay(''.join(['%s\t%s\n' % (d.serial, d.state)
+                                        for d in server.devices.values()]))
+                    return
+                elif request.startswith('host-serial:'):
+                    serial, query = request[len('host-serial:'):].rsplit(':', 1)
+                    device = server.devices.get(serial)
+                    if not device:
+                        self._fail('device not found')
+                    elif query == 'get-state':
+                        self._okay(device.state)
+                    elif query == 'get-serialno':
+                        self._okay(device.serial)
+                    else:
+                        self._fail('unknown host service')
+                    return
+                elif request.startswith('host:transport'):
+                    if request == 'host:transport-any':
+                        devices = server.devices.values()
+                        device = devices[0] if len(devices) == 1 else None
+                    else:
+                        device = server.devices.get(
+                            request[len('host:transport:'):])
+                    if not device:
+                        self._fail('device not found')
+                        return
+                    if device.state != 'device':
+                        self._fail('device offline')
+                        return
+                    self._okay()
+                elif device and request.startswith('shell:'):
+                    self._okay()
+                    self.request.sendall(device.shell(request[len('shell:'):]))
+                    return
+                elif device and request.startswith('reboot:'):
+                    device.reboots += 1
+                    self._okay()
+                    return
+                elif device and request == 'root:':
+                    self._okay()
+                    self.request.sendall('adbd is already running as root\n')
+                    return
+                elif device and request == 'remount:':
+                    self._okay()
+                    self.request.sendall('remount succeeded\n')
+                    return
+                elif device and request == 'sync:':
+                    self._okay()
+                    self._sync(device)
+                    return
+                else:
+                    self._fail('unknown service %s' % request)
+                    return
+        except EOFError:
+            pass
+
+    def _sync(self, device):
+        while True:
+            header = self._recv_exactly(8)
+            sync_id = header[:4]
+            length = struct.unpack('<I', header[4:])[0]
+            if sync_id == 'QUIT':
+                return
+            path = self._recv_exactly(length)
+            if sync_id == 'STAT':
+                try:
+                    st = os.stat(device.local_path(path))
+                    self.request.sendall('STAT' + struct.pack(
+                        '<III', st.st_mode, st.st_size, int(st.st_mtime)))
+                except OSError:
+                    self.request.sendall('STAT' + struct.pack('<III', 0, 0, 0))
+            elif sync_id == 'LIST':
+                local_dir = device.local_path(path)
+                for name in sorted(os.listdir(local_dir)):
+                    st = os.stat(os.path.join(local_dir, name))
+                    self.request.sendall('DENT' + struct.pack(
+                        '<IIII', st.st_mode, st.st_size, int(st.st_mtime),
+                        len(name)) + name)
+                self.request.sendall('DONE' + struct.pack('<IIII', 0, 0, 0, 0))
+            elif sync_id == 'SEND':
+                remote, mode = path.rsplit(',', 1)
+                local = device.local_path(remote)
+                if not os.path.isdir(os.path.dirname(local)):
+                    os.makedirs(os.path.dirname(local))
+                with open(local, 'wb') as f:
+                    while True:
+                        header = self._recv_exactly(8)
+                        length = struct.unpack('<I', header[4:])[0]
+                        if header[:4] == 'DONE':
+                            break
+                        f.write(self._recv_exactly(length))
+                os.chmod(local, stat.S_IMODE(int(mode)))
+                self.request.sendall('OKAY' + struct.pack('<I', 0))
+            elif sync_id == 'RECV':
+                local = device.local_path(path)
+                if not os.path.isfile(local):
+                    self._sync_fail('No such file or directory')
+                    continue
+                with open(local, 'rb') as f:
+                    while True:
+                        data = f.read(64 * 1024)
+                        if not data:
+                            break
+                        self.request.sendall('DATA' +
+                                             struct.pack('<I', len(data)) +
+                                             data)
+                self.request.sendall('DONE' + struct.pack('<I', 0))
+            else:
+                self._sync_fail('unknown sync request %s' % sync_id)
+                return
+
+
+class FakeADBServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Fake adb server listening on localhost. Port 0 selects a free
+    port which is available via the port attribute."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        SocketServer.TCPServer.__init__(self, ('127.0.0.1', port),
+                                        FakeADBRequestHandler)
+        self.port = self.server_address[1]
+        self.devices = {}
+        self.requests = []
+        self._thread = None
+
+    def add_device(self, serial, root, **kwargs):
+        device = FakeADBDevice(serial, root, **kwargs)
+        self.devices[serial] = device
+        return device
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='FakeADBServer')
+        self._thread.daemon = True
+        self._thread.start()
+        # Give the server thread a chance to start listening.
+        time.sleep(0.01)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
@@ -0,0 +1,168 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Benchmark of the queries made by the Jobs class against a jobs
+database holding many pending tests, before and after the migration
+which adds the schema's indexes.
+
+The database is created at schema version 1, which matches the
+unindexed tables used before the schema was versioned, filled with
+pending jobs and tests, measured, then migrated to the current
+version and measured again.
+
+usage: python selftest/jobsbench.py [--devices N] [--tests N]
+                                    [--tests-per-job N] [--iterations N]
+"""
+
+import json
+import optparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+import jobs
+
+# Queries as made at schema version 1 and at the current version.
+QUERIES = [
+    ('jobs_pending',
+     'select count(id) from jobs where device=?',
+     'select count(id) from jobs where device=?'),
+    ('duplicate job',
+     'select id from jobs where device=? and build_url=?',
+     'select id from jobs where device=? and build_url=?'),
+    ('duplicate test',
+     'select * from tests where '
+     'name=? and config_file=? and chunk=? and repos=? and jobid=?',
+     'select * from tests where '
+     'name=? and config_file=? and chunk=? and repos=? and jobid=?'),
+    ('expired jobs',
+     'select id from jobs where device=? and attempts>=?',
+     'select id from jobs where device=? and attempts>=?'),
+    ('next job',
+     'select id,created,last_attempt,build_url,'
+     'build_id,changeset,tree,revision,revision_hash,'
+     'enable_unittests,attempts,instr(build_url,"try") as istry '
+     'from jobs where device=? order by istry desc, created asc',
+     'select id,created,last_attempt,build_url,'
+     'build_id,changeset,tree,revision,revision_hash,'
+     'enable_unittests,attempts,istry '
+     'from jobs where device=? order by istry desc, '
+     'created asc limit 1'),
+    ('job tests',
+     'select name, config_file, chunk, repos, guid '
+     'from tests where jobid=?',
+     'select name, config_file, chunk, repos, guid '
+     'from tests where jobid=?'),
+    ('cancel test',
+     'select jobid from tests where guid=?',
+     'select jobid from tests where guid=?'),
+]
+
+
+def fill(filename, devices, tests, tests_per_job):
+    conn = sqlite3.connect(filename)
+    repos = json.dumps(['mozilla-central'])
+    job_rows = []
+    test_rows = []
+    jobid = 0
+    for i in range(tests / tests_per_job):
+        jobid += 1
+        device = 'device%d' % (i % devices)
+        tree = 'try' if i % 10 == 0 else 'mozilla-central'
+        build_url = 'https://example.com/%s/%d/fennec.apk' % (tree, i)
+        job_rows.append((jobid, '2016-01-01T00:00:%06d' % i, None, build_url,
+                         '%d' % i, 'changeset', tree, 'revision', 'hash',
+                         0, 0, device))
+        for chunk in range(tests_per_job):
+            test_rows.append((None, 'test%d' % (chunk % 5),
+                              'configs/test%d.ini' % (chunk % 5), chunk,
+                              'guid-%d-%d' % (jobid, chunk), repos, jobid))
+    conn.executemany('insert into jobs values '
+                     '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', job_rows)
+    conn.executemany('insert into tests values (?, ?, ?, ?, ?, ?, ?)',
+                     test_rows)
+    conn.commit()
+    conn.close()
+    return job_rows, test_rows
+
+
+def measure(conn, sql, values_list, iterations):
+    timings = []
+    for i in range(iterations):
+        for values in values_list:
+            start = time.time()
+            conn.execute(sql, values).fetchone()
+            timings.append(time.time() - start)
+    timings.sort()
+    return timings
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--devices', type='int', default=20,
+                      help='number of devices [default: %default]')
+    parser.add_option('--tests', type='int', default=100000,
+                      help='number of pending tests [default: %default]')
+    parser.add_option('--tests-per-job', type='int', default=10,
+                      help='number of tests per job [default: %default]')
+    parser.add_option('--iterations', type='int', default=5,
+                      help='number of passes over the queries '
+                      '[default: %default]')
+    options, args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'jobs.sqlite')
+        jobs.migrate_schema(filename, version=1)
+        job_rows, test_rows = fill(filename, options.devices, options.tests,
+                                   options.tests_per_job)
+        print '%d devices, %d jobs, %d tests' % (
+            options.devices, len(job_rows), len(test_rows))
+        # Query values spread over the jobs and tests.
+        step = max(1, len(job_rows) / 20)
+        sample_jobs = job_rows[::step]
+        sample_tests = test_rows[::step * options.tests_per_job]
+        values = {
+            'jobs_pending': [(job[11],) for job in sample_jobs],
+            'duplicate job': [(job[11], job[3]) for job in sample_jobs],
+            'duplicate test': [test[1:4] + test[5:7] for test in sample_tests],
+            'expired jobs': [(job[11], jobs.Jobs.MAX_ATTEMPTS)
+                             for job in sample_jobs],
+            'next job': [(job[11],) for job in sample_jobs],
+            'job tests': [(job[0],) for job in sample_jobs],
+            'cancel test': [(test[4],) for test in sample_tests],
+        }
+
+        results = {}
+        for phase in (1, 2):
+            if phase == 2:
+                start = time.time()
+                jobs.migrate_schema(filename)
+                print 'migration to version %d: %.2f s' % (
+                    jobs.SCHEMA_VERSION, time.time() - start)
+            conn = sqlite3.connect(filename)
+            for name, legacy_sql, sql in QUERIES:
+                results.setdefault(name, []).append(
+                    measure(conn, legacy_sql if phase == 1 else sql,
+                            values[name], options.iterations))
+            conn.close()
+
+        print '%-16s %14s %14s' % ('query', 'before (ms)', 'after (ms)')
+        for name, legacy_sql, sql in QUERIES:
+            before, after = results[name]
+            print '%-16s %14.3f %14.3f' % (
+                name, 1000 * before[len(before) / 2],
+                1000 * after[len(after) / 2])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import Queue
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import jobs
+
+
+class Worker(object):
+    tests = []
+
+
+class FakeTest(object):
+
+    def __init__(self, name, config_file=None, chunk=1, repos=None,
+                 enable_unittests=False):
+        self.name = name
+        self.config_file = config_file
+        self.chunk = chunk
+        self.repos = repos or []
+        self.enable_unittests = enable_unittests
+        self.job_guid = None
+
+    def generate_guid(self):
+        self.job_guid = '%s-%s-%s' % (self.name, self.chunk, id(self))
+
+
+class JobsSchemaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def get_version(self):
+        conn = sqlite3.connect('jobs.sqlite')
+        version = conn.execute('select version from schema_version').fetchone()
+        conn.close()
+        return version[0]
+
+    def test_new_database(self):
+        jobs.Jobs(None)
+        self.assertEqual(self.get_version(), jobs.SCHEMA_VERSION)
+        conn = sqlite3.connect('jobs.sqlite')
+        indexes = [row[0] for row in conn.execute(
+            'select name from sqlite_master where type="index"')]
+        conn.close()
+        self.assertTrue('tests_guid' in indexes)
+        self.assertTrue('jobs_device_istry_created' in indexes)
+        # Migrating again does nothing.
+        self.assertEqual(jobs.migrate_schema('jobs.sqlite'),
+                         jobs.SCHEMA_VERSION)
+
+    def test_unversioned_database(self):
+        # Create the tables as they were before the schema was
+        # versioned.
+        conn = sqlite3.connect('jobs.sqlite')
+        for sql in jobs.SCHEMA_MIGRATIONS[0]:
+            conn.execute(sql.replace('if not exists ', ''))
+        for i, tree in enumerate(['mozilla-central', 'try']):
+            conn.execute('insert into jobs values '
+                         '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (None, '2016-01-01T00:00:0%d' % i, None,
+                          'https://example.com/%s/fennec.apk' % tree,
+                          None, None, tree, None, None, 0, 0, 'device'))
+        conn.commit()
+        conn.close()
+
+        j = jobs.Jobs(None, default_device='device')
+        self.assertEqual(self.get_version(), jobs.SCHEMA_VERSION)
+        self.assertEqual(j.jobs_pending(), 2)
+        j.new_job('https://example.com/mozilla-central/fennec2.apk',
+                  tests=[])
+        self.assertEqual(j.jobs_pending(), 3)
+        # Try builds are run first.
+        job = j.get_next_job(worker=Worker())
+        self.assertEqual(job['tree'], 'try')
+        job = j.get_next_job(lifo=True, worker=Worker())
+        self.assertEqual(job['build_url'],
+                         'https://example.com/try/fennec.apk')
+
+
+class JobsTest(unittest.TestCase):
+
+    build_url = 'https://example.com/mozilla-central/fennec.apk'
+    try_build_url = 'https://example.com/try/fennec.apk'
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        self.jobs = jobs.Jobs(None, default_device='device')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def query(self, sql, values=()):
+        conn = sqlite3.connect('jobs.sqlite')
+        rows = conn.execute(sql, values).fetchall()
+        conn.close()
+        return rows
+
+    def set_created(self, build_url, created):
+        conn = sqlite3.connect('jobs.sqlite')
+        conn.execute('update jobs set created=? where build_url=?',
+                     (created, build_url))
+        conn.commit()
+        conn.close()
+
+    def test_get_next_job_purges_expired_jobs(self):
+        self.jobs.new_job(self.build_url, tests=[FakeTest('a')])
+        self.jobs.new_job(self.try_build_url, tests=[FakeTest('b')])
+        job_id = self.query('select id from jobs where build_url=?',
+                            (self.try_build_url,))[0][0]
+        self.jobs.set_job_attempts(job_id, jobs.Jobs.MAX_ATTEMPTS)
+        job = self.jobs.get_next_job(worker=Worker())
+        self.assertEqual(job['build_url'], self.build_url)
+        self.assertEqual(self.query('select count(id) from jobs'), [(1,)])
+        self.assertEqual(self.query('select name from tests'), [('a',)])
+
+    def test_get_next_job_order(self):
+        build_urls = [self.build_url,
+                      'https://example.com/mozilla-central/fennec2.apk',
+                      self.try_build_url]
+        for i, build_url in enumerate(build_urls):
+            self.jobs.new_job(build_url, tests=[])
+            self.set_created(build_url, '2016-01-01T00:00:0%d' % i)
+        # Try builds come first in both orders.
+        job = self.jobs.get_next_job(worker=Worker())
+        self.assertEqual(job['build_url'], self.try_build_url)
+        job = self.jobs.get_next_job(lifo=True, worker=Worker())
+        self.assertEqual(job['build_url'], self.try_build_url)
+        self.jobs.job_completed(job['id'])
+        job = self.jobs.get_next_job(lifo=True, worker=Worker())
+        self.assertEqual(job['build_url'], build_urls[1])
+        job = self.jobs.get_next_job(worker=Worker())
+        self.assertEqual(job['build_url'], build_urls[0])
+
+    def test_get_next_job_increments_attempts(self):
+        self.jobs.new_job(self.build_url, tests=[])
+        for attempts in range(1, jobs.Jobs.MAX_ATTEMPTS + 1):
+            job = self.jobs.get_next_job(worker=Worker())
+            self.assertEqual(job['attempts'], attempts)
+            self.assertNotEqual(job['last_attempt'], None)
+            self.assertEqual(self.query('select attempts from jobs'),
+                             [(attempts,)])
+        self.assertEqual(self.jobs.get_next_job(worker=Worker()), None)
+        self.assertEqual(self.jobs.jobs_pending(), 0)
+
+    def test_get_next_job_matches_tests(self):
+        queued = [FakeTest('a', 'a.ini', 1, ['repo1', 'repo2']),
+                  FakeTest('a', 'a.ini', 2, ['repo1', 'repo2']),
+                  FakeTest('b', 'b.ini', 1)]
+        self.jobs.new_job(self.build_url, tests=queued)
+        worker = Worker()
+        worker.tests = [FakeTest('b', 'b.ini', 1),
+                        FakeTest('a', 'a.ini', 2, ['repo1', 'repo2']),
+                        FakeTest('a', 'a.ini', 1, ['repo1']),
+                        FakeTest('c', 'c.ini', 1)]
+        job = self.jobs.get_next_job(worker=worker)
+        # The tests are returned in the order in which they were queued.
+        self.assertEqual(job['tests'], [worker.tests[1], worker.tests[0]])
+        self.assertEqual(worker.tests[1].job_guid, queued[1].job_guid)
+        self.assertEqual(worker.tests[0].job_guid, queued[2].job_guid)
+        self.assertEqual(worker.tests[2].job_guid, None)
+
+    def test_get_next_job_concurrent_claims(self):
+        for i in range(20):
+            self.jobs.new_job('%s?%d' % (self.build_url, i), tests=[])
+        claims = []
+        claims_lock = threading.Lock()
+
+        def claim():
+            # Each thread uses its own connection.
+            while True:
+                job = self.jobs.get_next_job(worker=Worker())
+                if not job:
+                    break
+                with claims_lock:
+                    claims.append((job['id'], job['attempts']))
+
+        threads = [threading.Thread(target=claim) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(claims), 20 * jobs.Jobs.MAX_ATTEMPTS)
+        self.assertEqual(len(set(claims)), len(claims))
+
+    def test_new_jobs_reuses_job(self):
+        self.jobs.new_job(self.build_url, tests=[FakeTest('a')])
+        new_tests = self.jobs.new_jobs(self.build_url,
+                                       {'device': [FakeTest('b')]})
+        self.assertEqual([test.name for test in new_tests['device']], ['b'])
+        self.assertEqual(self.jobs.jobs_pending(), 1)
+        self.assertEqual(self.query('select count(distinct jobid) from tests'),
+                         [(1,)])
+
+    def test_new_jobs_skips_queued_tests(self):
+        self.jobs.new_job(self.build_url,
+                          tests=[FakeTest('a', repos=['repo'])])
+        new_tests = self.jobs.new_jobs(
+            self.build_url,
+            {'device': [FakeTest('a', repos=['repo']),
+                        FakeTest('a', repos=['other']),
+                        FakeTest('a', chunk=2, repos=['repo'])]})
+        self.assertEqual([(test.chunk, test.repos)
+                          for test in new_tests['device']],
+                         [(1, ['other']), (2, ['repo'])])
+        self.assertEqual(self.query('select count(id) from tests'), [(3,)])
+
+    def test_new_jobs_removes_duplicates(self):
+        tests = [FakeTest('a'), FakeTest('a'), FakeTest('b')]
+        new_tests = self.jobs.new_jobs(self.build_url, {'device': tests})
+        self.assertEqual(new_tests['device'], [tests[0], tests[2]])
+        self.assertEqual(tests[1].job_guid, None)
+        self.assertEqual(self.query('select count(id) from tests'), [(2,)])
+
+    def test_new_jobs_allow_duplicates(self):
+        self.jobs.allow_duplicates = True
+        self.jobs.new_job(self.build_url, tests=[FakeTest('a')])
+        tests = [FakeTest('a'), FakeTest('a')]
+        new_tests = self.jobs.new_jobs(self.build_url, {'device': tests})
+        self.assertEqual(new_tests['device'], tests)
+        self.assertEqual(self.jobs.jobs_pending(), 2)
+        self.assertEqual(self.query('select count(id) from tests'), [(3,)])
+
+    def test_new_jobs_enable_unittests(self):
+        self.jobs.new_jobs(self.build_url,
+                           {'unittests': [FakeTest('a'),
+                                          FakeTest('b',
+                                                   enable_unittests=True)],
+                            'other': [FakeTest('a')],
+                            'empty': []})
+        self.jobs.new_jobs(self.try_build_url,
+                           {'unittests': [FakeTest('a')]},
+                           enable_unittests=True)
+        self.assertEqual(
+            sorted(self.query('select device, build_url, enable_unittests '
+                              'from jobs')),
+            [('empty', self.build_url, 0),
+             ('other', self.build_url, 0),
+             ('unittests', self.build_url, 1),
+             ('unittests', self.try_build_url, 1)])
+
+    def test_new_jobs_maps_jobs_to_devices(self):
+        self.jobs.new_jobs(self.try_build_url,
+                           {'device1': [FakeTest('a')],
+                            'device2': [FakeTest('a')]})
+        self.jobs.new_job(self.build_url, tests=[FakeTest('a')],
+                          device='device2')
+        device_tests = dict((device, [FakeTest(device)])
+                            for device in ['device1', 'device2', 'device3'])
+        self.jobs.new_jobs(self.build_url, device_tests)
+        rows = self.query('select jobs.device, tests.name from tests, jobs '
+                          'where tests.jobid=jobs.id and jobs.build_url=?',
+                          (self.build_url,))
+        self.assertEqual(sorted(rows),
+                         [('device1', 'device1'),
+                          ('device2', 'a'),
+                          ('device2', 'device2'),
+                          ('device3', 'device3')])
+        self.assertEqual(self.query('select count(id) from jobs'), [(5,)])
+
+    def test_notifier_skips_idle_device(self):
+        notifier = jobs.JobNotifier()
+        queue = Queue.Queue()
+        notifier.add_device('device', queue)
+        self.jobs.notifier = notifier
+        self.assertEqual(self.jobs.get_next_job(worker=Worker()), None)
+        statements = self.jobs.sql_stats['statements']
+        # The device is idle until its version changes.
+        self.assertEqual(self.jobs.get_next_job(worker=Worker()), None)
+        self.assertEqual(self.jobs.sql_stats['statements'], statements)
+
+        self.jobs.new_job(self.build_url, tests=[])
+        self.assertEqual(queue.get_nowait(), ('job', None))
+        job = self.jobs.get_next_job(worker=Worker())
+        self.assertEqual(job['build_url'], self.build_url)
+        self.jobs.job_completed(job['id'])
+        self.assertEqual(self.jobs.get_next_job(worker=Worker()), None)
+
+        self.jobs.new_jobs(self.try_build_url, {'device': []})
+        self.assertEqual(queue.get_nowait(), ('job', None))
+        job = self.jobs.get_next_job(worker=Worker())
+        self.assertEqual(job['build_url'], self.try_build_url)
@@ -0,0 +1,88 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Micro-benchmark of parsing the timestamps of logcat lines.
+
+Compares the strptime based parsing previously used by Logcat.get()
+and the analyze_logcat methods with logcattime.LogcatTimeParser over
+a synthetic logcat dump.
+
+usage: python selftest/logcatbench.py [--lines N] [--iterations N]
+"""
+
+import datetime
+import optparse
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from logcattime import LogcatTimeParser
+
+
+def generate_lines(count):
+    start = datetime.datetime(2016, 12, 31, 23, 0)
+    lines = []
+    for i in range(count):
+        t = start + datetime.timedelta(milliseconds=37 * i)
+        lines.append(u'%02d-%02d %02d:%02d:%02d.%03d I/GeckoDump( 2284): '
+                     u'line %d' % (t.month, t.day, t.hour, t.minute,
+                                   t.second, t.microsecond / 1000, i))
+    return lines
+
+
+def parse_strptime(lines):
+    curr_year = datetime.datetime.now().year
+    for line in lines:
+        try:
+            datetime.datetime.strptime('%4d-%s' % (curr_year, line[:18]),
+                                       '%Y-%m-%d %H:%M:%S.%f')
+        except ValueError:
+            pass
+
+
+def parse_logcattime(lines):
+    parse = LogcatTimeParser().parse
+    for line in lines:
+        parse(line)
+
+
+def measure(func, lines, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        func(lines)
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings
+
+
+def report(name, timings, count):
+    print '%-24s median %8.2f ms  %7.3f us/line' % (
+        name,
+        1000 * timings[len(timings) / 2],
+        1000000 * timings[len(timings) / 2] / count)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--lines', type='int', default=10000,
+                      help='number of logcat lines [default: %default]')
+    parser.add_option('--iterations', type='int', default=10,
+                      help='number of passes over the lines per parser '
+                      '[default: %default]')
+    options, args = parser.parse_args()
+
+    lines = generate_lines(options.lines)
+    report('strptime', measure(parse_strptime, lines, options.iterations),
+           options.lines)
+    report('LogcatTimeParser', measure(parse_logcattime, lines,
+                                       options.iterations),
+           options.lines)
+
+
+if __name__ == '__main__':
+    main()
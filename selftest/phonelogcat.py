@@ -0,0 +1,185 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import calendar
+import datetime
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from logcatstore import LogcatStore
+from logcattime import LogcatTimeParser, parse_logcat_time
+from phonetest import LogcatEvents
+
+
+class LogcatStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir)
+
+    def test_spill(self):
+        store = LogcatStore(max_lines=10, spill_dir=self.spill_dir)
+        lines = [u'01-01 00:00:%02d.000 I/Test( 1): line %d \xe9' % (i, i)
+                 for i in range(45)]
+        for i in range(0, len(lines), 7):
+            store.extend(lines[i:i + 7])
+        self.assertEqual(len(store), 45)
+        self.assertTrue(len(store._tail) <= 10)
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+        self.assertEqual(list(store), lines)
+
+        path = os.path.join(self.spill_dir, 'logcat.txt')
+        with open(path, 'w') as f:
+            store.write(f)
+        with open(path) as f:
+            self.assertEqual(f.read(), ''.join(
+                ['%s\n' % line.encode('UTF-8') for line in lines]))
+        os.unlink(path)
+
+        store.close()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(list(store), [])
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_boundary(self):
+        store = LogcatStore()
+        self.assertEqual(store.boundary, None)
+        store.extend([u'01-01 00:00:00.000 a', u'01-01 00:00:01.000 b',
+                      u'01-01 00:00:01.000 c'])
+        self.assertEqual(store.boundary, u'01-01 00:00:01.000')
+        self.assertEqual(store.boundary_lines,
+                         set([u'01-01 00:00:01.000 b',
+                              u'01-01 00:00:01.000 c']))
+        store.extend([u'01-01 00:00:02.000 d'])
+        self.assertEqual(store.boundary_lines,
+                         set([u'01-01 00:00:02.000 d']))
+
+
+class LogcatTimeTest(unittest.TestCase):
+
+    def test_parse(self):
+        for datestr in ('01-01 00:00:00.000', '02-29 12:34:56.789',
+                        '12-31 23:59:59.999'):
+            expected = datetime.datetime.strptime('2016-' + datestr,
+                                                  '%Y-%m-%d %H:%M:%S.%f')
+            expected = (calendar.timegm(expected.timetuple()) * 1000 +
+                        expected.microsecond / 1000)
+            self.assertEqual(parse_logcat_time(datestr + ' I/Test( 1): x',
+                                               2016), expected)
+        for line in ('', 'beginning of main', '02-30 00:00:00.000',
+                     '13-01 00:00:00.000', '01-01 24:00:00.000',
+                     '01-01 00:00:00,000', 'xx-01 00:00:00.000'):
+            self.assertEqual(parse_logcat_time(line, 2016), None)
+        self.assertEqual(parse_logcat_time('02-29 00:00:00.000', 2015), None)
+
+    def test_year_rollover(self):
+        old_year = '12-31 23:59:59.999'
+        new_year = '01-01 00:00:00.000'
+        for now in (datetime.datetime(2015, 12, 31, 23, 0),
+                    datetime.datetime(2016, 1, 1, 1, 0)):
+            parser = LogcatTimeParser(now)
+            self.assertEqual(parser.parse(new_year) - parser.parse(old_year),
+                             1)
+            # Lines within the same second as the previous line.
+            self.assertEqual(parser.parse(new_year[:15] + '250') -
+                             parser.parse(new_year), 250)
+            self.assertEqual(parser.parse(new_year[:15] + 'abc'), None)
+
+
+
+class FakeLogcat(object):
+    """Returns each of the given batches of lines from successive calls
+    to get()."""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.waits = 0
+
+    def get(self):
+        if self.batches:
+            return self.batches.pop(0)
+        return []
+
+    def wait(self, timeout):
+        self.waits += 1
+        time.sleep(min(timeout, 0.01))
+
+
+class LogcatEventsTest(unittest.TestCase):
+
+    def create_events(self, batches):
+        events = LogcatEvents(FakeLogcat(batches), logging.getLogger())
+        events.add_event('start', r'.*START ([0-9]+) (\w+)')
+        events.add_event('stop', r'.*STOP')
+        events.add_event('report', r'.*__start_report([0-9\.]+)__end_report')
+        return events
+
+    def test_process(self):
+        events = self.create_events([])
+        lines = ['I/Test( 1): START 1 a',
+                 'I/Test( 1): nothing',
+                 'I/Test( 1): START 2 b STOP',
+                 'I/Test( 1): __start_report1.5__end_report']
+        events.process(lines)
+        self.assertEqual(events.matches,
+                         [(lines[0], {'start': ('1', 'a')}),
+                          (lines[2], {'start': ('2', 'b'), 'stop': ()}),
+                          (lines[3], {'report': ('1.5',)})])
+        self.assertTrue(events.seen('stop'))
+        events.reset()
+        self.assertEqual(events.matches, [])
+        self.assertFalse(events.seen('stop'))
+
+    def test_first_only(self):
+        events = self.create_events([])
+        events.add_event('base_time', r'(\d{2}:\d{2})', first_only=True)
+        events.process(['00:01 START 1 a', '00:02 nothing', '00:03 STOP'])
+        self.assertEqual(events.matches,
+                         [('00:01 START 1 a', {'start': ('1', 'a'),
+                                               'base_time': ('00:01',)}),
+                          ('00:03 STOP', {'stop': ()})])
+        events.reset()
+        events.process(['00:04 nothing', '00:05 nothing'])
+        self.assertEqual(events.matches,
+                         [('00:04 nothing', {'base_time': ('00:04',)})])
+
+    def test_max_matches(self):
+        events = self.create_events([])
+        events.MAX_MATCHES = 3
+        events.process(['STOP'] * 5)
+        self.assertEqual(len(events.matches), 3)
+        self.assertTrue(events.seen('stop'))
+
+    def test_wait_for_events(self):
+        events = self.create_events([['START 1 a'], [], ['nothing'],
+                                     ['STOP', 'STOP'], ['START 2 b']])
+        self.assertTrue(events.wait_for_events(['start', 'stop'], 10))
+        # The wait returns as soon as every event has been seen.
+        self.assertEqual(events.logcat.batches, [['START 2 b']])
+        self.assertEqual(events.logcat.waits, 3)
+        self.assertEqual([matches for line, matches in events.matches],
+                         [{'start': ('1', 'a')}, {'stop': ()}, {'stop': ()}])
+
+    def test_wait_for_events_timeout(self):
+        events = self.create_events([['START 1 a']])
+        start = time.time()
+        self.assertFalse(events.wait_for_events(['start', 'report'], 0.2))
+        self.assertTrue(time.time() - start >= 0.2)
+        self.assertFalse(events.seen('report'))
+        self.assertEqual(len(events.matches), 1)
+
+        events = self.create_events([['STOP']])
+        self.assertFalse(events.wait_for_events(['stop', 'report'], 10,
+                                                abort=lambda: True,
+                                                abort_interval=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
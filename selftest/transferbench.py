@@ -0,0 +1,136 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Benchmark of pushing and pulling a directory of small files with
+adb's per file sync and as a tar or compressed tar archive.
+
+The device is emulated by the fake adb server in
+selftest/fakeadbserver.py which stores the device's files beneath a
+temporary directory and runs tar on the host, so no device is
+required. The numbers therefore measure the per file cost of the sync
+protocol and the cost of creating and extracting the archives, but
+not the bandwidth or latency of USB.
+
+usage: python selftest/transferbench.py [--files N] [--size BYTES]
+                                        [--iterations N]
+"""
+
+import optparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+from adb_android import ADBAndroid
+from adb_transport import ADBServerTransport
+from fakeadbserver import FakeADBServer
+
+SERIAL = 'FAKE0001'
+
+
+def create_files(path, count, size):
+    for i in range(count):
+        dirname = os.path.join(path, 'dir%d' % (i % 20))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(os.path.join(dirname, 'file%d' % i), 'wb') as f:
+            f.write(('%d ' % i) * (size / 4 + 1))
+
+
+def create_device(device_root):
+    def run(cmd):
+        # Run the command on the host beneath the device root.
+        cmd = re.sub(r' /(?!dev/null)', ' %s/' % device_root, cmd)
+        proc = subprocess.Popen(['/bin/sh', '-c', cmd],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        return proc.communicate()[0], proc.returncode
+
+    os.makedirs(os.path.join(device_root, 'proc'))
+    with open(os.path.join(device_root, 'proc', 'version'), 'w') as f:
+        f.write('Linux version 3.4.0\n')
+    os.makedirs(os.path.join(device_root, 'data', 'local', 'tests'))
+
+    server = FakeADBServer()
+    device = server.add_device(SERIAL, device_root)
+    device.script(r'^id$', 'uid=0(root) gid=0(root)')
+    device.script(r'^su ', '', 1)
+    device.script(r'^/system/bin/ls /$', 'system')
+    device.script(r'^/system/bin/ls -1A /$', 'system')
+    device.script(r'^type cp$', 'cp is /system/bin/cp')
+    device.script(r'^chmod --help$', 'usage: chmod [-R] MODE FILE')
+    device.script(r'^getprop', '[ro.build.version.sdk]: [19]')
+    device.script(r'^(tar|toybox|busybox|mkdir|ls|rm) ', run)
+    server.start()
+    adbdevice = ADBAndroid(device=SERIAL, adb='true', timeout=300,
+                           transport=ADBServerTransport(adb_port=server.port))
+    adbdevice._test_root = '/data/local/tests'
+    return server, adbdevice
+
+
+def measure(func, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        func(i)
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings
+
+
+def report(name, timings):
+    print '%-16s median %8.2f ms  min %8.2f ms' % (
+        name, 1000 * timings[len(timings) / 2], 1000 * timings[0])
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--files', type='int', default=200,
+                      help='number of files in the directory '
+                      '[default: %default]')
+    parser.add_option('--size', type='int', default=1024,
+                      help='size of each file in bytes [default: %default]')
+    parser.add_option('--iterations', type='int', default=3,
+                      help='number of transfers per mode [default: %default]')
+    options, args = parser.parse_args()
+
+    local_dir = tempfile.mkdtemp()
+    device_root = tempfile.mkdtemp()
+    server = None
+    try:
+        source_dir = os.path.join(local_dir, 'source')
+        create_files(source_dir, options.files, options.size)
+        server, adbdevice = create_device(device_root)
+        print '%d files of %d bytes, tar: %s, gzip: %s' % (
+            options.files, options.size, adbdevice._tar, adbdevice._tar_z)
+
+        for name, archive in (('sync', False), ('tar', 'tar'),
+                              ('tgz', 'tgz')):
+            def push(i):
+                adbdevice.push(source_dir, '/sdcard/%s-%d' % (name, i),
+                               archive=archive)
+
+            def pull(i):
+                adbdevice.pull('/sdcard/%s-%d' % (name, i),
+                               os.path.join(local_dir, '%s-%d' % (name, i)),
+                               archive=archive)
+
+            report('push %s' % name, measure(push, options.iterations))
+            report('pull %s' % name, measure(pull, options.iterations))
+    finally:
+        if server:
+            server.stop()
+        shutil.rmtree(local_dir)
+        shutil.rmtree(device_root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import multiprocessing
+import os
+import time
+import unittest
+
+from transferscheduler import TransferScheduler
+
+
+def run_transfer(scheduler, name, priority, duration, log, log_lock):
+    with scheduler.transfer(priority):
+        with log_lock:
+            log.put(('start', name, time.time()))
+        time.sleep(duration)
+        with log_lock:
+            log.put(('stop', name, time.time()))
+
+
+def hold_transfer(scheduler):
+    # Exit without releasing the slot.
+    scheduler.acquire()
+    os._exit(0)
+
+
+class TransferSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log = multiprocessing.Queue()
+        self.log_lock = multiprocessing.Lock()
+
+    def get_events(self, count):
+        events = [self.log.get(timeout=30) for i in range(count)]
+        events.sort(key=lambda event: event[2])
+        return events
+
+    def start(self, scheduler, name, priority, duration):
+        process = multiprocessing.Process(
+            target=run_transfer,
+            args=(scheduler, name, priority, duration, self.log,
+                  self.log_lock))
+        process.start()
+        return process
+
+    def test_limit(self):
+        scheduler = TransferScheduler(2)
+        processes = [self.start(scheduler, i, 0, 0.2) for i in range(6)]
+        events = self.get_events(12)
+        for process in processes:
+            process.join()
+        active = 0
+        for event, name, when in events:
+            active += 1 if event == 'start' else -1
+            self.assertTrue(active <= 2)
+        stats = scheduler.stats()
+        self.assertEqual(stats['transfers'], 6)
+        self.assertEqual(stats['active'], 0)
+        self.assertEqual(stats['waiting'], 0)
+        self.assertTrue(stats['max_delay'] > 0)
+
+    def test_priority(self):
+        scheduler = TransferScheduler(1)
+        # Hold the only slot while the other transfers queue up.
+        ticket, delay = scheduler.acquire()
+        # Start each transfer only once the previous one is waiting so
+        # that the order in which they take their tickets is known.
+        processes = []
+        for name, priority in (('low-1', 0), ('low-2', 0), ('high', 1)):
+            processes.append(self.start(scheduler, name, priority, 0))
+            while scheduler.stats()['waiting'] < len(processes):
+                time.sleep(0.05)
+        scheduler.release(ticket)
+        events = self.get_events(6)
+        for process in processes:
+            process.join()
+        self.assertEqual([name for event, name, when in events
+                          if event == 'start'],
+                         ['high', 'low-1', 'low-2'])
+
+    def test_reap(self):
+        scheduler = TransferScheduler(1)
+        scheduler.REAP_INTERVAL = 0.1
+        process = multiprocessing.Process(target=hold_transfer,
+                                          args=(scheduler,))
+        process.start()
+        process.join()
+        self.assertEqual(scheduler.stats()['active'], 1)
+        with scheduler.transfer():
+            self.assertEqual(scheduler.stats()['active'], 1)
+        self.assertEqual(scheduler.stats()['active'], 0)
@@ -54,6 +54,8 @@ class PerfherderSuite(dict):
 
 
 class PerfTest(PhoneTest):
+    perf_test = True
+
     def __init__(self, dm=None, phone=None, options=None,
                  config_file=None, chunk=1, repos=None):
         if repos is None:
@@ -5,11 +5,9 @@
 import ConfigParser
 import logging
 import os
-import re
-from time import sleep
 
 from perftest import PerfTest, PerfherderArtifact, PerfherderSuite
-from phonetest import PhoneTestResult
+from phonetest import LogcatEvents, PhoneTestResult
 from utils import geometric_mean, host
 
 logger = logging.getLogger()
@@ -240,29 +238,20 @@ class RoboTest(PerfTest):
         """
         self.loggerdeco.debug('analyzing logcat')
 
-        re_data = re.compile('.*__start_report([0-9\.]+)__end_report.*')
+        events = LogcatEvents(self.logcat, self.loggerdeco)
+        events.add_event('report', '.*__start_report([0-9\.]+)__end_report.*')
 
-        attempt = 1
         max_time = 90  # maximum time to wait for completeness score
-        wait_time = 3  # time to wait between attempts
-        max_attempts = max_time / wait_time
 
         results = None
-        while attempt <= max_attempts and results is None:
-            buf = self.logcat.get()
-            for line in buf:
-                match = re_data.match(line)
-                if match:
-                    numbers = match.group(1)
-                    if numbers:
-                        results = float(numbers)
-
-            if self.fennec_crashed:
-                # If fennec crashed, don't bother looking for pageload metric
-                break
-            if results is None:
-                sleep(wait_time)
-                attempt += 1
+        # If fennec crashed, don't bother looking for pageload metric
+        events.wait_for_events(['report'], max_time,
+                               abort=lambda: self.fennec_crashed)
+        for line, matches in events.matches:
+            if 'report' in matches:
+                numbers = matches['report'][0]
+                if numbers:
+                    results = float(numbers)
 
         if results is None:
             self.loggerdeco.info('Unable to find pageload metric')
@@ -3,18 +3,15 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import ConfigParser
-import datetime
 import logging
 import os
-import re
 import urlparse
 
-from time import sleep
-
 import utils
 
+from logcattime import LogcatTimeParser
 from perftest import PerfTest
-from phonetest import PhoneTestResult
+from phonetest import LogcatEvents, PhoneTestResult
 
 # Set the logger globally in the file, but this must be reset when
 # used in a child process.
@@ -278,17 +275,19 @@ class S1S2Test(PerfTest):
 
         logcat_prefix = '(\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3})'
         throbber_prefix = '..GeckoToolbarDisplayLayout.*zerdatime (\d+) - Throbber'
-        re_base_time = re.compile('%s' % logcat_prefix)
-        re_gecko_time = re.compile('%s .*([Gg]ecko)' % logcat_prefix)
-        re_start_time = re.compile(
+        events = LogcatEvents(self.logcat, self.loggerdeco)
+        events.add_event('base_time', logcat_prefix, first_only=True)
+        events.add_event('gecko_time', '%s .*([Gg]ecko)' % logcat_prefix)
+        events.add_event(
+            'start_time',
             '%s .*('
             'Start proc .*%s.* for activity %s|'
             'Fennec application start)' % (
                 logcat_prefix, self.build.app_name, self.build.app_name))
-        re_throbber_start_time = re.compile('%s %s start' %
-                                            (logcat_prefix, throbber_prefix))
-        re_throbber_stop_time = re.compile('%s %s stop' %
-                                           (logcat_prefix, throbber_prefix))
+        events.add_event('throbber_start_time', '%s %s start' %
+                         (logcat_prefix, throbber_prefix))
+        events.add_event('throbber_stop_time', '%s %s stop' %
+                         (logcat_prefix, throbber_prefix))
 
         base_time = 0
         start_time = 0
@@ -297,146 +296,101 @@ class S1S2Test(PerfTest):
         start_time_reason = ''
         fennec_start = 'Fennec application start'
 
-        attempt = 1
         max_time = 90 # maximum time to wait for throbbers
-        wait_time = 3 # time to wait between attempts
-        max_attempts = max_time / wait_time
-
-        while (attempt <= max_attempts and (throbber_start_time == 0 or
-                                            throbber_stop_time == 0)):
-            buf = self.logcat.get()
-            for line in buf:
-                self.loggerdeco.debug('analyze_logcat: %s' % line)
-                match = re_base_time.match(line)
-                if match and not base_time:
-                    base_time = match.group(1)
-                    self.loggerdeco.info('analyze_logcat: base_time: %s' %
-                                         base_time)
-                # We want the Fennec application start message, or the
-                # Start proc message or the first gecko related
-                # message in order to determine the start_time which
-                # will be used to convert the absolute time values
-                # into values relative to the start of fennec.  See
-                # https://bugzilla.mozilla.org/show_bug.cgi?id=1214810
-                if not start_time:
-                    match = re_gecko_time.match(line)
-                    if match:
-                        start_time = match.group(1)
-                        start_time_reason = match.group(2)
-                        self.loggerdeco.info(
-                            'analyze_logcat: new start_time: %s %s' %
-                            (start_time, start_time_reason))
-                match = re_start_time.match(line)
-                if match:
-                    group1 = match.group(1)
-                    group2 = match.group(2)
-                    if not start_time:
-                        start_time = group1
-                        start_time_reason = group2
-                        self.loggerdeco.info(
-                            'analyze_logcat: new start_time: %s %s' %
-                            (start_time, start_time_reason))
-                    elif (fennec_start in group2 and
-                          fennec_start not in start_time_reason):
-                        # Only use the first if there are multiple
-                        # fennec_start messages.
-                        start_time = group1
-                        start_time_reason = group2
-                        self.loggerdeco.info(
-                            'analyze_logcat: updated start_time: %s %s' %
-                            (start_time, start_time_reason))
-                    elif (fennec_start not in start_time_reason and
-                          group2.startswith('Start proc')):
-                        start_time = group1
-                        start_time_reason = group2
-                        self.loggerdeco.info(
-                            'analyze_logcat: updated start_time: %s %s' %
-                            (start_time, start_time_reason))
-                    else:
-                        self.loggerdeco.info(
-                            'analyze_logcat: ignoring start_time: %s %s' %
-                            (group1, group2))
-                    continue
-                # We want the first throbberstart and throbberstop
-                # after the start_time.
-                match = re_throbber_start_time.match(line)
-                if match:
-                    if throbber_start_time:
-                        self.loggerdeco.warning(
-                            'analyze_logcat: throbber_start_time: %s '
-                            'missing throbber_stop. Resetting '
-                            'throbber_start_time.' % throbber_start_time)
-                    throbber_start_time = match.group(1)
-                    self.loggerdeco.info(
-                        'analyze_logcat: throbber_start_time: %s' %
-                        throbber_start_time)
-                    continue
-                match = re_throbber_stop_time.match(line)
-                if match and not throbber_stop_time:
-                    throbber_stop_time = match.group(1)
-                    self.loggerdeco.info(
-                        'analyze_logcat: throbber_stop_time: %s' %
-                        throbber_stop_time)
-                    continue
-                if start_time and throbber_start_time and throbber_stop_time:
-                    break
+
+        if not events.wait_for_events(
+                ['throbber_start_time', 'throbber_stop_time'], max_time,
+                abort=lambda: self.fennec_crashed):
             if self.fennec_crashed:
                 # If fennec crashed, don't bother looking for the Throbbers
                 self.loggerdeco.warning('analyze_logcat: fennec crashed.')
+
+        for line, matches in events.matches:
+            if 'base_time' in matches and not base_time:
+                base_time = matches['base_time'][0]
+                self.loggerdeco.info('analyze_logcat: base_time: %s' %
+                                     base_time)
+            # We want the Fennec application start message, or the
+            # Start proc message or the first gecko related
+            # message in order to determine the start_time which
+            # will be used to convert the absolute time values
+            # into values relative to the start of fennec.  See
+            # https://bugzilla.mozilla.org/show_bug.cgi?id=1214810
+            if not start_time and 'gecko_time' in matches:
+                start_time, start_time_reason = matches['gecko_time']
+                self.loggerdeco.info(
+                    'analyze_logcat: new start_time: %s %s' %
+                    (start_time, start_time_reason))
+            if 'start_time' in matches:
+                group1, group2 = matches['start_time']
+                if not start_time:
+                    start_time = group1
+                    start_time_reason = group2
+                    self.loggerdeco.info(
+                        'analyze_logcat: new start_time: %s %s' %
+                        (start_time, start_time_reason))
+                elif (fennec_start in group2 and
+                      fennec_start not in start_time_reason):
+                    # Only use the first if there are multiple
+                    # fennec_start messages.
+                    start_time = group1
+                    start_time_reason = group2
+                    self.loggerdeco.info(
+                        'analyze_logcat: updated start_time: %s %s' %
+                        (start_time, start_time_reason))
+                elif (fennec_start not in start_time_reason and
+                      group2.startswith('Start proc')):
+                    start_time = group1
+                    start_time_reason = group2
+                    self.loggerdeco.info(
+                        'analyze_logcat: updated start_time: %s %s' %
+                        (start_time, start_time_reason))
+                else:
+                    self.loggerdeco.info(
+                        'analyze_logcat: ignoring start_time: %s %s' %
+                        (group1, group2))
+                continue
+            # We want the first throbberstart and throbberstop
+            # after the start_time.
+            if 'throbber_start_time' in matches:
+                if throbber_start_time:
+                    self.loggerdeco.warning(
+                        'analyze_logcat: throbber_start_time: %s '
+                        'missing throbber_stop. Resetting '
+                        'throbber_start_time.' % throbber_start_time)
+                throbber_start_time = matches['throbber_start_time'][0]
+                self.loggerdeco.info(
+                    'analyze_logcat: throbber_start_time: %s' %
+                    throbber_start_time)
+                continue
+            if 'throbber_stop_time' in matches and not throbber_stop_time:
+                throbber_stop_time = matches['throbber_stop_time'][0]
+                self.loggerdeco.info(
+                    'analyze_logcat: throbber_stop_time: %s' %
+                    throbber_stop_time)
+                continue
+            if start_time and throbber_start_time and throbber_stop_time:
                 break
-            if (start_time == 0 or
-                throbber_start_time == 0 or
-                throbber_stop_time == 0):
-                sleep(wait_time)
-                attempt += 1
         if throbber_start_time and throbber_stop_time == 0:
             self.loggerdeco.warning('Unable to find Throbber stop')
 
         # The captured time from the logcat lines is in the format
         # MM-DD HH:MM:SS.mmm. It is possible for the year to change
-        # between the different times, so we need to make adjustments
-        # if necessary. First, we assume the year does not change and
-        # parse the dates as if they are in the current year. If
-        # the dates violate the natural order start_time,
-        # throbber_start_time, throbber_stop_time, we can adjust the
-        # year.
+        # between the different times. LogcatTimeParser assigns each
+        # time the year which places it closest to the current time
+        # so that the times remain in order across a new year.
 
         if base_time and start_time and throbber_start_time and throbber_stop_time:
-            parse = lambda y, t: datetime.datetime.strptime('%4d-%s' % (y, t), '%Y-%m-%d %H:%M:%S.%f')
-            year = datetime.datetime.now().year
-            base_time = parse(year, base_time)
-            start_time = parse(year, start_time)
-            throbber_start_time = parse(year, throbber_start_time)
-            throbber_stop_time = parse(year, throbber_stop_time)
-
-            self.loggerdeco.debug('analyze_logcat: before year adjustment '
-                                  'base: %s, start: %s, '
-                                  'throbber start: %s' %
-                                  (base_time, start_time,
-                                   throbber_start_time))
-
-            if base_time > start_time:
-                base_time.replace(year=year-1)
-            elif start_time > throbber_start_time:
-                base_time.replace(year=year-1)
-                start_time.replace(year=year-1)
-            elif throbber_start_time > throbber_stop_time:
-                base_time.replace(year=year-1)
-                start_time.replace(year=year-1)
-                throbber_start_time.replace(year-1)
-
-            self.loggerdeco.debug('analyze_logcat: after year adjustment '
-                                  'base: %s, start: %s, '
-                                  'throbber start: %s' %
-                                  (base_time, start_time,
-                                   throbber_start_time))
+            parse = LogcatTimeParser().parse
+            base_time = parse(base_time)
+            start_time = parse(start_time)
+            throbber_start_time = parse(throbber_start_time)
+            throbber_stop_time = parse(throbber_stop_time)
 
             # Convert the times to milliseconds from the base time.
-            convert = lambda t1, t2: round((t2 - t1).total_seconds() * 1000.0)
-
-            start_time = convert(base_time, start_time)
-            throbber_start_time = convert(base_time, throbber_start_time)
-            throbber_stop_time = convert(base_time, throbber_stop_time)
+            start_time = start_time - base_time
+            throbber_start_time = throbber_start_time - base_time
+            throbber_stop_time = throbber_stop_time - base_time
 
             self.loggerdeco.debug('analyze_logcat: base: %s, start: %s, '
                                   'throbber start: %s, throbber stop: %s, '
@@ -5,11 +5,9 @@
 import ConfigParser
 import logging
 import os
-import re
-from time import sleep
 
 from perftest import PerfTest, PerfherderArtifact, PerfherderSuite
-from phonetest import PhoneTestResult
+from phonetest import LogcatEvents, PhoneTestResult
 from utils import median, geometric_mean, host
 
 logger = logging.getLogger()
@@ -254,45 +252,35 @@ I/GeckoDump( 2284): __startTimestamp1433438438092__endTimestamp
         """
         self.loggerdeco.debug('analyzing logcat')
 
-        re_page_data = re.compile('.*\|[0-9];([a-zA-Z0-9\.\/\-]+);([0-9;]+).*')
-        re_end_report = re.compile('.*__end_tp_report.*')
+        events = LogcatEvents(self.logcat, self.loggerdeco)
+        events.add_event('page_data',
+                         '.*\|[0-9];([a-zA-Z0-9\.\/\-]+);([0-9;]+).*')
+        events.add_event('end_report', '.*__end_tp_report.*')
 
-        attempt = 1
         max_time = 180  # maximum time to wait for tp report
-        wait_time = 3  # time to wait between attempts
-        max_attempts = max_time / wait_time
 
         results = {}
         pageload_metric = {'summary': 0}
-        while attempt <= max_attempts and pageload_metric['summary'] == 0:
-            buf = self.logcat.get()
-            for line in buf:
-                self.loggerdeco.debug('analyze_logcat: %s' % line)
-                if re_end_report.match(line):
-                    # calculate score
-                    data = []
-                    for page in results:
-                        data.append(median(results[page]))
-                        # median of each page, ignoring the first run
-                        pageload_metric[page] = median(results[page][1:])
-                    pageload_metric['summary'] = geometric_mean(data)
-                    break
-
-                match = re_page_data.match(line)
-                if match:
-                    page_name = match.group(1)
-                    numbers = match.group(2)
-                    if page_name and numbers:
-                        page_name = page_name.split('/')[0]
-                        numbers = [float(x) for x in numbers.split(';')]
-                        results[page_name] = numbers
-
-            if self.fennec_crashed:
-                # If fennec crashed, don't bother looking for pageload metric
+        # If fennec crashed, don't bother looking for pageload metric
+        events.wait_for_events(['end_report'], max_time,
+                               abort=lambda: self.fennec_crashed)
+        for line, matches in events.matches:
+            if 'end_report' in matches:
+                # calculate score
+                data = []
+                for page in results:
+                    data.append(median(results[page]))
+                    # median of each page, ignoring the first run
+                    pageload_metric[page] = median(results[page][1:])
+                pageload_metric['summary'] = geometric_mean(data)
                 break
-            if pageload_metric['summary'] == 0:
-                sleep(wait_time)
-                attempt += 1
+
+            if 'page_data' in matches:
+                page_name, numbers = matches['page_data']
+                if page_name and numbers:
+                    page_name = page_name.split('/')[0]
+                    numbers = [float(x) for x in numbers.split(';')]
+                    results[page_name] = numbers
         if pageload_metric['summary'] == 0:
             self.loggerdeco.warning('Unable to find pageload metric')
 
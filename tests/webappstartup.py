@@ -3,7 +3,6 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import ConfigParser
-import datetime
 import os
 import re
 import sys
@@ -15,8 +14,9 @@ from mozprofile import FirefoxProfile
 import utils
 
 from adb import ADBError
+from logcattime import LogcatTimeParser
 from perftest import PerfTest
-from phonetest import PhoneTestResult
+from phonetest import LogcatEvents, PhoneTestResult
 
 class WebappStartupTest(PerfTest):
     def __init__(self, dm=None, phone=None, options=None,
@@ -409,20 +409,16 @@ class WebappStartupTest(PerfTest):
             datapoint['startup_time'] = startup_time
         return datapoint
 
-    def wait_for_fennec(self, max_wait_time=60, wait_time=5,
-                        kill_wait_time=20):
+    def wait_for_fennec(self, max_wait_time=60, kill_wait_time=20):
         # Wait for up to a max_wait_time seconds for fennec to close
-        # itself in response to the quitter request. Check that fennec
-        # is still running every wait_time seconds. If fennec doesn't
+        # itself in response to the quitter request. The wait runs on
+        # the device and returns as soon as fennec exits. If fennec doesn't
         # close on its own, attempt up to 3 times to kill fennec, waiting
         # kill_wait_time seconds between attempts.
         # Return True if fennec exits on its own, False if it needs to be killed.
         # Re-raise the last exception if fennec can not be killed.
-        max_wait_attempts = max_wait_time / wait_time
-        for wait_attempt in range(1, max_wait_attempts+1):
-            if not self.is_webapp_running():
-                return True
-            sleep(wait_time)
+        if self.wait_for_webapp_exit(max_wait_time):
+            return True
         self.loggerdeco.debug('wait_for_fennec: killing fennec')
         max_killattempts = 3
         for kill_attempt in range(1, max_killattempts+1):
@@ -468,15 +464,18 @@ class WebappStartupTest(PerfTest):
             self.get_webappstartup_name()
         return success
 
-    def is_webapp_running(self):
+    def wait_for_webapp_exit(self, max_wait_time):
+        process_names = [self.build.app_name,
+                         '%s:%s.Webapp0' % (self.build.app_name,
+                                            self.build.app_name)]
+        if self.webappstartup_name:
+            process_names.append(self.webappstartup_name)
         for attempt in range(1, self.options.phone_retry_limit+1):
             try:
-                return (self.dm.process_exist(self.build.app_name) or
-                        self.dm.process_exist(self.webappstartup_name) or
-                        self.dm.process_exist('%s:%s.Webapp0' % (
-                            self.build.app_name, self.build.app_name)))
+                return self.dm.wait_for_process_exit(
+                    process_names, max_wait_time=max_wait_time)
             except ADBError:
-                self.loggerdeco.exception('Attempt %d is fennec running' % attempt)
+                self.loggerdeco.exception('Attempt %d wait for fennec exit' % attempt)
                 if attempt == self.options.phone_retry_limit:
                     raise
                 sleep(self.options.phone_retry_wait)
@@ -487,17 +486,19 @@ class WebappStartupTest(PerfTest):
         logcat_prefix = '(\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3})'
         chrome_prefix = '..GeckoBrowser.*: zerdatime .* - browser chrome startup finished.'
         webapp_prefix = '..GeckoConsole.*WEBAPP STARTUP COMPLETE'
-        re_base_time = re.compile('%s' % logcat_prefix)
-        re_gecko_time = re.compile('%s .*([Gg]ecko)' % logcat_prefix)
-        re_start_time = re.compile(
+        events = LogcatEvents(self.logcat, self.loggerdeco)
+        events.add_event('base_time', logcat_prefix, first_only=True)
+        events.add_event('gecko_time', '%s .*([Gg]ecko)' % logcat_prefix)
+        events.add_event(
+            'start_time',
             '%s .*('
             'Start proc .*%s.* for activity %s|'
             'Fennec application start)' % (
                 logcat_prefix, self.webappstartup_name, self.webappstartup_name))
-        re_chrome_time = re.compile('%s %s' %
-                                    (logcat_prefix, chrome_prefix))
-        re_startup_time = re.compile('%s %s' %
-                                     (logcat_prefix, webapp_prefix))
+        events.add_event('chrome_time', '%s %s' %
+                         (logcat_prefix, chrome_prefix))
+        events.add_event('startup_time', '%s %s' %
+                         (logcat_prefix, webapp_prefix))
 
         base_time = 0
         start_time = 0
@@ -506,143 +507,98 @@ class WebappStartupTest(PerfTest):
         start_time_reason = ''
         fennec_start = 'Fennec application start'
 
-        attempt = 1
         max_time = 90 # maximum time to wait for WEBAPP STARTUP COMPLETE
-        wait_time = 3 # time to wait between attempts
-        max_attempts = max_time / wait_time
-
-        while attempt <= max_attempts and startup_time == 0:
-            buf = self.logcat.get()
-            for line in buf:
-                self.loggerdeco.debug('analyze_logcat: %s' % line)
-                match = re_base_time.match(line)
-                if match and not base_time:
-                    base_time = match.group(1)
-                    self.loggerdeco.info('analyze_logcat: base_time: %s' %
-                                         base_time)
-                # We want the Fennec application start message, or the
-                # Start proc message or the first gecko related
-                # message in order to determine the start_time which
-                # will be used to convert the absolute time values
-                # into values relative to the start of fennec.  See
-                # https://bugzilla.mozilla.org/show_bug.cgi?id=1214810
-                if not start_time:
-                    match = re_gecko_time.match(line)
-                    if match:
-                        start_time = match.group(1)
-                        start_time_reason = match.group(2)
-                        self.loggerdeco.info(
-                            'analyze_logcat: new start_time: %s %s' %
-                            (start_time, start_time_reason))
-                match = re_start_time.match(line)
-                if match:
-                    group1 = match.group(1)
-                    group2 = match.group(2)
-                    if not start_time:
-                        start_time = group1
-                        start_time_reason = group2
-                        self.loggerdeco.info(
-                            'analyze_logcat: new start_time: %s %s' %
-                            (start_time, start_time_reason))
-                    elif (fennec_start in group2 and
-                          fennec_start not in start_time_reason):
-                        # Webapps emit two fennec_start messages. Only
-                        # use the first.
-                        start_time = group1
-                        start_time_reason = group2
-                        self.loggerdeco.info(
-                            'analyze_logcat: updated start_time: %s %s' %
-                            (start_time, start_time_reason))
-                    elif (fennec_start not in start_time_reason and
-                          group2.startswith('Start proc')):
-                        start_time = group1
-                        start_time_reason = group2
-                        self.loggerdeco.info(
-                            'analyze_logcat: updated start_time: %s %s' %
-                            (start_time, start_time_reason))
-                    else:
-                        self.loggerdeco.info(
-                            'analyze_logcat: ignoring start_time: %s %s' %
-                            (group1, group2))
-                    continue
-                # We want the first chrome time and WEBAPP STARTUP
-                # COMPLETE after the start_time.
-                match = re_chrome_time.match(line)
-                if match:
-                    if chrome_time:
-                        self.loggerdeco.warning(
-                            'analyze_logcat: chrome_time: %s '
-                            'missing startup_time. Resetting '
-                            'throbber_start_time.' % chrome_time)
-                    chrome_time = match.group(1)
-                    self.loggerdeco.info('analyze_logcat: chrome_time: %s' %
-                                         chrome_time)
-                    continue
-                match = re_startup_time.match(line)
-                if match and not startup_time:
-                    startup_time = match.group(1)
-                    self.loggerdeco.info('analyze_logcat: startup_time: %s' %
-                                         startup_time)
-                    continue
-                if start_time and startup_time:
-                    break
+
+        if not events.wait_for_events(['startup_time'], max_time,
+                                      abort=lambda: self.fennec_crashed):
             if self.fennec_crashed:
                 # If fennec crashed, don't bother looking for the Throbbers
                 self.loggerdeco.warning('analyze_logcat: fennec crashed.')
+
+        for line, matches in events.matches:
+            if 'base_time' in matches and not base_time:
+                base_time = matches['base_time'][0]
+                self.loggerdeco.info('analyze_logcat: base_time: %s' %
+                                     base_time)
+            # We want the Fennec application start message, or the
+            # Start proc message or the first gecko related
+            # message in order to determine the start_time which
+            # will be used to convert the absolute time values
+            # into values relative to the start of fennec.  See
+            # https://bugzilla.mozilla.org/show_bug.cgi?id=1214810
+            if not start_time and 'gecko_time' in matches:
+                start_time, start_time_reason = matches['gecko_time']
+                self.loggerdeco.info(
+                    'analyze_logcat: new start_time: %s %s' %
+                    (start_time, start_time_reason))
+            if 'start_time' in matches:
+                group1, group2 = matches['start_time']
+                if not start_time:
+                    start_time = group1
+                    start_time_reason = group2
+                    self.loggerdeco.info(
+                        'analyze_logcat: new start_time: %s %s' %
+                        (start_time, start_time_reason))
+                elif (fennec_start in group2 and
+                      fennec_start not in start_time_reason):
+                    # Webapps emit two fennec_start messages. Only
+                    # use the first.
+                    start_time = group1
+                    start_time_reason = group2
+                    self.loggerdeco.info(
+                        'analyze_logcat: updated start_time: %s %s' %
+                        (start_time, start_time_reason))
+                elif (fennec_start not in start_time_reason and
+                      group2.startswith('Start proc')):
+                    start_time = group1
+                    start_time_reason = group2
+                    self.loggerdeco.info(
+                        'analyze_logcat: updated start_time: %s %s' %
+                        (start_time, start_time_reason))
+                else:
+                    self.loggerdeco.info(
+                        'analyze_logcat: ignoring start_time: %s %s' %
+                        (group1, group2))
+                continue
+            # We want the first chrome time and WEBAPP STARTUP
+            # COMPLETE after the start_time.
+            if 'chrome_time' in matches:
+                if chrome_time:
+                    self.loggerdeco.warning(
+                        'analyze_logcat: chrome_time: %s '
+                        'missing startup_time. Resetting '
+                        'throbber_start_time.' % chrome_time)
+                chrome_time = matches['chrome_time'][0]
+                self.loggerdeco.info('analyze_logcat: chrome_time: %s' %
+                                     chrome_time)
+                continue
+            if 'startup_time' in matches and not startup_time:
+                startup_time = matches['startup_time'][0]
+                self.loggerdeco.info('analyze_logcat: startup_time: %s' %
+                                     startup_time)
+                continue
+            if start_time and startup_time:
                 break
-            if start_time == 0 or chrome_time == 0 or startup_time == 0:
-                sleep(wait_time)
-                attempt += 1
         if chrome_time and startup_time == 0:
             self.loggerdeco.warning('Unable to find WEBAPP STARTUP COMPLETE')
 
         # The captured time from the logcat lines is in the format
         # MM-DD HH:MM:SS.mmm. It is possible for the year to change
-        # between the different times, so we need to make adjustments
-        # if necessary. First, we assume the year does not change and
-        # parse the dates as if they are in the current year. If
-        # the dates violate the natural order start_time,
-        # throbber_start_time, throbber_stop_time, we can adjust the
-        # year.
+        # between the different times. LogcatTimeParser assigns each
+        # time the year which places it closest to the current time
+        # so that the times remain in order across a new year.
 
         if base_time and start_time and chrome_time and startup_time:
-            parse = lambda y, t: datetime.datetime.strptime('%4d-%s' % (y, t), '%Y-%m-%d %H:%M:%S.%f')
-            year = datetime.datetime.now().year
-            base_time = parse(year, base_time)
-            start_time = parse(year, start_time)
-            chrome_time = parse(year, chrome_time)
-            startup_time = parse(year, startup_time)
-
-            self.loggerdeco.debug('analyze_logcat: before year adjustment '
-                                  'base: %s, start: %s, '
-                                  'chrome time: %s '
-                                  'startup time: %s' %
-                                  (base_time, start_time,
-                                   chrome_time, startup_time))
-
-            if base_time > start_time:
-                base_time.replace(year=year-1)
-            elif start_time > chrome_time:
-                base_time.replace(year=year-1)
-                start_time.replace(year=year-1)
-            elif chrome_time > startup_time:
-                base_time.replace(year=year-1)
-                start_time.replace(year=year-1)
-                chrome_time.replace(year=year-1)
-
-            self.loggerdeco.debug('analyze_logcat: after year adjustment '
-                                  'base: %s, start: %s, '
-                                  'chrome time: %s '
-                                  'startup time: %s' %
-                                  (base_time, start_time,
-                                   chrome_time, startup_time))
+            parse = LogcatTimeParser().parse
+            base_time = parse(base_time)
+            start_time = parse(start_time)
+            chrome_time = parse(chrome_time)
+            startup_time = parse(startup_time)
 
             # Convert the times to milliseconds from the base time.
-            convert = lambda t1, t2: round((t2 - t1).total_seconds() * 1000.0)
-
-            start_time = convert(base_time, start_time)
-            chrome_time = convert(base_time, chrome_time)
-            startup_time = convert(base_time, startup_time)
+            start_time = start_time - base_time
+            chrome_time = chrome_time - base_time
+            startup_time = startup_time - base_time
 
             self.loggerdeco.debug('analyze_logcat: base: %s, start: %s, '
                                   'chrome time: %s, startup_time: %s ' %
@@ -0,0 +1,188 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import contextlib
+import errno
+import multiprocessing
+import os
+import time
+
+
+class TransferScheduler(object):
+    """Limits the number of concurrent bulk adb transfers, such as
+    pushes, pulls and installs, made by all of the processes on the
+    host.
+
+    The scheduler must be created in the main process before the
+    worker processes are started so that its shared state is
+    inherited by them. Waiting transfers are granted in order of
+    priority, higher first, then in the order they were requested.
+    Slots held or requested by processes which have exited are
+    reclaimed.
+
+    ::
+
+        scheduler = TransferScheduler(4)
+        ...
+        with scheduler.transfer(priority=1) as delay:
+            dm.push(local, remote)
+    """
+
+    # Interval in seconds at which waiting processes check for slots
+    # held by processes which have exited.
+    REAP_INTERVAL = 5
+
+    def __init__(self, max_transfers, max_waiters=256):
+        """
+        :param max_transfers: maximum number of concurrent transfers.
+        :param max_waiters: maximum number of concurrently waiting
+            transfers. Additional transfers wait for a free entry.
+        """
+        self.max_transfers = max_transfers
+        self._cond = multiprocessing.Condition()
+        # Process ids and tickets of the transfers in progress. A
+        # process id of 0 marks a free entry.
+        self._holder_pids = multiprocessing.Array('i', max_transfers,
+                                                  lock=False)
+        self._holder_tickets = multiprocessing.Array('l', max_transfers,
+                                                     lock=False)
+        # Process ids, priorities and tickets of the waiting transfers.
+        self._waiter_pids = multiprocessing.Array('i', max_waiters,
+                                                  lock=False)
+        self._waiter_priorities = multiprocessing.Array('i', max_waiters,
+                                                        lock=False)
+        self._waiter_tickets = multiprocessing.Array('l', max_waiters,
+                                                     lock=False)
+        self._next_ticket = multiprocessing.Value('l', 1, lock=False)
+        self._transfers = multiprocessing.Value('l', 0, lock=False)
+        self._total_delay = multiprocessing.Value('d', 0, lock=False)
+        self._max_delay = multiprocessing.Value('d', 0, lock=False)
+
+    def _is_alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError, e:
+            return e.errno != errno.ESRCH
+        return True
+
+    def _reap(self):
+        reaped = False
+        for pids in (self._holder_pids, self._waiter_pids):
+            for i in range(len(pids)):
+                if pids[i] and not self._is_alive(pids[i]):
+                    pids[i] = 0
+                    reaped = True
+        if reaped:
+            self._cond.notify_all()
+
+    def _free_holder(self):
+        for i in range(self.max_transfers):
+            if not self._holder_pids[i]:
+                return i
+        return None
+
+    def _is_next(self, slot):
+        priority = self._waiter_priorities[slot]
+        ticket = self._waiter_tickets[slot]
+        for i in range(len(self._waiter_pids)):
+            if i == slot or not self._waiter_pids[i]:
+                continue
+            if (self._waiter_priorities[i] > priority or
+                (self._waiter_priorities[i] == priority and
+                 self._waiter_tickets[i] < ticket)):
+                return False
+        return True
+
+    def acquire(self, priority=0):
+        """Waits until a transfer may start.
+
+        :param priority: integer priority of the transfer. Transfers
+            with higher priorities are started first.
+        :returns: tuple of the transfer's ticket which must be passed
+            to release() and the seconds spent waiting.
+        """
+        start_time = time.time()
+        pid = os.getpid()
+        with self._cond:
+            ticket = self._next_ticket.value
+            self._next_ticket.value += 1
+            while True:
+                slots = [i for i in range(len(self._waiter_pids))
+                         if not self._waiter_pids[i]]
+                if slots:
+                    slot = slots[0]
+                    break
+                self._cond.wait(self.REAP_INTERVAL)
+                self._reap()
+            self._waiter_pids[slot] = pid
+            self._waiter_priorities[slot] = priority
+            self._waiter_tickets[slot] = ticket
+            try:
+                while True:
+                    holder = self._free_holder()
+                    if holder is not None and self._is_next(slot):
+                        break
+                    self._cond.wait(self.REAP_INTERVAL)
+                    self._reap()
+            finally:
+                self._waiter_pids[slot] = 0
+            self._holder_pids[holder] = pid
+            self._holder_tickets[holder] = ticket
+            delay = time.time() - start_time
+            self._transfers.value += 1
+            self._total_delay.value += delay
+            self._max_delay.value = max(self._max_delay.value, delay)
+            # Other waiters may now be next.
+            self._cond.notify_all()
+        return ticket, delay
+
+    def release(self, ticket):
+        """Ends a transfer.
+
+        :param ticket: the ticket returned by acquire().
+        """
+        with self._cond:
+            for i in range(self.max_transfers):
+                if self._holder_tickets[i] == ticket:
+                    self._holder_pids[i] = 0
+                    self._holder_tickets[i] = 0
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def transfer(self, priority=0):
+        """Context manager which holds a transfer slot while its
+        block runs. The seconds spent waiting for the slot are bound
+        by the as clause.
+
+        :param priority: integer priority of the transfer.
+        """
+        ticket, delay = self.acquire(priority)
+        try:
+            yield delay
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        """Returns a dict of the number of transfers in progress and
+        waiting, and the number of transfers started along with their
+        total and maximum queueing delays in seconds."""
+        with self._cond:
+            return {
+                'active': len([pid for pid in self._holder_pids if pid]),
+                'waiting': len([pid for pid in self._waiter_pids if pid]),
+                'transfers': self._transfers.value,
+                'total_delay': self._total_delay.value,
+                'max_delay': self._max_delay.value,
+            }
+
+    def __str__(self):
+        stats = self.stats()
+        if stats['transfers']:
+            average = stats['total_delay'] / stats['transfers']
+        else:
+            average = 0
+        return ('transfers: active %d/%d, waiting %d, started %d, '
+                'average delay %.1fs, max delay %.1fs' % (
+                    stats['active'], self.max_transfers, stats['waiting'],
+                    stats['transfers'], average, stats['max_delay']))
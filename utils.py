@@ -4,6 +4,7 @@
 
 # get_remote_content modelled on treeherder/etc/common.py
 
+import hashlib
 import httplib
 import json
 import logging
@@ -154,6 +155,32 @@ def generate_guid():
     return str(uuid.uuid4())
 
 
+# Cache of file digests keyed on (path, size, mtime, algorithm).
+_file_digests = {}
+
+def file_digest(path, algorithm='sha1'):
+    """Returns the hex digest of the contents of the file at
+    path. Digests are cached until the file's size or modification
+    time changes.
+
+    :param path: path of the file.
+    :param algorithm: name of a hashlib algorithm.
+    """
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime, algorithm)
+    digest = _file_digests.get(key)
+    if digest is None:
+        h = hashlib.new(algorithm)
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(64 * 1024)
+                if not data:
+                    break
+                h.update(data)
+        digest = _file_digests[key] = h.hexdigest()
+    return digest
+
+
 # These computational functions are taken from Talos:filter.py
 def median(series):
     """
@@ -5,6 +5,7 @@
 from __future__ import with_statement
 
 import Queue
+import collections
 import datetime
 import logging
 import logging.handlers
@@ -41,6 +42,10 @@ from sensitivedatafilter import SensitiveDataFilter
 # used in a child process.
 logger = logging.getLogger()
 
+# Name of the file in the device's test root which records the
+# fingerprint of the installed build.
+INSTALLED_BUILD_FILE = 'installed-build'
+
 class Crashes(object):
 
     CRASH_WINDOW = 30
@@ -60,14 +65,101 @@ class Crashes(object):
         return len(self.crash_times) >= self.crash_limit
 
 
+class RebootPolicy(object):
+    """Decides whether a device is rebooted after the previous builds
+    have been uninstalled and tracks the time spent rebooting it.
+
+    The device is rebooted before a job if any of the enabled rules
+    apply:
+
+    * every_jobs: at least every_jobs jobs have been installed since
+      the last reboot. 1 reboots before every job. 0 disables the rule.
+    * every_minutes: at least every_minutes minutes have elapsed since
+      the last reboot. 0 disables the rule.
+    * on_failure: a crash or failed health check has occurred since the
+      last reboot.
+    * before_perf_tests: the job contains performance tests.
+    """
+
+    def __init__(self, every_jobs=1, every_minutes=0, on_failure=True,
+                 before_perf_tests=False):
+        self.every_jobs = every_jobs
+        self.every_minutes = every_minutes
+        self.on_failure = on_failure
+        self.before_perf_tests = before_perf_tests
+        # The number of jobs installed since the last reboot. The state
+        # of the device is not known when the worker starts, so the
+        # first job is due for a reboot if every_jobs is enabled.
+        self.jobs = every_jobs
+        self.failures = []
+        self.last_reboot = datetime.datetime.now()
+        self.reboots = 0
+        self.reboot_time = datetime.timedelta()
+        self.skipped = 0
+
+    def get_reason(self, tests):
+        """Returns the reason the device should be rebooted before
+        running tests or None if it should not be rebooted.
+
+        :param tests: list of the job's PhoneTest objects.
+        """
+        if self.every_jobs and self.jobs >= self.every_jobs:
+            return 'every %d jobs' % self.every_jobs
+        if (self.every_minutes and
+            datetime.datetime.now() - self.last_reboot >=
+            datetime.timedelta(minutes=self.every_minutes)):
+            return 'every %d minutes' % self.every_minutes
+        if self.on_failure and self.failures:
+            return 'after %s' % ', '.join(self.failures)
+        if self.before_perf_tests and [t for t in tests if t.perf_test]:
+            return 'before performance tests'
+        return None
+
+    def add_job(self):
+        self.jobs += 1
+
+    def add_failure(self, reason):
+        self.failures.append(reason)
+
+    def add_reboot(self, elapsed):
+        """Records a reboot which took elapsed time.
+
+        :param elapsed: datetime.timedelta.
+        """
+        self.jobs = 0
+        self.failures = []
+        self.last_reboot = datetime.datetime.now()
+        self.reboots += 1
+        self.reboot_time += elapsed
+
+    def add_skipped(self):
+        self.skipped += 1
+
+    def __str__(self):
+        if self.reboots:
+            average = self.reboot_time / self.reboots
+        else:
+            average = datetime.timedelta()
+        return ('reboots: %d, time rebooting: %s, average reboot: %s, '
+                'reboots skipped: %d, estimated time saved: %s' % (
+                    self.reboots, self.reboot_time, average, self.skipped,
+                    average * self.skipped))
+
+
 class PhoneTestMessage(object):
 
     def __init__(self, phone, build=None, phone_status=None,
-                 message=None):
+                 message=None, adb_stats=None, sql_stats=None):
         self.phone = phone
         self.build = build
         self.phone_status = phone_status
         self.message = message
+        # Copy of the worker's adb.ADBCommandStats, sent periodically
+        # with heartbeats.
+        self.adb_stats = adb_stats
+        # Copy of the statement statistics of the worker's jobs
+        # database connections, sent with the adb statistics.
+        self.sql_stats = sql_stats
         self.timestamp = datetime.datetime.now().replace(microsecond=0)
 
     def __str__(self):
@@ -99,10 +191,11 @@ class PhoneWorker(object):
     PHONE_MAX_REBOOTS = 3
     PHONE_PING_INTERVAL = 15*60
     PHONE_COMMAND_QUEUE_TIMEOUT = 10
+    ADB_STATS_INTERVAL = 60
 
     def __init__(self, dm, worker_num, tests, phone, options,
                  autophone_queue, logfile_prefix, loglevel, mailer,
-                 shared_lock):
+                 shared_lock, job_notifier=None):
 
         self.state = ProcessStates.STARTING
         self.tests = tests
@@ -113,6 +206,8 @@ class PhoneWorker(object):
         self.last_status_msg = None
         self.first_status_of_type = None
         self.last_status_of_previous_type = None
+        self.adb_stats = None
+        self.sql_stats = None
         self.crashes = Crashes(crash_window=options.phone_crash_window,
                                crash_limit=options.phone_crash_limit)
         # Messages are passed to the PhoneWorkerSubProcess worker from
@@ -123,6 +218,8 @@ class PhoneWorker(object):
         self.queue = multiprocessing.Queue()
         self.lock = multiprocessing.Lock()
         self.shared_lock = shared_lock
+        if job_notifier:
+            job_notifier.add_device(phone.id, self.queue)
         self.subprocess = PhoneWorkerSubProcess(dm,
                                                 self.worker_num,
                                                 tests,
@@ -130,7 +227,7 @@ class PhoneWorker(object):
                                                 autophone_queue,
                                                 self.queue, logfile_prefix,
                                                 loglevel, mailer,
-                                                shared_lock)
+                                                shared_lock, job_notifier)
         self.loggerdeco = LogDecorator(logger,
                                        {'phoneid': self.phone.id},
                                        '%(phoneid)s|%(message)s')
@@ -139,6 +236,17 @@ class PhoneWorker(object):
     def is_alive(self):
         return self.subprocess.is_alive()
 
+    def adbstats(self):
+        response = 'phone %s (%s):\n' % (self.phone.id, self.phone.serial)
+        if not self.adb_stats:
+            response += '  no adb statistics received\n'
+            return response
+        response += '  since %s\n' % datetime.datetime.fromtimestamp(
+            self.adb_stats.start_time).replace(microsecond=0)
+        for line in str(self.adb_stats).splitlines():
+            response += '  %s\n' % line
+        return response
+
     def start(self, phone_status=PhoneStatus.IDLE):
         self.loggerdeco.debug('PhoneWorker:start')
         self.state = ProcessStates.RUNNING
@@ -164,10 +272,6 @@ class PhoneWorker(object):
         self.state = ProcessStates.RESTARTING
         self.queue.put_nowait(('shutdown', None))
 
-    def new_job(self):
-        self.loggerdeco.debug('PhoneWorker:new_job')
-        self.queue.put_nowait(('job', None))
-
     def reboot(self):
         self.loggerdeco.debug('PhoneWorker:reboot')
         self.queue.put_nowait(('reboot', None))
@@ -188,10 +292,18 @@ class PhoneWorker(object):
         self.loggerdeco.debug('PhoneWorker:ping')
         self.queue.put_nowait(('ping', None))
 
+    def reprobe(self):
+        self.loggerdeco.debug('PhoneWorker:reprobe')
+        self.queue.put_nowait(('reprobe', None))
+
     def process_msg(self, msg):
         """These are status messages routed back from the autophone_queue
         listener in the main AutoPhone class. There is probably a bit
         clearer way to do this..."""
+        if msg.adb_stats:
+            self.adb_stats = msg.adb_stats
+        if msg.sql_stats:
+            self.sql_stats = msg.sql_stats
         if (not self.last_status_msg or
             msg.phone_status != self.last_status_msg.phone_status):
             self.last_status_of_previous_type = self.last_status_msg
@@ -230,6 +342,8 @@ class PhoneWorker(object):
                 response += '  previous state %s ago:\n    %s\n' % (
                     now - self.last_status_of_previous_type.timestamp,
                     self.last_status_of_previous_type.short_desc())
+        if self.sql_stats:
+            response += '  %s\n' % jobs.Jobs.format_sql_stats(self.sql_stats)
         return response
 
 class PhoneWorkerSubProcess(object):
@@ -244,7 +358,7 @@ class PhoneWorkerSubProcess(object):
 
     def __init__(self, dm, worker_num, tests, phone, options,
                  autophone_queue, queue, logfile_prefix, loglevel, mailer,
-                 shared_lock):
+                 shared_lock, job_notifier=None):
         global logger
 
         self.state = ProcessStates.RUNNING
@@ -266,14 +380,21 @@ class PhoneWorkerSubProcess(object):
         self.loglevel = loglevel
         self.mailer = mailer
         self.shared_lock = shared_lock
+        self.job_notifier = job_notifier
         self.p = None
         self.jobs = None
         self.build = None
         self.last_ping = None
+        self.adb_stats_time = 0
         self.phone_status = None
         self.filehandler = None
         self.s3_bucket = None
         self.treeherder = None
+        self.reboot_policy = RebootPolicy(
+            every_jobs=options.reboot_every_jobs,
+            every_minutes=options.reboot_every_minutes,
+            on_failure=options.reboot_on_failure,
+            before_perf_tests=options.reboot_before_perf_tests)
 
     def is_alive(self):
         """Call from main process."""
@@ -327,12 +448,14 @@ class PhoneWorkerSubProcess(object):
         return self.phone_status == PhoneStatus.DISABLED
 
     def update_status(self, build=None, phone_status=None,
-                      message=None):
+                      message=None, adb_stats=None, sql_stats=None):
         if phone_status:
             self.phone_status = phone_status
         phone_message = PhoneTestMessage(self.phone, build=build,
                                          phone_status=self.phone_status,
-                                         message=message)
+                                         message=message,
+                                         adb_stats=adb_stats,
+                                         sql_stats=sql_stats)
         if message != 'Heartbeat':
             self.loggerdeco.info(str(phone_message))
         try:
@@ -341,36 +464,87 @@ class PhoneWorkerSubProcess(object):
             self.loggerdeco.warning('Autophone queue is full!')
 
     def heartbeat(self):
-        self.update_status(message='Heartbeat')
-
-    def _check_path(self, path):
-        self.loggerdeco.debug('Checking path %s.' % path)
-        success = True
+        # Send the adb command and jobs database statistics to the
+        # main process at most once every ADB_STATS_INTERVAL seconds.
+        adb_stats = None
+        sql_stats = None
+        now = time.time()
+        if now - self.adb_stats_time >= PhoneWorker.ADB_STATS_INTERVAL:
+            adb_stats = self.dm.command_stats.copy()
+            if self.jobs:
+                sql_stats = self.jobs.copy_sql_stats()
+            self.adb_stats_time = now
+        self.update_status(message='Heartbeat', adb_stats=adb_stats,
+                           sql_stats=sql_stats)
+
+    def _check_paths(self, paths):
+        """Checks that a directory can be created in each of the paths
+        and that a file can be pushed to it. The directories for all
+        of the paths are created and removed using a single adb shell
+        invocation each. Returns the list of the paths which failed
+        the check."""
+        self.loggerdeco.debug('Checking paths %s.' % paths)
+        paths = list(collections.OrderedDict.fromkeys(paths))
+        failed = set()
         try:
-            d = posixpath.join(path, 'autophone_check_path')
-            self.dm.rm(d, recursive=True, force=True, root=True)
-            self.dm.mkdir(d, parents=True, root=True)
-            self.dm.chmod(d, recursive=True, root=True)
+            dirs = [posixpath.join(p, 'autophone_check_path')
+                    for p in paths]
+            cmds = []
+            for d in dirs:
+                cmds.extend(['rm -r %s' % d, 'mkdir %s' % d, 'chmod 777 %s' % d])
+            results = self.dm.shell_batch(cmds, root=True)
+            # The result of removing a directory left over from a
+            # previous check is ignored.
+            for i, (output, exitcode) in enumerate(results):
+                if i % 3 and exitcode != 0:
+                    self.loggerdeco.error('Checking path %s: %s: %s' % (
+                        paths[i / 3], cmds[i], output))
+                    failed.add(paths[i / 3])
             with tempfile.NamedTemporaryFile() as tmp:
                 tmp.write('autophone test\n')
                 tmp.flush()
-                self.dm.push(tmp.name,
-                             posixpath.join(d, 'path_check'))
-            self.dm.rm(d, recursive=True, root=True)
+                for path, d in zip(paths, dirs):
+                    if path in failed:
+                        continue
+                    try:
+                        self.dm.push(tmp.name,
+                                     posixpath.join(d, 'path_check'))
+                    except (ADBError, ADBTimeoutError):
+                        self.loggerdeco.exception(
+                            'Exception while checking path %s' % path)
+                        failed.add(path)
+            cmds = ['rm -r %s' % d for d in dirs]
+            results = self.dm.shell_batch(cmds, root=True)
+            for path, cmd, (output, exitcode) in zip(paths, cmds, results):
+                if exitcode != 0 and path not in failed:
+                    self.loggerdeco.error('Checking path %s: %s: %s' % (
+                        path, cmd, output))
+                    failed.add(path)
         except (ADBError, ADBTimeoutError):
-            self.loggerdeco.exception('Exception while checking path %s' % path)
-            success = False
-        return success
+            self.loggerdeco.exception('Exception while checking paths %s' %
+                                      paths)
+            return paths
+        return [path for path in paths if path in failed]
 
     def reboot(self):
         self.loggerdeco.debug('PhoneWorkerSubProcess:reboot')
         self.update_status(phone_status=PhoneStatus.REBOOTING)
-        self.dm.reboot()
+        self._reboot_device()
         # Setting svc power stayon true after rebooting is necessary
         # since the setting does not survice reboots.
         self.dm.power_on()
         self.ping()
 
+    def _reboot_device(self):
+        """Reboots the device recording the time taken in the reboot
+        policy."""
+        start_time = datetime.datetime.now()
+        try:
+            self.dm.reboot()
+        finally:
+            self.reboot_policy.add_reboot(datetime.datetime.now() - start_time)
+            self.loggerdeco.info('Reboot policy: %s' % self.reboot_policy)
+
     def disable_phone(self, errmsg, send_email=True):
         """Completely disable phone. No further attempts to recover it will
         be performed unless initiated by the user."""
@@ -413,13 +587,14 @@ class PhoneWorkerSubProcess(object):
                     msg = 'Attempt: %d, SELinux is not permissive' % attempt
                     phone_status = PhoneStatus.ERROR
                     self.dm.shell_output("setenforce Permissive", root=True)
-                elif not self._check_path('/data/local/tmp'):
-                    msg = 'Attempt: %d, ping path: %s' % (attempt, '/data/local/tmp')
-                    phone_status = PhoneStatus.ERROR
-                elif not self._check_path(self.dm.test_root):
-                    msg = 'Attempt: %d, ping path: %s' % (attempt, self.dm.test_root)
-                    phone_status = PhoneStatus.ERROR
-                elif require_ip_address:
+                else:
+                    failed_paths = self._check_paths(['/data/local/tmp',
+                                                      self.dm.test_root])
+                    if failed_paths:
+                        msg = 'Attempt: %d, ping path: %s' % (
+                            attempt, ', '.join(failed_paths))
+                        phone_status = PhoneStatus.ERROR
+                if phone_status == PhoneStatus.OK and require_ip_address:
                     try:
                         ip_address = self.dm.get_ip_address()
                     except (ADBError, ADBTimeoutError):
@@ -469,7 +644,7 @@ class PhoneWorkerSubProcess(object):
                 # Only reboot if the previous state was ok.
                 self.loggerdeco.warning('Rebooting due to ping failure.')
                 try:
-                    self.dm.reboot()
+                    self._reboot_device()
                 except (ADBError, ADBTimeoutError):
                     msg2 = 'Exception rebooting device: %s' % traceback.format_exc()
                     self.loggerdeco.warning(msg2)
@@ -480,6 +655,9 @@ class PhoneWorkerSubProcess(object):
         else:
             test_msg = ''
 
+        if phone_status != PhoneStatus.OK:
+            self.reboot_policy.add_failure('ping %s' % phone_status)
+
         if self.is_disabled():
             self.heartbeat()
         elif phone_status == PhoneStatus.ERROR:
@@ -557,6 +735,69 @@ class PhoneWorkerSubProcess(object):
                 test.test_result.status = PhoneTestResult.USERCANCEL
         self.jobs.cancel_test(test_guid, device=self.phone.id)
 
+    def _get_build_fingerprint(self):
+        """Returns the fingerprint of the job's build which is
+        recorded on the device once the build has been installed: the
+        sha256 digest of the apk followed by the package name."""
+        return '%s %s' % (
+            utils.file_digest(os.path.join(self.build.dir, 'build.apk'),
+                              'sha256'),
+            self.build.app_name)
+
+    def _get_installed_build_state(self):
+        """Returns a tuple of the recorded installed build fingerprint
+        or None, the list of installed packages and the package's
+        lastUpdateTime or None, collected using a single adb shell."""
+        path = posixpath.join(self.dm.test_root, INSTALLED_BUILD_FILE)
+        results = self.dm.shell_batch(
+            ['cat %s' % path,
+             'pm list package',
+             'dumpsys package %s' % self.build.app_name])
+        recorded, exitcode = results[0]
+        if exitcode != 0:
+            recorded = None
+        packages = [line.replace('package:', '').strip()
+                    for line in results[1][0].splitlines()
+                    if line.startswith('package:')]
+        update_time = None
+        for line in results[2][0].splitlines():
+            line = line.strip()
+            if line.startswith('lastUpdateTime='):
+                update_time = line[len('lastUpdateTime='):]
+                break
+        return recorded, packages, update_time
+
+    def is_build_installed(self):
+        """Returns True if the job's build is already installed.
+
+        The build is considered installed if the fingerprint recorded
+        on the device by install_build matches the build and the
+        package's lastUpdateTime, and the build's package is the only
+        Mozilla package installed. The state is read from the device
+        each time so that it is revalidated after reboots, crashes
+        and installations made outside of autophone.
+        """
+        recorded, packages, update_time = self._get_installed_build_state()
+        if not recorded or not update_time:
+            return False
+        if recorded != '%s %s' % (self._get_build_fingerprint(), update_time):
+            return False
+        mozilla_packages = [p for p in packages
+                            if re.match('org\.mozilla\..*(fennec|firefox)', p)]
+        return (mozilla_packages == [self.build.app_name] and
+                FLASH_PACKAGE not in packages)
+
+    def record_installed_build(self):
+        """Records the fingerprint of the job's build on the device."""
+        recorded, packages, update_time = self._get_installed_build_state()
+        if not update_time:
+            self.loggerdeco.warning('Unable to determine lastUpdateTime of %s'
+                                    % self.build.app_name)
+            return
+        path = posixpath.join(self.dm.test_root, INSTALLED_BUILD_FILE)
+        self.dm.shell_output("echo '%s %s' > %s" % (
+            self._get_build_fingerprint(), update_time, path))
+
     def install_build(self, job):
         ### Why are we retrying here? is it helpful at all?
         """Install the build for this job.
@@ -569,6 +810,20 @@ class PhoneWorkerSubProcess(object):
         self.loggerdeco.info('Installing build %s.' % self.build.id)
         # Record start time for the install so can track how long this takes.
         start_time = datetime.datetime.now()
+        if self.options.device_skip_identical_install:
+            try:
+                if self.is_build_installed():
+                    # Clear the app's data so that the tests start
+                    # from the same state as after a new install.
+                    self.dm.shell_output('pm clear %s' % self.build.app_name)
+                    self.loggerdeco.info('Build %s is already installed.' %
+                                         self.build.id)
+                    return {'success': True, 'message': ''}
+                self.dm.rm(posixpath.join(self.dm.test_root,
+                                          INSTALLED_BUILD_FILE),
+                           force=True)
+            except (ADBError, ADBTimeoutError):
+                self.loggerdeco.exception('Exception checking installed build')
         message = ''
         for attempt in range(1, self.options.phone_retry_limit+1):
             uninstalled = False
@@ -583,11 +838,16 @@ class PhoneWorkerSubProcess(object):
                     p.replace('package:', '') for p in
                     self.dm.shell_output("pm list package org.mozilla").split()
                     if re.match('package:.*(fennec|firefox)', p)]
-                for p in mozilla_packages:
-                    self.dm.uninstall_app(p)
-                if self.dm.is_app_installed(FLASH_PACKAGE):
-                    self.dm.uninstall_app(FLASH_PACKAGE)
-                self.reboot()
+                self.dm.uninstall_apps(mozilla_packages + [FLASH_PACKAGE])
+                reason = self.reboot_policy.get_reason(job['tests'])
+                if reason:
+                    self.loggerdeco.info('Rebooting %s.' % reason)
+                    self.reboot()
+                else:
+                    self.reboot_policy.add_skipped()
+                    self.loggerdeco.info('Skipping reboot. Reboot policy: %s' %
+                                         self.reboot_policy)
+                self.reboot_policy.add_job()
                 uninstalled = True
                 break
             except ADBError, e:
@@ -620,6 +880,8 @@ class PhoneWorkerSubProcess(object):
             try:
                 self.dm.install_app(os.path.join(self.build.dir,
                                                 'build.apk'))
+                if self.options.device_skip_identical_install:
+                    self.record_installed_build()
                 stop_time = datetime.datetime.now()
                 self.loggerdeco.info('Install build %s elapsed time: %s' % (
                     (job['build_url'], stop_time - start_time)))
@@ -663,6 +925,13 @@ class PhoneWorkerSubProcess(object):
             self.state == ProcessStates.SHUTTINGDOWN or
             self.is_disabled()):
             return False
+        # Give the installs and pushes of performance tests
+        # precedence in the host's transfer scheduler so that their
+        # measurements are not delayed by other devices' transfers.
+        if [t for t in job['tests'] if t.perf_test]:
+            self.dm.transfer_priority = 1
+        else:
+            self.dm.transfer_priority = 0
         install_status = self.install_build(job)
         if not install_status['success']:
             self.loggerdeco.info('Not running tests due to %s' % (
@@ -724,6 +993,8 @@ class PhoneWorkerSubProcess(object):
                                message, PhoneTestResult.EXCEPTION)
                 self.ping(test=t)
 
+            if t.test_result.status == PhoneTestResult.EXCEPTION:
+                self.reboot_policy.add_failure('exception during %s' % t.name)
             if (t.test_result.status != PhoneTestResult.USERCANCEL and
                 not is_test_completed and
                 job['attempts'] < jobs.Jobs.MAX_ATTEMPTS):
@@ -740,6 +1011,8 @@ class PhoneWorkerSubProcess(object):
                            t.name, traceback.format_exc()))
                 t.test_failure(t.name, 'TEST-UNEXPECTED-FAIL',
                                message, PhoneTestResult.EXCEPTION)
+            if t.crash_detected:
+                self.reboot_policy.add_failure('crash during %s' % t.name)
             # Remove this test from the jobs database whether or not it
             # ran successfully.
             self.jobs.test_completed(test_job_guid)
@@ -771,7 +1044,9 @@ class PhoneWorkerSubProcess(object):
                                                tests=[t])
 
         try:
-            if self.is_ok():
+            # Leave the build installed if it may be reused by the
+            # next job. install_build uninstalls it otherwise.
+            if self.is_ok() and not self.options.device_skip_identical_install:
                 self.dm.uninstall_app(self.build.app_name)
         except:
             self.loggerdeco.exception('device error during '
@@ -860,10 +1135,10 @@ class PhoneWorkerSubProcess(object):
             self.loggerdeco.info('Shutting down at user\'s request...')
             self.state = ProcessStates.SHUTTINGDOWN
         elif request[0] == 'job':
-            # This is just a notification that breaks us from waiting on the
-            # command queue; it's not essential, since jobs are stored in
-            # a db, but it allows the worker to react quickly to a request if
-            # it isn't doing anything else.
+            # This is just a notification from the job notifier that
+            # breaks us from waiting on the command queue so that the
+            # worker reacts quickly to a new job if it isn't doing
+            # anything else.
             self.loggerdeco.debug('Received job command request...')
         elif request[0] == 'reboot':
             self.loggerdeco.info("Rebooting at user's request...")
@@ -892,6 +1167,12 @@ class PhoneWorkerSubProcess(object):
         elif request[0] == 'ping':
             self.loggerdeco.info("Pinging at user's request...")
             self.ping()
+        elif request[0] == 'reprobe':
+            self.loggerdeco.info("Probing capabilities at user's request...")
+            try:
+                self.dm.probe_capabilities()
+            except (ADBError, ADBTimeoutError):
+                self.loggerdeco.exception('Exception probing capabilities')
         else:
             self.loggerdeco.debug('handle_cmd: Unknown request %s' % request[0])
         return command
@@ -925,6 +1206,9 @@ class PhoneWorkerSubProcess(object):
         # immediately available commands, then start the next job, if there is
         # one.  If neither a job nor a command is currently available,
         # block on the command queue for PhoneWorker.PHONE_COMMAND_QUEUE_TIMEOUT seconds.
+        # When jobs are added for the phone, the job notifier puts a
+        # job command on the queue which ends the wait, and until then
+        # get_next_job returns None without querying the database.
         request = None
         while True:
             while True:
@@ -1036,7 +1320,8 @@ class PhoneWorkerSubProcess(object):
 
         self.jobs = jobs.Jobs(self.mailer,
                               default_device=self.phone.id,
-                              allow_duplicates=self.options.allow_duplicate_jobs)
+                              allow_duplicates=self.options.allow_duplicate_jobs,
+                              notifier=self.job_notifier)
 
         self.loggerdeco.info('Worker: Connected.')
 
@@ -1059,5 +1344,8 @@ class PhoneWorkerSubProcess(object):
                                               shared_lock=self.shared_lock)
         self.update_status(phone_status=PhoneStatus.IDLE)
         self.ping()
-        self.main_loop()
+        try:
+            self.main_loop()
+        finally:
+            self.dm.stop_logcat_reader()
 